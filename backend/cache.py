@@ -0,0 +1,189 @@
+# backend/cache.py
+"""
+生成结果缓存：以规范化输入的哈希作为键。
+
+- Redis 保存索引（条目元数据 + 按最近访问时间排序的 zset）
+- 结果文件保存在 CACHE_DIR（默认 static/outputs/cache）下，可直接经 /outputs 访问
+- 淘汰策略：超过 CACHE_MAX_AGE 未访问的条目先删，总大小超过 CACHE_MAX_BYTES 时按 LRU 删除
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Optional
+
+from config import (
+    CACHE_DIR, CACHE_ENABLED, CACHE_MAX_AGE, CACHE_MAX_BYTES, OUTPUT_DIR,
+    IMAGE_MODEL_ID, VOICE_MODEL_ID, VIDEO_MODEL_ID,
+)
+
+INDEX_KEY = "cache:index"          # zset: cache_key -> 最近访问时间
+ENTRY_PREFIX = "cache:entry:"      # hash: path / url / size / created
+BYTES_KEY = "cache:bytes"          # 当前缓存总字节数
+STATS_KEY = "cache:stats"          # hash: <kind>:hits / <kind>:misses
+
+Path(CACHE_DIR).mkdir(parents=True, exist_ok=True)
+
+
+def _normalize(value):
+    if isinstance(value, str):
+        # 折叠空白，避免仅因换行/多余空格导致缓存未命中
+        return " ".join(value.split())
+    if isinstance(value, bytes):
+        return hashlib.sha256(value).hexdigest()
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_normalize(v) for v in value]
+    return value
+
+
+def file_digest(path: str) -> str:
+    """流式计算文件 sha256，用于参考音频等二进制输入"""
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def make_key(kind: str, **inputs) -> str:
+    payload = json.dumps(
+        {"kind": kind, **_normalize(inputs)},
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return f"{kind}_{hashlib.sha256(payload.encode('utf-8')).hexdigest()}"
+
+
+def image_key(text: str) -> str:
+    return make_key("img", text=text, model=IMAGE_MODEL_ID)
+
+
+def voice_key(text: str, voice_id: str) -> str:
+    # voice_id 本身就是参考音频的内容哈希
+    return make_key(
+        "voice",
+        text=text,
+        reference=voice_id,
+        model=VOICE_MODEL_ID,
+        format="wav",
+    )
+
+
+def video_key(image_url: str, audio_url: str, duration: int) -> str:
+    return make_key(
+        "video",
+        image_url=image_url,
+        audio_url=audio_url,
+        duration=duration,
+        model=VIDEO_MODEL_ID,
+    )
+
+
+def _url_for(path: Path) -> str:
+    return "/outputs/" + path.relative_to(OUTPUT_DIR).as_posix()
+
+
+def lookup(conn, key: str) -> Optional[str]:
+    """命中返回 result_url，未命中返回 None；同时更新命中/未命中计数"""
+    if not CACHE_ENABLED:
+        return None
+    kind = key.split("_", 1)[0]
+    entry = conn.hgetall(ENTRY_PREFIX + key)
+    if entry and not os.path.exists(entry[b"path"].decode()):
+        # 文件被外部删除，索引失效
+        _drop(conn, key, entry)
+        entry = None
+    if not entry:
+        conn.hincrby(STATS_KEY, f"{kind}:misses", 1)
+        return None
+
+    conn.zadd(INDEX_KEY, {key: time.time()})
+    conn.hincrby(STATS_KEY, f"{kind}:hits", 1)
+    return entry[b"url"].decode()
+
+
+def store(conn, key: str, src_path: str) -> Optional[str]:
+    """把任务输出登记进缓存，返回缓存文件的 result_url"""
+    if not CACHE_ENABLED:
+        return None
+    src = Path(src_path)
+    dest = Path(CACHE_DIR) / f"{key}{src.suffix}"
+    if not dest.exists():
+        tmp = dest.with_name(dest.name + ".tmp")
+        try:
+            # 同一文件系统下用硬链接，不额外占用磁盘
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+
+    size = dest.stat().st_size
+    now = time.time()
+    pipe = conn.pipeline()
+    pipe.exists(ENTRY_PREFIX + key)
+    pipe.hset(ENTRY_PREFIX + key, mapping={
+        "path": str(dest),
+        "url": _url_for(dest),
+        "size": size,
+        "created": now,
+    })
+    pipe.zadd(INDEX_KEY, {key: now})
+    existed = pipe.execute()[0]
+    if not existed:
+        conn.incrby(BYTES_KEY, size)
+
+    evict(conn)
+    return _url_for(dest)
+
+
+def _drop(conn, key: str, entry: dict = None):
+    entry = entry or conn.hgetall(ENTRY_PREFIX + key)
+    # 以 zrem 的返回值为准，避免多个进程同时淘汰同一条目时重复扣减字节数
+    if not conn.zrem(INDEX_KEY, key):
+        return
+    conn.delete(ENTRY_PREFIX + key)
+    if entry:
+        conn.decrby(BYTES_KEY, int(entry[b"size"]))
+        try:
+            os.remove(entry[b"path"].decode())
+        except FileNotFoundError:
+            pass
+
+
+def evict(conn):
+    """先按年龄淘汰，再按 LRU 淘汰到容量上限以下"""
+    expired = conn.zrangebyscore(INDEX_KEY, 0, time.time() - CACHE_MAX_AGE)
+    for key in expired:
+        _drop(conn, key.decode())
+
+    while int(conn.get(BYTES_KEY) or 0) > CACHE_MAX_BYTES:
+        oldest = conn.zrange(INDEX_KEY, 0, 0)
+        if not oldest:
+            conn.set(BYTES_KEY, 0)
+            break
+        _drop(conn, oldest[0].decode())
+
+
+def stats(conn) -> dict:
+    raw = {k.decode(): int(v) for k, v in conn.hgetall(STATS_KEY).items()}
+    by_kind = {}
+    for field, value in raw.items():
+        kind, counter = field.split(":", 1)
+        by_kind.setdefault(kind, {"hits": 0, "misses": 0})[counter] = value
+    for counters in by_kind.values():
+        total = counters["hits"] + counters["misses"]
+        counters["hit_ratio"] = round(counters["hits"] / total, 4) if total else 0.0
+    return {
+        "enabled": CACHE_ENABLED,
+        "entries": conn.zcard(INDEX_KEY),
+        "bytes": int(conn.get(BYTES_KEY) or 0),
+        "max_bytes": CACHE_MAX_BYTES,
+        "max_age": CACHE_MAX_AGE,
+        "kinds": by_kind,
+    }
@@ -1,9 +1,125 @@
 # backend/config.py
 import os
 
-IMAGE_GEN_URL = os.getenv("IMAGE_GEN_URL", "http://image-gen:8000/generate")
+IMAGE_GEN_URL = os.getenv("IMAGE_GEN_URL", "http://qwen-image:8007/generate")
 VOICE_GEN_URL = os.getenv("VOICE_GEN_URL", "http://voice-gen:8000/generate")
 VIDEO_GEN_URL = os.getenv("VIDEO_GEN_URL", "http://video-gen:8000/generate")
+FISH_SPEECH_URL = os.getenv("FISH_SPEECH_URL", "http://fish-speech:8080/v1/tts")
+# 多个 fish-speech 副本（逗号分隔），长文本分段后并发分发到这些副本
+FISH_SPEECH_URLS = [u.strip() for u in os.getenv("FISH_SPEECH_URLS", FISH_SPEECH_URL).split(",") if u.strip()]
+
+
+def _urls(name: str, default: str) -> list:
+    return [u.strip() for u in os.getenv(name, default).split(",") if u.strip()]
+
+
+# 模型服务副本（逗号分隔），由 services/registry.py 轮询健康状态并路由到负载最低的副本
+SERVICE_URLS = {
+    "image": _urls("IMAGE_GEN_URLS", IMAGE_GEN_URL),
+    "voice": FISH_SPEECH_URLS,
+    "video": _urls("VIDEO_GEN_URLS", VIDEO_GEN_URL),
+}
+SERVICE_HEALTH_PATHS = {
+    "image": os.getenv("IMAGE_GEN_HEALTH_PATH", "/health"),
+    "voice": os.getenv("VOICE_GEN_HEALTH_PATH", "/v1/health"),
+    "video": os.getenv("VIDEO_GEN_HEALTH_PATH", "/health"),
+}
+HEALTH_CHECK_INTERVAL = float(os.getenv("HEALTH_CHECK_INTERVAL", 5))
+HEALTH_CHECK_TIMEOUT = float(os.getenv("HEALTH_CHECK_TIMEOUT", 2))
+# 连续失败达到次数后摘除副本一段时间，期间健康检查恢复也要等摘除期结束
+EJECT_AFTER_FAILURES = int(os.getenv("EJECT_AFTER_FAILURES", 2))
+EJECT_SECONDS = float(os.getenv("EJECT_SECONDS", 30))
 
 OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/app/static/outputs")
-os.makedirs(OUTPUT_DIR, exist_ok=True)
\ No newline at end of file
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+# 模型服务 HTTP 客户端：连接/读取超时与整体截止时间分开
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", 600))  # 两次收到数据之间的最长间隔
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", 3))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", 1.0))
+SERVICE_CONCURRENCY = {
+    "image": int(os.getenv("IMAGE_GEN_CONCURRENCY", 2)),
+    "voice": int(os.getenv("VOICE_GEN_CONCURRENCY", 8)),
+    "video": int(os.getenv("VIDEO_GEN_CONCURRENCY", 1)),
+}
+SERVICE_DEADLINES = {
+    "image": float(os.getenv("IMAGE_GEN_DEADLINE", 300)),   # 5分钟
+    "voice": float(os.getenv("VOICE_GEN_DEADLINE", 600)),   # 10分钟
+    "video": float(os.getenv("VIDEO_GEN_DEADLINE", 3600)),  # 1小时（10分钟视频需较长时间）
+}
+
+# 模型服务与 backend 挂载同一个 static 卷时，服务直接把产物写入 OUTPUT_DIR，只返回文件名
+SHARED_ARTIFACTS = os.getenv("SHARED_ARTIFACTS", "true").lower() == "true"
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+
+# 结果缓存（按输入内容寻址）
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "true").lower() == "true"
+CACHE_DIR = os.getenv("CACHE_DIR", os.path.join(OUTPUT_DIR, "cache"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", 20 * 1024**3))  # 默认 20GB
+CACHE_MAX_AGE = int(os.getenv("CACHE_MAX_AGE", 7 * 24 * 3600))  # 超过 7 天未访问即淘汰
+
+# 参与缓存键计算的模型标识，换模型后旧缓存自动失效
+IMAGE_MODEL_ID = os.getenv("IMAGE_MODEL_ID", "Qwen/Qwen-Image")
+VOICE_MODEL_ID = os.getenv("VOICE_MODEL_ID", "fishaudio/openaudio-s1-mini")
+VIDEO_MODEL_ID = os.getenv("VIDEO_MODEL_ID", "cerspense/zeroscope_v2_576w")
+
+# 相同输入的进行中任务合并：占位有效期 = job_timeout + 排队宽限
+SINGLEFLIGHT_QUEUE_GRACE = int(os.getenv("SINGLEFLIGHT_QUEUE_GRACE", 3600))
+
+# 流式 TTS：按句切分后逐段请求 fish-speech，每段不超过该字符数
+TTS_SEGMENT_CHARS = int(os.getenv("TTS_SEGMENT_CHARS", 200))
+TTS_REQUESTS_PER_REPLICA = int(os.getenv("TTS_REQUESTS_PER_REPLICA", 1))
+TTS_CROSSFADE_MS = int(os.getenv("TTS_CROSSFADE_MS", 30))
+TTS_PAUSE_MS = int(os.getenv("TTS_PAUSE_MS", 150))  # 段与段之间统一的停顿
+
+# 参考音色目录，与 fish-speech 容器挂载的 references/ 为同一目录
+REFERENCES_DIR = os.getenv("REFERENCES_DIR", "/app/references")
+os.makedirs(REFERENCES_DIR, exist_ok=True)
+# fish-speech 无法访问共享 references/ 目录时（如远程部署），改为随请求内联发送参考音频
+VOICE_INLINE_REFERENCE = os.getenv("VOICE_INLINE_REFERENCE", "false").lower() == "true"
+
+# 推理进度（模型服务写入 Redis 的 progress:<task_id>）
+PROGRESS_TTL = int(os.getenv("PROGRESS_TTL", 3600))
+PROGRESS_STALL_SECONDS = int(os.getenv("PROGRESS_STALL_SECONDS", 120))  # 超过该时间未更新视为卡住
+
+# 任务状态 SSE 推送：空闲时的心跳间隔（同时重新核对一次状态）
+SSE_KEEPALIVE_SECONDS = float(os.getenv("SSE_KEEPALIVE_SECONDS", 15))
+
+# 按阶段与优先级划分的 RQ 队列：interactive 优先，batch 只在同阶段 worker 空闲时执行
+PRIORITIES = ("interactive", "batch")
+# 各阶段平均耗时的初始估计（秒），有实际完成记录后按指数滑动平均更新
+RUNTIME_ESTIMATES = {
+    "image": float(os.getenv("IMAGE_RUNTIME_ESTIMATE", 60)),
+    "voice": float(os.getenv("VOICE_RUNTIME_ESTIMATE", 120)),
+    "video": float(os.getenv("VIDEO_RUNTIME_ESTIMATE", 1800)),
+}
+RUNTIME_EWMA_ALPHA = float(os.getenv("RUNTIME_EWMA_ALPHA", 0.2))
+# 准入控制：预计等待（排队数 × 平均耗时 / worker 数）超过阈值即返回 429
+ADMISSION_MAX_WAIT = {
+    "interactive": {
+        "image": float(os.getenv("IMAGE_MAX_WAIT", 600)),
+        "voice": float(os.getenv("VOICE_MAX_WAIT", 900)),
+        "video": float(os.getenv("VIDEO_MAX_WAIT", 4 * 3600)),
+    },
+    "batch": {
+        "image": float(os.getenv("IMAGE_BATCH_MAX_WAIT", 6 * 3600)),
+        "voice": float(os.getenv("VOICE_BATCH_MAX_WAIT", 6 * 3600)),
+        "video": float(os.getenv("VIDEO_BATCH_MAX_WAIT", 24 * 3600)),
+    },
+}
+
+# Prometheus：worker 进程的指标端口（backend 的指标在 API 的 /metrics）
+WORKER_METRICS_PORT = int(os.getenv("WORKER_METRICS_PORT", 9100))
+
+# 任务状态记录（task_store.py）：任务结束后保留 TASK_TTL 秒，到期由 janitor 连同产物文件一起删除
+TASK_TTL = int(os.getenv("TASK_TTL", 7 * 24 * 3600))
+# RQ job（meta 与返回值）在完成后的保留时间；状态查询以任务记录为准，job 只需保留到流水线下游阶段读取完毕
+JOB_RESULT_TTL = int(os.getenv("JOB_RESULT_TTL", 24 * 3600))
+JOB_FAILURE_TTL = int(os.getenv("JOB_FAILURE_TTL", 7 * 24 * 3600))
+# 上传的参考音频登记后即移入 references/，uploads/ 中超过 UPLOAD_TTL 的文件视为残留
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploads")
+UPLOAD_TTL = int(os.getenv("UPLOAD_TTL", 24 * 3600))
+JANITOR_INTERVAL = float(os.getenv("JANITOR_INTERVAL", 600))
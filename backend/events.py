@@ -0,0 +1,17 @@
+# backend/events.py
+"""
+任务状态变更通知（Redis pub/sub）。
+
+worker 每次更新 job.meta、模型服务每次上报推理进度时，向 task_events:<job_id> 发布一条通知；
+SSE 端点订阅这些频道，收到通知后重新汇总状态并推送给浏览器，不再需要客户端轮询。
+通知本身不携带状态，状态仍以 job.meta / progress:<job_id> 为准，漏收一条也不会不一致。
+"""
+EVENTS_PREFIX = "task_events:"
+
+
+def channel(job_id: str) -> str:
+    return EVENTS_PREFIX + job_id
+
+
+def notify(conn, job_id: str, kind: str = "status"):
+    conn.publish(channel(job_id), kind)
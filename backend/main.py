@@ -1,59 +1,227 @@
-from fastapi import FastAPI, File, UploadFile, Form, HTTPException
+from fastapi import FastAPI, File, UploadFile, Form, HTTPException, Request
+from fastapi.responses import FileResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from redis import Redis
-from rq import Queue
+from redis import asyncio as aioredis
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
+import asyncio
+import json
 import uuid
 import shutil
 from pathlib import Path
-from models import TaskResponse, TaskStatus
-from tasks import async_generate_image, async_clone_voice, async_generate_video
+from typing import Optional
+from models import TaskResponse, TaskStatus, TaskStatusQuery, TaskStatusBatch
+from tasks import (
+    async_generate_image, async_clone_voice, async_clone_voice_stream,
+    async_generate_video, async_generate_pipeline_video,
+)
+from config import (
+    REDIS_HOST, REDIS_PORT, SINGLEFLIGHT_QUEUE_GRACE, OUTPUT_DIR, SSE_KEEPALIVE_SECONDS, PRIORITIES,
+    JOB_RESULT_TTL, JOB_FAILURE_TTL, UPLOAD_DIR,
+)
+import cache
+import events
+import metrics
+import singleflight
+import pipeline
+import queues
+import task_store
+import voices
 
 app = FastAPI(title="Text-to-Video API")
-app.mount("/outputs", StaticFiles(directory="static/outputs"), name="outputs")
+app.mount("/outputs", StaticFiles(directory=OUTPUT_DIR), name="outputs")
 
-redis_conn = Redis(host="redis", port=6379)
-queue = Queue("default", connection=redis_conn)
+redis_conn = Redis(host=REDIS_HOST, port=REDIS_PORT)
+# SSE 订阅专用的异步连接，pub/sub 等待不占用请求线程
+async_redis = aioredis.Redis(host=REDIS_HOST, port=REDIS_PORT)
+metrics.register_redis_collector(redis_conn)
+
+# 单次批量状态查询的任务数上限
+TASK_BATCH_MAX = 1000
+
+@app.on_event("startup")
+def start_janitor():
+    task_store.start_janitor(redis_conn)
+
+def _priority(priority: str) -> str:
+    if priority not in PRIORITIES:
+        raise HTTPException(400, f"priority must be one of {', '.join(PRIORITIES)}")
+    return priority
+
+def _admit(stages, priority: str):
+    """准入控制：相关阶段排队过长时以 429 拒绝，并给出预计等待时间"""
+    rejected = queues.admission(redis_conn, stages, priority)
+    if rejected:
+        raise HTTPException(429, rejected, headers={"Retry-After": str(rejected["estimated_wait"])})
+
+def enqueue_once(cache_key: str, task_id: str, stage: str, priority: str, func, *args,
+                 job_timeout: str, **kwargs) -> str:
+    """
+    相同输入的任务已在排队或执行时直接挂靠到该任务。
+    返回实际承载结果的 job_id：等于 task_id 表示本次真正入队。
+    任务记录在入队之前登记，worker 开始执行时记录一定已存在。
+    """
+    ttl = int(job_timeout) + SINGLEFLIGHT_QUEUE_GRACE
+    leader = singleflight.claim(redis_conn, cache_key, task_id, ttl)
+    if leader is not None:
+        task_store.create(redis_conn, task_id, job_id=leader, timeout=ttl)
+        return leader
+    task_store.create(redis_conn, task_id, job_id=task_id, timeout=ttl)
+    try:
+        queues.get_queue(redis_conn, stage, priority).enqueue(
+            func, task_id, *args,
+            cache_key=cache_key,
+            job_id=task_id,
+            job_timeout=job_timeout,
+            result_ttl=JOB_RESULT_TTL,
+            failure_ttl=JOB_FAILURE_TTL,
+            **kwargs,
+        )
+    except Exception as e:
+        singleflight.release(redis_conn, cache_key, task_id)
+        task_store.update(redis_conn, task_id, status="failed", error=f"Enqueue failed: {e}")
+        raise
+    return task_id
+
+def _save_upload(audio: UploadFile) -> Path:
+    if not audio.filename.endswith(('.wav', '.mp3')):
+        raise HTTPException(400, "Only WAV/MP3 allowed")
+
+    upload_dir = Path(UPLOAD_DIR)
+    upload_dir.mkdir(parents=True, exist_ok=True)
+    audio_path = upload_dir / f"{uuid.uuid4()}_{audio.filename}"
+    with open(audio_path, "wb") as f:
+        shutil.copyfileobj(audio.file, f)
+    return audio_path
+
+def _resolve_voice(audio: Optional[UploadFile], voice_id: Optional[str], reference_text: str = "") -> str:
+    """上传的参考音频先登记进音色库；已登记的音色直接使用 voice_id"""
+    if voice_id:
+        if not voices.exists(voice_id):
+            raise HTTPException(404, "Voice not found")
+        voices.touch(redis_conn, voice_id)
+        return voice_id
+    if audio is None:
+        raise HTTPException(400, "Either audio or voice_id is required")
+    return voices.register(redis_conn, str(_save_upload(audio)), reference_text)
+
+@app.post("/api/voices")
+async def register_voice_api(
+    audio: UploadFile = File(...),
+    reference_text: str = Form("")  # 参考音频对应的文本，可提升克隆效果
+):
+    return {"voice_id": _resolve_voice(audio, None, reference_text)}
 
 @app.post("/api/image/generate", response_model=TaskResponse)
-async def generate_image_api(text: str = Form(...)):
+async def generate_image_api(
+    text: str = Form(...),
+    priority: str = Form("interactive")  # interactive / batch
+):
+    priority = _priority(priority)
     task_id = f"img_{uuid.uuid4().hex}"
-    queue.enqueue(async_generate_image, task_id, text, job_timeout='600')
+    cache_key = cache.image_key(text)
+    cached_url = cache.lookup(redis_conn, cache_key)
+    if cached_url:
+        task_store.create(redis_conn, task_id, status="completed", url=cached_url)
+        return {"task_id": task_id, "status": "completed", "result_url": cached_url}
+
+    _admit(["image"], priority)
+    enqueue_once(cache_key, task_id, "image", priority, async_generate_image, text, job_timeout='600')
     return {"task_id": task_id}
 
 @app.post("/api/voice/clone", response_model=TaskResponse)
 async def clone_voice_api(
     text: str = Form(...),
-    audio: UploadFile = File(...)
+    audio: Optional[UploadFile] = File(None),
+    voice_id: Optional[str] = Form(None),  # 已登记的音色，提供时无需再上传 audio
+    stream: bool = Form(False),  # 按句流式合成，可通过 stream_url 边合成边播放
+    priority: str = Form("interactive")
 ):
-    if not audio.filename.endswith(('.wav', '.mp3')):
-        raise HTTPException(400, "Only WAV/MP3 allowed")
-    
-    upload_dir = Path("uploads")
-    upload_dir.mkdir(exist_ok=True)
-    audio_path = upload_dir / f"{uuid.uuid4()}_{audio.filename}"
-    with open(audio_path, "wb") as f:
-        shutil.copyfileobj(audio.file, f)
-    
+    # 流式合成有人在等着听，总是走交互队列
+    priority = "interactive" if stream else _priority(priority)
+    voice_id = _resolve_voice(audio, voice_id)
     task_id = f"voice_{uuid.uuid4().hex}"
-    queue.enqueue(
-        async_clone_voice,
+    stream_url = f"/api/voice/stream/{task_id}" if stream else None
+    cache_key = cache.voice_key(text, voice_id)
+    cached_url = cache.lookup(redis_conn, cache_key)
+    if cached_url:
+        task_store.create(redis_conn, task_id, status="completed", url=cached_url)
+        return {"task_id": task_id, "status": "completed", "result_url": cached_url, "stream_url": stream_url}
+
+    _admit(["voice"], priority)
+    enqueue_once(
+        cache_key,
         task_id,
+        "voice",
+        priority,
+        async_clone_voice_stream if stream else async_clone_voice,
         text,
-        str(audio_path),
+        voice_id,
         job_timeout='1800'  # 30分钟
     )
-    return {"task_id": task_id}
+    return {"task_id": task_id, "stream_url": stream_url}
+
+async def _tail_file(path: Path, job_id: str, poll_interval: float = 0.2):
+    """跟随 worker 正在写入的文件，把新增内容按块推给客户端，任务结束且读完后退出"""
+    while not path.exists():
+        job = queues.fetch_job(redis_conn, job_id)
+        if not job or (job.meta or {}).get("status") == "failed":
+            return
+        await asyncio.sleep(poll_interval)
+
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(64 * 1024)
+            if chunk:
+                yield chunk
+                continue
+            job = queues.fetch_job(redis_conn, job_id)
+            status = (job.meta or {}).get("status") if job else "failed"
+            if status in ("completed", "failed"):
+                # 任务结束后再读一次，确保尾部数据不丢
+                rest = f.read()
+                if rest:
+                    yield rest
+                return
+            await asyncio.sleep(poll_interval)
+
+@app.get("/api/voice/stream/{task_id}")
+async def stream_voice_api(task_id: str):
+    state = task_store.get(redis_conn, task_id)
+    if state is None:
+        raise HTTPException(404, "Task not found")
+    if state["status"] == "completed":
+        # 命中缓存、挂靠到了已完成的同输入任务或已合成完毕，直接返回完整文件
+        return FileResponse(Path(OUTPUT_DIR) / state["result_url"][len("/outputs/"):], media_type="audio/wav")
+
+    job_id = state["job"]
+    return StreamingResponse(
+        _tail_file(Path(OUTPUT_DIR) / f"{job_id}.wav", job_id),
+        media_type="audio/wav",
+    )
 
 @app.post("/api/video/generate", response_model=TaskResponse)
 async def generate_video_api(
     image_url: str = Form(...),
     audio_url: str = Form(...),
-    duration: int = Form(600)  # 默认10分钟
+    duration: int = Form(600),  # 默认10分钟
+    priority: str = Form("interactive")
 ):
+    priority = _priority(priority)
     task_id = f"video_{uuid.uuid4().hex}"
-    queue.enqueue(
-        async_generate_video,
+    cache_key = cache.video_key(image_url, audio_url, duration)
+    cached_url = cache.lookup(redis_conn, cache_key)
+    if cached_url:
+        task_store.create(redis_conn, task_id, status="completed", url=cached_url)
+        return {"task_id": task_id, "status": "completed", "result_url": cached_url}
+
+    _admit(["video"], priority)
+    enqueue_once(
+        cache_key,
         task_id,
+        "video",
+        priority,
+        async_generate_video,
         image_url,
         audio_url,
         duration,
@@ -61,15 +229,171 @@ async def generate_video_api(
     )
     return {"task_id": task_id}
 
+def _submit_stage(cache_key: str, cached_url: Optional[str], task_id: str, stage: str, priority: str,
+                  func, *args, job_timeout: str) -> dict:
+    """流水线的单个阶段：命中缓存直接给出 url，否则入队（或挂靠到进行中的相同任务）"""
+    if cached_url:
+        return {"url": cached_url}
+    return {"job_id": enqueue_once(cache_key, task_id, stage, priority, func, *args, job_timeout=job_timeout)}
+
+@app.post("/api/pipeline/generate", response_model=TaskResponse)
+async def generate_pipeline_api(
+    text: str = Form(...),
+    audio: Optional[UploadFile] = File(None),
+    voice_id: Optional[str] = Form(None),
+    narration: str = Form(None),  # 旁白文本，缺省时与画面描述相同
+    duration: int = Form(600),
+    priority: str = Form("interactive")
+):
+    """一次提交完成 图片 + 语音 → 视频：前两个阶段并行，video 阶段在两者完成后自动开始"""
+    priority = _priority(priority)
+    voice_id = _resolve_voice(audio, voice_id)
+    narration = narration or text
+    pipeline_id = f"pipe_{uuid.uuid4().hex}"
+
+    image_key, voice_key = cache.image_key(text), cache.voice_key(narration, voice_id)
+    image_url, voice_url = cache.lookup(redis_conn, image_key), cache.lookup(redis_conn, voice_key)
+    # 在提交任何阶段之前整体做准入检查，避免只入队了一部分
+    _admit([s for s, hit in (("image", image_url), ("voice", voice_url), ("video", None)) if not hit], priority)
+
+    image = _submit_stage(
+        image_key, image_url, f"{pipeline_id}_image", "image", priority,
+        async_generate_image, text, job_timeout='600'
+    )
+    voice = _submit_stage(
+        voice_key, voice_url, f"{pipeline_id}_voice", "voice", priority,
+        async_clone_voice, narration, voice_id, job_timeout='1800'
+    )
+
+    video_id = f"{pipeline_id}_video"
+    pipeline.save(redis_conn, pipeline_id, {
+        "image": image,
+        "voice": voice,
+        "video": {"job_id": video_id},
+    })
+
+    depends_on = [ref["job_id"] for ref in (image, voice) if "job_id" in ref]
+    task_store.create(redis_conn, video_id, job_id=video_id, timeout=7200 + SINGLEFLIGHT_QUEUE_GRACE)
+    queues.get_queue(redis_conn, "video", priority).enqueue(
+        async_generate_pipeline_video,
+        video_id,
+        image,
+        voice,
+        duration,
+        job_id=video_id,
+        depends_on=depends_on or None,
+        job_timeout='7200',
+        result_ttl=JOB_RESULT_TTL,
+        failure_ttl=JOB_FAILURE_TTL,
+    )
+
+    return {"task_id": pipeline_id}
+
+def _task_status(task_id: str) -> TaskStatus:
+    if task_id.startswith("pipe_"):
+        state = pipeline.status(redis_conn, task_id)
+        if state is None:
+            raise HTTPException(404, "Task not found")
+        return TaskStatus(**state)
+
+    state = task_store.get(redis_conn, task_id)
+    if state is None:
+        raise HTTPException(404, "Task not found")
+    return TaskStatus(**state)
+
 @app.get("/api/task/{task_id}", response_model=TaskStatus)
 async def get_task_status(task_id: str):
-    job = queue.fetch_job(task_id)
-    if not job:
-        raise HTTPException(404, "Task not found")
-    
-    meta = job.meta or {}
-    return TaskStatus(
-        status=meta.get("status", job.get_status()),
-        result_url=meta.get("result_url"),
-        error=meta.get("error")
-    )
\ No newline at end of file
+    """轮询接口，保留兼容；前端优先使用 /api/task/{task_id}/events"""
+    return _task_status(task_id)
+
+@app.post("/api/tasks/status", response_model=TaskStatusBatch)
+async def get_task_statuses(query: TaskStatusQuery):
+    """批量查询：普通任务一次读完，流水线任务逐个汇总各阶段；不存在或已过期的任务为 null"""
+    if len(query.task_ids) > TASK_BATCH_MAX:
+        raise HTTPException(400, f"At most {TASK_BATCH_MAX} task_ids per request")
+    task_ids = list(dict.fromkeys(query.task_ids))
+    states = task_store.get_many(redis_conn, [t for t in task_ids if not t.startswith("pipe_")])
+    for task_id in task_ids:
+        if task_id.startswith("pipe_"):
+            states[task_id] = pipeline.status(redis_conn, task_id)
+    return {"tasks": {t: TaskStatus(**states[t]) if states[t] else None for t in task_ids}}
+
+@app.get("/api/tasks")
+async def list_tasks(status: str = "processing", limit: int = 100, offset: int = 0):
+    """按状态列出任务（最近更新在前），同时给出各状态的任务数"""
+    if status not in task_store.STATES:
+        raise HTTPException(400, f"status must be one of {', '.join(task_store.STATES)}")
+    return {
+        "counts": task_store.counts(redis_conn),
+        "task_ids": task_store.list_by_status(redis_conn, status, min(limit, TASK_BATCH_MAX), offset),
+    }
+
+def _event_channels(task_id: str) -> list:
+    """任务状态由哪些 job 决定：流水线为各阶段 job，挂靠任务为实际执行的 job"""
+    if task_id.startswith("pipe_"):
+        stages = pipeline.load(redis_conn, task_id) or {}
+        job_ids = [ref["job_id"] for ref in stages.values() if "job_id" in ref]
+    else:
+        job_ids = [singleflight.resolve(redis_conn, task_id)]
+    return [events.channel(job_id) for job_id in job_ids]
+
+async def _status_events(task_id: str, request: Request):
+    """
+    订阅任务相关 job 的通知，状态有变化时推送一条 SSE 事件，任务结束后关闭连接。
+    空闲时每 SSE_KEEPALIVE_SECONDS 发送心跳并重新核对一次状态，防止漏掉通知
+    （例如 job 被 RQ 超时终止时不会有 worker 发出通知）。
+    """
+    pubsub = async_redis.pubsub()
+    # 先订阅再读取状态，避免两者之间的变更丢失
+    await pubsub.subscribe(*_event_channels(task_id))
+    try:
+        last = None
+        while True:
+            try:
+                state = _task_status(task_id)
+            except HTTPException as e:
+                yield f"event: error\ndata: {json.dumps({'detail': e.detail})}\n\n"
+                return
+            body = state.model_dump_json()
+            if body != last:
+                yield f"event: status\ndata: {body}\n\n"
+                last = body
+            if state.status in ("completed", "failed"):
+                return
+
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=SSE_KEEPALIVE_SECONDS)
+            if message is None:
+                yield ": keepalive\n\n"
+            # 推理进度通知可能连续到达，合并成一次状态汇总
+            while await pubsub.get_message(ignore_subscribe_messages=True, timeout=0):
+                pass
+            if await request.is_disconnected():
+                return
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
+
+@app.get("/api/task/{task_id}/events")
+async def task_events(task_id: str, request: Request):
+    """Server-Sent Events：任务状态变化时推送 TaskStatus JSON"""
+    _task_status(task_id)  # 任务不存在时直接返回 404
+    return StreamingResponse(
+        _status_events(task_id, request),
+        media_type="text/event-stream",
+        # 关闭 nginx 代理缓冲，事件立即送达浏览器
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/api/queue/stats")
+async def get_queue_stats():
+    """各阶段队列长度、worker 数、平均耗时与预计等待"""
+    return queues.stats(redis_conn)
+
+@app.get("/api/cache/stats")
+async def get_cache_stats():
+    return cache.stats(redis_conn)
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus 抓取入口：队列深度与等待、worker 数、平均耗时、结果缓存命中"""
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,95 @@
+# backend/metrics.py
+"""
+Prometheus 指标。
+
+- 队列、worker、平均耗时与结果缓存命中都记录在 Redis 中，由 RedisCollector 在抓取时读取，
+  backend 的 /metrics 即可给出全局视图，不受 worker 副本数影响
+- 入队→开始等待时间、各阶段执行耗时、模型服务请求耗时只在 worker 进程内产生，
+  由 worker.py 的 MetricsWorker 在 WORKER_METRICS_PORT 上单独暴露
+- 推理耗时、步速、编码 / 写盘耗时与模型加载时间由各模型服务自己的 /metrics 暴露
+"""
+import resource
+from datetime import datetime, timezone
+
+from prometheus_client import Gauge, Histogram, REGISTRY
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from rq import Worker
+
+from config import PRIORITIES
+import cache
+import queues
+
+# 分桶覆盖图片（约 1 分钟）到长视频（约 1 小时）
+DURATION_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+
+QUEUE_WAIT = Histogram(
+    "rq_queue_wait_seconds", "Time between enqueue and a worker starting the job",
+    ["queue"], buckets=DURATION_BUCKETS,
+)
+STAGE_DURATION = Histogram(
+    "pipeline_stage_seconds", "Wall time of a completed stage task inside the worker",
+    ["stage"], buckets=DURATION_BUCKETS,
+)
+SERVICE_REQUEST = Histogram(
+    "model_service_request_seconds", "Model service call including retries and artifact write",
+    ["service", "outcome"], buckets=DURATION_BUCKETS,
+)
+PEAK_RSS = Gauge("process_peak_resident_memory_bytes", "Peak resident set size of this process")
+PEAK_RSS.set_function(lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024)
+
+
+def _utcnow():
+    # rq 以不带时区的 UTC 时间记录 enqueued_at
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def observe_queue_wait(job):
+    """worker 取到 job 准备执行时调用"""
+    if job.enqueued_at:
+        QUEUE_WAIT.labels(job.origin).observe(max(0.0, (_utcnow() - job.enqueued_at).total_seconds()))
+
+
+class RedisCollector:
+    """抓取时从 Redis 读取队列与缓存状态"""
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def describe(self):
+        # 不让注册时就访问 Redis
+        return []
+
+    def collect(self):
+        depth = GaugeMetricFamily("rq_queue_depth", "Jobs waiting in the queue", labels=["queue"])
+        oldest = GaugeMetricFamily("rq_queue_oldest_job_age_seconds", "Age of the oldest waiting job", labels=["queue"])
+        running = GaugeMetricFamily("rq_queue_running_jobs", "Jobs currently being executed", labels=["queue"])
+        workers = GaugeMetricFamily("rq_workers", "Workers listening on the stage", labels=["stage"])
+        runtime = GaugeMetricFamily("pipeline_stage_average_seconds", "EWMA of stage runtime used for admission", labels=["stage"])
+        wait = GaugeMetricFamily("pipeline_estimated_wait_seconds", "Estimated wait for a new job", labels=["stage", "priority"])
+
+        now = _utcnow()
+        for stage in queues.STAGES:
+            for priority in PRIORITIES:
+                queue = queues.get_queue(self.conn, stage, priority)
+                depth.add_metric([queue.name], queue.count)
+                running.add_metric([queue.name], queue.started_job_registry.count)
+                head = queue.get_jobs(0, 1)
+                age = (now - head[0].enqueued_at).total_seconds() if head and head[0].enqueued_at else 0
+                oldest.add_metric([queue.name], max(0.0, age))
+                wait.add_metric([stage, priority], queues.estimated_wait(self.conn, stage, priority)["estimated_wait"])
+            workers.add_metric([stage], Worker.count(queue=queues.get_queue(self.conn, stage)))
+            runtime.add_metric([stage], queues.average_runtime(self.conn, stage))
+        yield from (depth, oldest, running, workers, runtime, wait)
+
+        lookups = CounterMetricFamily("result_cache_lookups", "Result cache lookups", labels=["kind", "result"])
+        stats = cache.stats(self.conn)
+        for kind, counters in stats["kinds"].items():
+            lookups.add_metric([kind, "hit"], counters["hits"])
+            lookups.add_metric([kind, "miss"], counters["misses"])
+        yield lookups
+        yield GaugeMetricFamily("result_cache_bytes", "Bytes held by the result cache", value=stats["bytes"])
+        yield GaugeMetricFamily("result_cache_entries", "Entries in the result cache", value=stats["entries"])
+
+
+def register_redis_collector(conn):
+    REGISTRY.register(RedisCollector(conn))
@@ -1,10 +1,22 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Optional, Dict, Any, List
 
 class TaskResponse(BaseModel):
     task_id: str
+    status: str = "pending"  # 命中缓存时直接返回 completed
+    result_url: Optional[str] = None
+    stream_url: Optional[str] = None  # 流式语音合成时可边合成边播放的地址
 
 class TaskStatus(BaseModel):
     status: str  # pending, processing, completed, failed
     result_url: Optional[str] = None
-    error: Optional[str] = None
\ No newline at end of file
+    error: Optional[str] = None
+    stage: Optional[str] = None  # 流水线任务当前所处阶段
+    stages: Optional[Dict[str, Any]] = None  # 流水线任务各阶段详情
+    progress: Optional[Dict[str, Any]] = None  # 推理进度：stage / step / total / eta 等
+
+class TaskStatusQuery(BaseModel):
+    task_ids: List[str]
+
+class TaskStatusBatch(BaseModel):
+    tasks: Dict[str, Optional[TaskStatus]]  # 不存在或已过期的任务为 null
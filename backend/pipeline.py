@@ -0,0 +1,72 @@
+# backend/pipeline.py
+"""
+文字 → 视频 一体化流水线的状态记录。
+
+一个流水线 task_id 对应三个阶段：image 与 voice 并行执行，video 通过 RQ depends_on
+在两者完成后自动入队。每个阶段记录为 {"job_id": ...}（需要执行或挂靠到进行中的任务）
+或 {"url": ...}（命中结果缓存，无需执行）。
+"""
+import json
+from typing import Optional
+
+from config import TASK_TTL
+import task_store
+
+PIPELINE_PREFIX = "pipeline:"
+STAGES = ("image", "voice", "video")
+
+
+def save(conn, pipeline_id: str, stages: dict):
+    conn.setex(PIPELINE_PREFIX + pipeline_id, TASK_TTL, json.dumps(stages))
+
+
+def load(conn, pipeline_id: str) -> Optional[dict]:
+    raw = conn.get(PIPELINE_PREFIX + pipeline_id)
+    return json.loads(raw) if raw else None
+
+
+def stage_status(ref: dict, state: Optional[dict]) -> dict:
+    if "url" in ref:
+        return {"status": "completed", "result_url": ref["url"]}
+    if state is None:
+        return {"status": "failed", "error": "Stage task expired or missing"}
+    return {k: state[k] for k in ("status", "result_url", "error", "progress")}
+
+
+def status(conn, pipeline_id: str) -> Optional[dict]:
+    """汇总各阶段状态，返回 TaskStatus 所需字段"""
+    stages = load(conn, pipeline_id)
+    if stages is None:
+        return None
+
+    states = task_store.get_many(conn, [ref["job_id"] for ref in stages.values() if "job_id" in ref])
+    detail = {name: stage_status(stages[name], states.get(stages[name].get("job_id"))) for name in STAGES}
+    for name in STAGES:
+        if detail[name]["status"] == "failed":
+            return {
+                "status": "failed",
+                "stage": name,
+                "error": f"{name} stage failed: {detail[name].get('error')}",
+                "stages": detail,
+            }
+
+    video = detail["video"]
+    if video["status"] == "completed":
+        return {"status": "completed", "stage": "video", "result_url": video["result_url"], "stages": detail}
+
+    # 当前阶段：video 已开始则为 video，否则为尚未完成的前置阶段
+    if video["status"] == "processing":
+        current = "video"
+    else:
+        current = ",".join(n for n in ("image", "voice") if detail[n]["status"] != "completed") or "video"
+    started = any(d["status"] != "pending" for d in detail.values())
+    # image 与 voice 并行时取第一个仍在推理的阶段的进度
+    current_progress = next(
+        (detail[n]["progress"] for n in current.split(",") if detail[n].get("progress")), None
+    )
+    return {
+        "status": "processing" if started else "pending",
+        "stage": current,
+        "stages": detail,
+        "progress": current_progress,
+    }
@@ -0,0 +1,55 @@
+# backend/progress.py
+"""
+任务内部进度：模型服务在推理的每一步回调中写入 progress:<task_id> 哈希，
+字段为 stage / step / total / elapsed / eta / updated，backend 只负责读取。
+
+TTS 没有可回调的推理循环，由 worker 按已完成的分段数自行上报。
+"""
+import time
+from typing import Optional
+
+from config import PROGRESS_TTL, PROGRESS_STALL_SECONDS
+from events import channel
+
+PROGRESS_PREFIX = "progress:"
+
+
+def publish(conn, task_id: str, stage: str, step: int, total: int, started: float):
+    elapsed = time.time() - started
+    eta = elapsed / step * (total - step) if step else None
+    key = PROGRESS_PREFIX + task_id
+    pipe = conn.pipeline()
+    pipe.hset(key, mapping={
+        "stage": stage,
+        "step": step,
+        "total": total,
+        "elapsed": round(elapsed, 2),
+        "eta": round(eta, 2) if eta is not None else "",
+        "updated": time.time(),
+    })
+    pipe.expire(key, PROGRESS_TTL)
+    pipe.publish(channel(task_id), "progress")
+    pipe.execute()
+
+
+def get(conn, task_id: str) -> Optional[dict]:
+    return parse(conn.hgetall(PROGRESS_PREFIX + task_id))
+
+
+def parse(raw: dict) -> Optional[dict]:
+    """解析进度哈希；超过 PROGRESS_STALL_SECONDS 未更新时标记 stalled，便于区分卡死与单步较慢"""
+    if not raw:
+        return None
+    data = {k.decode(): v.decode() for k, v in raw.items()}
+    step, total = int(data["step"]), int(data["total"])
+    updated = float(data["updated"])
+    return {
+        "stage": data["stage"],
+        "step": step,
+        "total": total,
+        "percent": round(100.0 * step / total, 1) if total else None,
+        "elapsed": float(data["elapsed"]),
+        "eta": float(data["eta"]) if data["eta"] else None,
+        "updated": updated,
+        "stalled": time.time() - updated > PROGRESS_STALL_SECONDS,
+    }
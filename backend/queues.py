@@ -0,0 +1,94 @@
+# backend/queues.py
+"""
+按阶段（image / voice / video）与优先级（interactive / batch）划分的 RQ 队列，以及准入控制。
+
+每个阶段有独立的 worker 池，监听顺序为 <stage> → <stage>_batch，
+因此长视频任务不会挡住图片任务，批量任务也只在交互任务排空后才执行。
+预计等待 = 前面的任务数 × 该阶段平均耗时 / 该阶段 worker 数；
+平均耗时来自已完成任务的指数滑动平均（queue_stats:runtime）。
+"""
+import math
+from typing import Optional
+
+from rq import Queue, Worker
+from rq.job import Job
+from rq.exceptions import NoSuchJobError
+from rq.registry import StartedJobRegistry
+
+from config import PRIORITIES, RUNTIME_ESTIMATES, RUNTIME_EWMA_ALPHA, ADMISSION_MAX_WAIT
+
+STAGES = ("image", "voice", "video")
+RUNTIME_KEY = "queue_stats:runtime"  # hash: <stage> -> 平均耗时（秒）
+
+
+def queue_name(stage: str, priority: str = "interactive") -> str:
+    return stage if priority == "interactive" else f"{stage}_{priority}"
+
+
+def get_queue(conn, stage: str, priority: str = "interactive") -> Queue:
+    return Queue(queue_name(stage, priority), connection=conn)
+
+
+def fetch_job(conn, job_id: str) -> Optional[Job]:
+    """按 id 取 job，不限定所在队列"""
+    try:
+        return Job.fetch(job_id, connection=conn)
+    except NoSuchJobError:
+        return None
+
+
+def record_runtime(conn, stage: str, seconds: float):
+    """任务实际执行完成后更新该阶段的平均耗时"""
+    previous = conn.hget(RUNTIME_KEY, stage)
+    average = seconds if previous is None else (
+        RUNTIME_EWMA_ALPHA * seconds + (1 - RUNTIME_EWMA_ALPHA) * float(previous)
+    )
+    conn.hset(RUNTIME_KEY, stage, average)
+
+
+def average_runtime(conn, stage: str) -> float:
+    value = conn.hget(RUNTIME_KEY, stage)
+    return float(value) if value is not None else RUNTIME_ESTIMATES[stage]
+
+
+def estimated_wait(conn, stage: str, priority: str = "interactive") -> dict:
+    """新任务提交到该阶段后，预计多久开始执行"""
+    interactive = get_queue(conn, stage, "interactive")
+    queues = [interactive] if priority == "interactive" else [get_queue(conn, stage, p) for p in PRIORITIES]
+    running = sum(StartedJobRegistry(queue=get_queue(conn, stage, p)).count for p in PRIORITIES)
+    ahead = sum(q.count for q in queues) + running
+    workers = max(1, Worker.count(queue=interactive))
+    runtime = average_runtime(conn, stage)
+    return {
+        "stage": stage,
+        "ahead": ahead,
+        "workers": workers,
+        "average_runtime": round(runtime, 1),
+        "estimated_wait": round(ahead * runtime / workers, 1),
+    }
+
+
+def admission(conn, stages, priority: str = "interactive") -> Optional[dict]:
+    """
+    检查将要入队的各阶段，任一阶段预计等待超过阈值则返回拒绝详情，否则返回 None。
+    流水线的预计等待按各阶段之和保守估计。
+    """
+    estimates = [estimated_wait(conn, stage, priority) for stage in stages]
+    over = [e for e in estimates if e["estimated_wait"] > ADMISSION_MAX_WAIT[priority][e["stage"]]]
+    if not over:
+        return None
+    return {
+        "message": f"{', '.join(e['stage'] for e in over)} queue is saturated, retry later",
+        "estimated_wait": math.ceil(sum(e["estimated_wait"] for e in estimates)),
+        "stages": estimates,
+    }
+
+
+def stats(conn) -> dict:
+    return {
+        stage: {
+            **estimated_wait(conn, stage, "batch"),
+            "queued": {p: get_queue(conn, stage, p).count for p in PRIORITIES},
+        }
+        for stage in STAGES
+    }
@@ -0,0 +1,60 @@
+import io
+import wave
+from typing import List
+
+import numpy as np
+
+# 低于该幅度（相对 int16 满幅）视为静音
+SILENCE_THRESHOLD = 0.01
+
+
+def read_wav(data: bytes):
+    with wave.open(io.BytesIO(data), "rb") as w:
+        params = (w.getframerate(), w.getnchannels(), w.getsampwidth())
+        frames = w.readframes(w.getnframes())
+    if params[2] != 2:
+        raise ValueError(f"Only 16-bit PCM is supported, got sample width {params[2]}")
+    samples = np.frombuffer(frames, dtype=np.int16).reshape(-1, params[1])
+    return samples.astype(np.float32) / 32768.0, params
+
+
+def trim_silence(samples: np.ndarray) -> np.ndarray:
+    loud = np.flatnonzero(np.abs(samples).max(axis=1) > SILENCE_THRESHOLD)
+    if loud.size == 0:
+        return samples[:0]
+    return samples[loud[0]:loud[-1] + 1]
+
+
+def stitch_wavs(segments: List[bytes], crossfade_ms: int = 30, pause_ms: int = 150) -> bytes:
+    """
+    按顺序拼接多段 WAV：
+    先裁掉每段首尾的静音，再在段间插入统一长度的停顿，最后在接缝处做线性交叉淡化，避免爆音。
+    """
+    decoded = [read_wav(data) for data in segments]
+    params = decoded[0][1]
+    if any(p != params for _, p in decoded):
+        raise ValueError("Segments have mismatched sample rate / channels / width")
+    rate, channels, _ = params
+
+    pause = np.zeros((int(rate * pause_ms / 1000), channels), dtype=np.float32)
+    fade = int(rate * crossfade_ms / 1000)
+
+    out = trim_silence(decoded[0][0])
+    for samples, _ in decoded[1:]:
+        nxt = np.concatenate([pause, trim_silence(samples)])
+        n = min(fade, len(out), len(nxt))
+        if n:
+            ramp = np.linspace(0.0, 1.0, n, dtype=np.float32)[:, None]
+            overlap = out[-n:] * (1.0 - ramp) + nxt[:n] * ramp
+            out = np.concatenate([out[:-n], overlap, nxt[n:]])
+        else:
+            out = np.concatenate([out, nxt])
+
+    pcm = (np.clip(out, -1.0, 1.0) * 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(pcm.tobytes())
+    return buf.getvalue()
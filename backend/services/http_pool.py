@@ -0,0 +1,166 @@
+"""
+模型服务共享的异步 HTTP 客户端层。
+
+- 每个服务一个 httpx.AsyncClient：keep-alive 连接池，跨任务复用
+- 每个服务独立的并发上限（asyncio.Semaphore）
+- 连接/读取超时与整体截止时间分开设置
+- 5xx 与连接错误按指数退避重试，每次尝试都重新选择副本（见 registry.py）
+- 响应体流式写盘，不在内存中整体缓冲
+
+RQ 任务是同步函数，通过 run() 把协程提交到本进程常驻的事件循环线程执行，
+这样同一 worker 进程内的多个调用可以共享连接池并发进行。
+"""
+import asyncio
+import os
+import random
+import threading
+import time
+from contextlib import asynccontextmanager
+from pathlib import Path
+
+import httpx
+
+from config import (
+    HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT, HTTP_MAX_RETRIES, HTTP_RETRY_BACKOFF,
+    SERVICE_CONCURRENCY, SERVICE_DEADLINES, SHARED_ARTIFACTS,
+)
+from services.registry import registry
+import metrics
+
+RETRY_STATUS = {500, 502, 503, 504}
+RETRY_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError, httpx.ReadError)
+
+_loop = None
+_loop_pid = None
+_loop_lock = threading.Lock()
+_clients = {}
+_semaphores = {}
+
+
+def _event_loop() -> asyncio.AbstractEventLoop:
+    global _loop, _loop_pid
+    with _loop_lock:
+        # fork 出的子进程不会继承事件循环线程，需要重新创建
+        if _loop is None or _loop_pid != os.getpid():
+            _loop = asyncio.new_event_loop()
+            _loop_pid = os.getpid()
+            _clients.clear()
+            _semaphores.clear()
+            threading.Thread(target=_loop.run_forever, name="http-pool", daemon=True).start()
+        return _loop
+
+
+def run(coro):
+    """在常驻事件循环中执行协程并阻塞等待结果（供同步的 RQ 任务调用）"""
+    return asyncio.run_coroutine_threadsafe(coro, _event_loop()).result()
+
+
+def _client(service: str) -> httpx.AsyncClient:
+    if service not in _clients:
+        limit = SERVICE_CONCURRENCY.get(service, 4)
+        _clients[service] = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=limit, max_keepalive_connections=limit),
+        )
+        _semaphores[service] = asyncio.Semaphore(limit)
+    return _clients[service]
+
+
+async def _backoff(attempt: int):
+    delay = HTTP_RETRY_BACKOFF * (2 ** attempt)
+    await asyncio.sleep(delay + random.uniform(0, delay / 2))
+
+
+@asynccontextmanager
+async def _stream(service: str, json: dict):
+    """带重试的流式 POST；重试只发生在开始读取响应体之前，失败的副本计入摘除统计"""
+    client = _client(service)
+    async with _semaphores[service]:
+        for attempt in range(HTTP_MAX_RETRIES + 1):
+            last = attempt == HTTP_MAX_RETRIES
+            started = False
+            async with registry.route(service) as replica:
+                try:
+                    async with client.stream("POST", replica.url, json=json) as response:
+                        if response.status_code in RETRY_STATUS:
+                            registry.failed(replica)
+                        if response.status_code in RETRY_STATUS and not last:
+                            # 释放连接后退避，下一次尝试重新选副本
+                            await response.aread()
+                        else:
+                            if response.is_error:
+                                await response.aread()
+                            response.raise_for_status()
+                            registry.succeeded(replica)
+                            started = True
+                            yield response
+                            return
+                except RETRY_ERRORS:
+                    # 响应体已交给调用方后出错不能重放，直接抛出
+                    if not started:
+                        registry.failed(replica)
+                    if last or started:
+                        raise
+            await _backoff(attempt)
+
+
+@asynccontextmanager
+async def _timed(service: str):
+    """记录一次完整的服务调用耗时（含重试与产物写盘）"""
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        metrics.SERVICE_REQUEST.labels(service, outcome).observe(time.perf_counter() - started)
+
+
+async def post_to_file(service: str, json: dict, dest, chunk_size: int = 1024 * 1024) -> Path:
+    """POST 请求并把响应体流式写入 dest（先写临时文件再原子替换）"""
+    dest = Path(dest)
+    tmp = dest.with_name(dest.name + ".part")
+
+    async def _download():
+        async with _stream(service, json) as response:
+            with open(tmp, "wb") as f:
+                async for chunk in response.aiter_bytes(chunk_size):
+                    f.write(chunk)
+        os.replace(tmp, dest)
+        return dest
+
+    try:
+        async with _timed(service):
+            return await asyncio.wait_for(_download(), SERVICE_DEADLINES.get(service))
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+async def post_for_artifact(service: str, json: dict, dest) -> Path:
+    """
+    请求模型服务生成产物并保存到 dest。
+    共享 static 卷时只传文件名，由服务直接写盘，backend 不经手任何产物字节；
+    否则退化为流式下载。
+    """
+    dest = Path(dest)
+    if not SHARED_ARTIFACTS:
+        return await post_to_file(service, json, dest)
+
+    async def _call():
+        async with _stream(service, {**json, "output_file": dest.name}) as response:
+            await response.aread()
+            return response.json()
+
+    async with _timed(service):
+        result = await asyncio.wait_for(_call(), SERVICE_DEADLINES.get(service))
+    if result.get("output_file") != dest.name or not dest.exists():
+        raise RuntimeError(f"{service} service did not write {dest.name} to the shared output directory")
+    return dest
+
+
+async def post_stream(service: str, json: dict, chunk_size: int = 16384):
+    """POST 请求并逐块产出响应体（用于流式 TTS）"""
+    async with _stream(service, json) as response:
+        async for chunk in response.aiter_bytes(chunk_size):
+            yield chunk
@@ -1,11 +1,7 @@
-import requests
-from config import IMAGE_GEN_URL
+from pathlib import Path
 
-def generate_image(text: str) -> bytes:
-    response = requests.post(
-        f"{IMAGE_GEN_URL}/generate",
-        json={"text": text},
-        timeout=300  # 5分钟超时
-    )
-    response.raise_for_status()
-    return response.content
\ No newline at end of file
+from services.http_pool import post_for_artifact
+
+
+async def generate_image(text: str, dest: str):
+    await post_for_artifact("image", {"prompt": text, "task_id": Path(dest).stem}, dest)
@@ -0,0 +1,137 @@
+"""
+模型服务副本登记与客户端路由。
+
+每个服务（image / voice / video）可配置多个副本 URL。后台协程定期请求各副本的 /health，
+读取 in_flight / queue_depth；请求时选择 负载 = 副本上报的 in_flight + queue_depth + 本进程正在发往它的请求数
+最低的健康副本。本进程的请求实时计入，其他 worker 的负载以最近一次健康检查为准。
+
+请求失败（连接错误或 5xx）累计到 EJECT_AFTER_FAILURES 次即摘除 EJECT_SECONDS 秒；
+所有副本都不可用时仍退回到其中负载最低的一个，而不是直接失败。
+"""
+import asyncio
+import random
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List
+from urllib.parse import urlsplit
+
+import httpx
+
+from config import (
+    SERVICE_URLS, SERVICE_HEALTH_PATHS, HEALTH_CHECK_INTERVAL, HEALTH_CHECK_TIMEOUT,
+    EJECT_AFTER_FAILURES, EJECT_SECONDS,
+)
+
+# 加载中的副本能接收请求但要等模型就绪，只在没有就绪副本时才使用
+LOADING_PENALTY = 1000
+
+
+@dataclass
+class Replica:
+    url: str
+    health_url: str
+    healthy: bool = True  # 首次健康检查前默认可用
+    loading: bool = False
+    reported_load: int = 0
+    local_in_flight: int = 0
+    failures: int = 0
+    ejected_until: float = 0.0
+    last_checked: float = 0.0
+    stats: Dict = field(default_factory=dict)
+
+    def available(self, now: float) -> bool:
+        return self.healthy and now >= self.ejected_until
+
+    def load(self) -> int:
+        return self.reported_load + self.local_in_flight + (LOADING_PENALTY if self.loading else 0)
+
+
+def _health_url(url: str, path: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}{path}"
+
+
+class Registry:
+    def __init__(self, urls: Dict[str, List[str]]):
+        self.replicas = {
+            service: [Replica(u, _health_url(u, SERVICE_HEALTH_PATHS.get(service, "/health"))) for u in service_urls]
+            for service, service_urls in urls.items()
+        }
+        self._loop = None
+        self._poller = None
+        self._client = None
+
+    def _ensure_polling(self):
+        # 在 http_pool 的事件循环中懒启动（fork 后事件循环重建，随之重启）；只有一个副本时无需轮询
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop and any(len(r) > 1 for r in self.replicas.values()):
+            self._loop = loop
+            self._client = httpx.AsyncClient(timeout=HEALTH_CHECK_TIMEOUT)
+            self._poller = loop.create_task(self._poll_forever())
+
+    async def _poll_forever(self):
+        while True:
+            await asyncio.gather(*(self._check(r) for rs in self.replicas.values() for r in rs))
+            await asyncio.sleep(HEALTH_CHECK_INTERVAL)
+
+    async def _check(self, replica: Replica):
+        try:
+            response = await self._client.get(replica.health_url)
+            data = response.json() if response.headers.get("content-type", "").startswith("application/json") else {}
+            status = data.get("status", "healthy")
+            replica.healthy = response.status_code == 200 and status not in ("unhealthy", "failed")
+            replica.loading = status == "loading"
+            replica.reported_load = int(data.get("in_flight", 0)) + int(data.get("queue_depth", 0))
+            replica.stats = {k: data[k] for k in ("in_flight", "queue_depth") if k in data}
+        except (httpx.HTTPError, ValueError):
+            replica.healthy = False
+        replica.last_checked = time.time()
+
+    def pick(self, service: str) -> Replica:
+        self._ensure_polling()
+        replicas = self.replicas[service]
+        now = time.time()
+        candidates = [r for r in replicas if r.available(now)] or replicas
+        lowest = min(r.load() for r in candidates)
+        return random.choice([r for r in candidates if r.load() == lowest])
+
+    @asynccontextmanager
+    async def route(self, service: str):
+        """选定副本并记录本进程的在途请求；调用方在失败时调用 failed()"""
+        replica = self.pick(service)
+        replica.local_in_flight += 1
+        try:
+            yield replica
+        finally:
+            replica.local_in_flight -= 1
+
+    def succeeded(self, replica: Replica):
+        replica.failures = 0
+
+    def failed(self, replica: Replica):
+        replica.failures += 1
+        if replica.failures >= EJECT_AFTER_FAILURES:
+            replica.ejected_until = time.time() + EJECT_SECONDS
+            replica.failures = 0
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        return {
+            service: [
+                {
+                    "url": r.url,
+                    "healthy": r.healthy,
+                    "loading": r.loading,
+                    "ejected": now < r.ejected_until,
+                    "load": r.load(),
+                    "local_in_flight": r.local_in_flight,
+                    **r.stats,
+                }
+                for r in replicas
+            ]
+            for service, replicas in self.replicas.items()
+        }
+
+
+registry = Registry(SERVICE_URLS)
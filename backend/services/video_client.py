@@ -1,16 +1,12 @@
-import requests
+from pathlib import Path
+from services.http_pool import post_for_artifact
 
-def generate_video(image_url: str, audio_url: str, duration: int) -> bytes:
+
+async def generate_video(image_url: str, audio_url: str, duration: int, dest: str):
     payload = {
         "image_url": image_url,
         "audio_url": audio_url,
-        "duration": duration  # 秒
+        "duration": duration,  # 秒
+        "task_id": Path(dest).stem  # 供 video-gen 按任务上报分段进度
     }
-    
-    response = requests.post(
-        "http://video-gen:8002/generate",
-        json=payload,
-        timeout=3600  # 1小时超时（10分钟视频需较长时间）
-    )
-    response.raise_for_status()
-    return response.content
\ No newline at end of file
+    await post_for_artifact("video", payload, dest)
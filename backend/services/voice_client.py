@@ -1,20 +1,146 @@
-import requests
+import asyncio
+import re
+import struct
 import base64
+import tempfile
+from pathlib import Path
+from typing import AsyncIterator, Callable, List, Optional
+from config import (
+    FISH_SPEECH_URLS, TTS_SEGMENT_CHARS,
+    TTS_REQUESTS_PER_REPLICA, TTS_CROSSFADE_MS, TTS_PAUSE_MS, VOICE_INLINE_REFERENCE,
+)
+from services.audio_stitch import stitch_wavs
+from services.http_pool import post_to_file, post_stream
+import voices
 
-def clone_voice(text: str, audio_path: str) -> bytes:
-    with open(audio_path, "rb") as f:
-        audio_b64 = base64.b64encode(f.read()).decode()
-    
+WAV_HEADER_SIZE = 44
+# 流式输出时总长度未知，按惯例把 RIFF/data 大小填为最大值
+STREAMING_SIZE = 0xFFFFFFFF
+
+_SENTENCE_END = re.compile(r'(?<=[。！？；!?;…\n])|(?<=\.)\s')
+
+
+def _reference_fields(voice_id: str) -> dict:
+    """默认只传 reference_id，由 fish-speech 从共享的 references/ 目录读取"""
+    if not VOICE_INLINE_REFERENCE:
+        return {"reference_id": voice_id}
+    with open(voices.reference_file(voice_id), "rb") as f:
+        return {"reference_audio": base64.b64encode(f.read()).decode()}
+
+
+async def _synthesize(text: str, reference: dict, dest):
     payload = {
         "text": text,
-        "reference_audio": audio_b64,
+        **reference,
         "format": "wav"
     }
-    
-    response = requests.post(
-        "http://fish-speech:8000/v1/tts",
-        json=payload,
-        timeout=600  # 10分钟超时
-    )
-    response.raise_for_status()
-    return response.content
\ No newline at end of file
+    await post_to_file("voice", payload, dest)
+
+
+async def clone_voice(text: str, voice_id: str, dest: str,
+                      on_progress: Optional[Callable[[int, int], None]] = None):
+    """
+    长文本按句切分后并发分发到各 fish-speech 副本，再按原顺序拼接写入 dest。
+    参考音频（若需内联）只编码一次，所有分段共用。
+    on_progress(done, total) 在每个分段完成后调用。
+    """
+    reference = _reference_fields(voice_id)
+    segments = split_sentences(text)
+    report = on_progress or (lambda done, total: None)
+    report(0, max(1, len(segments)))
+    if len(segments) <= 1:
+        await _synthesize(text, reference, dest)
+        report(1, 1)
+        return
+
+    # 每个副本同时处理的请求数受 TTS_REQUESTS_PER_REPLICA 限制
+    limit = asyncio.Semaphore(len(FISH_SPEECH_URLS) * TTS_REQUESTS_PER_REPLICA)
+
+    done = 0
+
+    async def _segment(i, segment, path):
+        nonlocal done
+        async with limit:
+            # 每段独立路由到当前负载最低的副本
+            await _synthesize(segment, reference, path)
+        done += 1
+        report(done, len(segments))
+
+    with tempfile.TemporaryDirectory(dir=Path(dest).parent) as tmpdir:
+        paths = [Path(tmpdir) / f"{i:05d}.wav" for i in range(len(segments))]
+        await asyncio.gather(*(_segment(i, seg, p) for i, (seg, p) in enumerate(zip(segments, paths))))
+        wavs = [p.read_bytes() for p in paths]
+    Path(dest).write_bytes(stitch_wavs(wavs, crossfade_ms=TTS_CROSSFADE_MS, pause_ms=TTS_PAUSE_MS))
+
+
+def split_sentences(text: str, max_chars: int = TTS_SEGMENT_CHARS) -> List[str]:
+    """按句末标点切分，再把短句合并到不超过 max_chars 的段落"""
+    sentences = [s.strip() for s in _SENTENCE_END.split(text) if s and s.strip()]
+    segments, current = [], ""
+    for sentence in sentences:
+        # 超长的单句按长度硬切
+        while len(sentence) > max_chars:
+            if current:
+                segments.append(current)
+                current = ""
+            segments.append(sentence[:max_chars])
+            sentence = sentence[max_chars:]
+        if current and len(current) + len(sentence) + 1 > max_chars:
+            segments.append(current)
+            current = ""
+        current = f"{current} {sentence}".strip() if current and current[-1].isascii() else current + sentence
+    if current:
+        segments.append(current)
+    return segments
+
+
+def streaming_wav_header(header: bytes) -> bytes:
+    """把 fish-speech 返回的 WAV 头中的长度字段改为流式占位值"""
+    header = bytearray(header[:WAV_HEADER_SIZE])
+    struct.pack_into("<I", header, 4, STREAMING_SIZE)
+    struct.pack_into("<I", header, 40, STREAMING_SIZE)
+    return bytes(header)
+
+
+def finalize_wav(path: str):
+    """流式写完后回填 RIFF / data 长度，使文件成为标准 WAV"""
+    with open(path, "r+b") as f:
+        f.seek(0, 2)
+        size = f.tell()
+        f.seek(4)
+        f.write(struct.pack("<I", size - 8))
+        f.seek(40)
+        f.write(struct.pack("<I", size - WAV_HEADER_SIZE))
+
+
+async def stream_voice(text: str, voice_id: str) -> AsyncIterator[bytes]:
+    """
+    逐句请求 fish-speech 的流式合成，边收边产出。
+    产出的字节拼起来是一个完整的（长度占位的）WAV：只保留第一段的 WAV 头，后续段去掉头部。
+    """
+    reference = _reference_fields(voice_id)
+    header_sent = False
+    for segment in split_sentences(text):
+        payload = {
+            "text": segment,
+            **reference,
+            "format": "wav",
+            "streaming": True,
+        }
+        pending = b""
+        in_header = True
+        async for chunk in post_stream("voice", payload):
+            if not chunk:
+                continue
+            if in_header:
+                pending += chunk
+                if len(pending) < WAV_HEADER_SIZE:
+                    continue
+                if not header_sent:
+                    yield streaming_wav_header(pending)
+                    header_sent = True
+                chunk = pending[WAV_HEADER_SIZE:]
+                in_header = False
+                if not chunk:
+                    continue
+            yield chunk
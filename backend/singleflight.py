@@ -0,0 +1,75 @@
+# backend/singleflight.py
+"""
+相同输入的进行中任务合并（single-flight）。
+
+以缓存键为协调点：第一个提交者在 Redis 中占位并入队，成为 leader；
+在其完成前提交的相同请求只登记一个 task_id -> leader job_id 的别名，
+查询状态时直接读取 leader 任务，因此所有跟随者看到完全相同的状态变化。
+多个 uvicorn worker 之间通过 Redis 的 SET NX 保证只有一个 leader。
+"""
+from typing import Optional
+
+from rq.job import Job
+from rq.exceptions import NoSuchJobError
+
+INFLIGHT_PREFIX = "inflight:"   # cache_key -> leader job_id
+ALIAS_PREFIX = "task_alias:"    # 跟随者 task_id -> leader job_id
+ALIAS_TTL = 24 * 3600
+
+# 仅当占位仍属于该 job 时才删除，避免误删后来者的占位
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_DEAD_STATUSES = {"failed", "stopped", "canceled"}
+
+
+def _leader_alive(conn, job_id: str) -> bool:
+    try:
+        job = Job.fetch(job_id, connection=conn)
+    except NoSuchJobError:
+        # leader 已占位但尚未完成入队；占位本身带 TTL，不会永久悬挂
+        return True
+    if job.get_status() in _DEAD_STATUSES:
+        return False
+    return (job.meta or {}).get("status") != "failed"
+
+
+def claim(conn, key: str, task_id: str, ttl: int) -> Optional[str]:
+    """
+    尝试成为 key 的 leader。
+    成功返回 None，调用方应以 job_id=task_id 入队；
+    否则返回已有 leader 的 job_id，并为 task_id 登记别名。
+    """
+    for _ in range(3):
+        if conn.set(INFLIGHT_PREFIX + key, task_id, nx=True, ex=ttl):
+            return None
+
+        leader = conn.get(INFLIGHT_PREFIX + key)
+        if leader is None:
+            # leader 刚好完成并释放，重新抢占
+            continue
+        leader = leader.decode()
+        if not _leader_alive(conn, leader):
+            # leader 所在 worker 崩溃或任务已失败，清理占位后重试
+            release(conn, key, leader)
+            continue
+
+        conn.setex(ALIAS_PREFIX + task_id, ALIAS_TTL, leader)
+        return leader
+
+    # 竞争过于激烈时退化为独立执行
+    return None
+
+
+def release(conn, key: str, job_id: str):
+    conn.eval(_RELEASE_SCRIPT, 1, INFLIGHT_PREFIX + key, job_id)
+
+
+def resolve(conn, task_id: str) -> str:
+    """把跟随者的 task_id 映射到实际执行的 job_id"""
+    leader = conn.get(ALIAS_PREFIX + task_id)
+    return leader.decode() if leader else task_id
@@ -0,0 +1,261 @@
+# backend/task_store.py
+"""
+任务状态记录：API 提交时创建、worker 每次更新 job.meta 时同步，状态查询只读这里，
+不依赖 RQ job 是否仍在 Redis 中（job 在 JOB_RESULT_TTL 后即被 RQ 删除）。
+
+- task:<task_id>        hash: status / stage / url / error / job / files / created / updated
+  job 为实际承载结果的 job_id（single-flight 跟随者指向 leader，命中缓存时为空）；
+  files 为该任务独占的产物文件（换行分隔），记录到期时一并删除
+- task:state:<status>   zset: task_id -> 最近更新时间，按状态列出任务（跟随者不入索引，状态以 leader 为准）
+- task:expiry           zset: task_id -> 到期时间；未结束的任务为 创建 + job 超时 + TASK_TTL，结束后重置为 结束 + TASK_TTL
+
+janitor 定期删除到期记录及其文件；把 RQ 中已失败或丢失（worker 崩溃）但记录仍未结束的任务补记为 failed，
+依赖已失败或丢失、永远不会被调度的 deferred 任务同样补记为 failed；
+并清理 uploads/ 中超过 UPLOAD_TTL 的残留上传（正常登记后上传文件已移入 references/）。
+多个 backend 进程之间以 Redis 锁保证每个周期只有一个执行。
+"""
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from rq.job import Job
+
+from config import TASK_TTL, UPLOAD_DIR, UPLOAD_TTL, JANITOR_INTERVAL
+import progress
+
+logger = logging.getLogger(__name__)
+
+TASK_PREFIX = "task:"
+STATE_PREFIX = "task:state:"
+EXPIRY_KEY = "task:expiry"
+JANITOR_LOCK = "task:janitor"
+STATES = ("pending", "processing", "completed", "failed")
+TERMINAL = ("completed", "failed")
+SWEEP_BATCH = 500
+# 提交时先登记记录再入队，留出余量避免把刚提交的任务误判为丢失
+RECONCILE_GRACE = 60
+_DEAD_JOB_STATUSES = {"failed", "stopped", "canceled"}
+
+
+def _decode(raw: dict) -> dict:
+    return {k.decode(): v.decode() for k, v in raw.items()}
+
+
+def create(conn, task_id: str, job_id: Optional[str] = None, status: str = "pending",
+           url: Optional[str] = None, timeout: int = 0):
+    """
+    提交时（入队之前）登记任务；timeout 为 job 超时，任务未结束前记录不会到期。
+    job_id 为空表示命中缓存无需执行，与 task_id 不同表示挂靠到进行中的 leader。
+    """
+    now = time.time()
+    record = {"status": status, "job": job_id or "", "created": now, "updated": now}
+    if url:
+        record["url"] = url
+    pipe = conn.pipeline()
+    pipe.hset(TASK_PREFIX + task_id, mapping=record)
+    if job_id in (None, task_id):
+        pipe.zadd(STATE_PREFIX + status, {task_id: now})
+    pipe.zadd(EXPIRY_KEY, {task_id: now + (0 if status in TERMINAL else timeout) + TASK_TTL})
+    pipe.execute()
+
+
+def update(conn, task_id: str, status: Optional[str] = None, files: Iterable = (), **fields):
+    """worker 同步状态；值为 None 的字段不覆盖"""
+    now = time.time()
+    record = {k: v for k, v in fields.items() if v is not None}
+    record["updated"] = now
+    if files:
+        record["files"] = "\n".join(str(f) for f in files)
+    pipe = conn.pipeline()
+    if status:
+        record["status"] = status
+        for state in STATES:
+            if state != status:
+                pipe.zrem(STATE_PREFIX + state, task_id)
+        pipe.zadd(STATE_PREFIX + status, {task_id: now})
+    if status in TERMINAL:
+        pipe.zadd(EXPIRY_KEY, {task_id: now + TASK_TTL})
+    else:
+        # 升级前入队、没有提交记录的任务也能到期
+        pipe.zadd(EXPIRY_KEY, {task_id: now + TASK_TTL}, nx=True)
+    pipe.hset(TASK_PREFIX + task_id, mapping=record)
+    pipe.execute()
+
+
+def _status(record: dict, source: dict, progress_raw: dict) -> dict:
+    return {
+        "status": source.get("status", "pending"),
+        "stage": source.get("stage") or None,
+        "result_url": source.get("url") or None,
+        "error": source.get("error") or None,
+        "job": record.get("job") or None,
+        "progress": progress.parse(progress_raw),
+    }
+
+
+def get_many(conn, task_ids: List[str]) -> Dict[str, Optional[dict]]:
+    """
+    批量读取状态，与数量无关地固定两次往返：先取任务记录，
+    再取跟随者对应的 leader 记录与各 job 的推理进度。记录不存在或 leader 已到期时为 None。
+    """
+    pipe = conn.pipeline()
+    for task_id in task_ids:
+        pipe.hgetall(TASK_PREFIX + task_id)
+    records = [_decode(raw) for raw in pipe.execute()]
+
+    jobs = [r.get("job") or task_id for task_id, r in zip(task_ids, records)]
+    pipe = conn.pipeline()
+    for job_id in jobs:
+        pipe.hgetall(TASK_PREFIX + job_id)
+        pipe.hgetall(progress.PROGRESS_PREFIX + job_id)
+    replies = pipe.execute()
+
+    result = {}
+    for i, (task_id, record) in enumerate(zip(task_ids, records)):
+        leader, progress_raw = replies[2 * i], replies[2 * i + 1]
+        if not record:
+            result[task_id] = None
+            continue
+        source = _decode(leader) if jobs[i] != task_id else record
+        result[task_id] = _status(record, source, progress_raw) if source else None
+    return result
+
+
+def get(conn, task_id: str) -> Optional[dict]:
+    return get_many(conn, [task_id])[task_id]
+
+
+def list_by_status(conn, status: str, limit: int = 100, offset: int = 0) -> List[str]:
+    """按最近更新时间倒序列出某状态的任务"""
+    return [t.decode() for t in conn.zrevrange(STATE_PREFIX + status, offset, offset + limit - 1)]
+
+
+def counts(conn) -> dict:
+    pipe = conn.pipeline()
+    for state in STATES:
+        pipe.zcard(STATE_PREFIX + state)
+    return dict(zip(STATES, pipe.execute()))
+
+
+def _dead_dependencies(conn, jobs: List[Job]) -> Dict[str, str]:
+    """
+    deferred job 在依赖失败或丢失后 RQ 不会再调度，也不会标记失败，会一直停在 deferred；
+    返回其中依赖已死的 job_id -> 错误信息（依赖集合与依赖 job 各一次往返）
+    """
+    pipe = conn.pipeline()
+    for job in jobs:
+        pipe.smembers(job.dependencies_key)
+    dependencies = {job.id: [d.decode() for d in ids] for job, ids in zip(jobs, pipe.execute())}
+    dependency_ids = sorted({d for ids in dependencies.values() for d in ids})
+    dead = {}
+    for dep_id, dep in zip(dependency_ids, Job.fetch_many(dependency_ids, connection=conn)):
+        if dep is None:
+            dead[dep_id] = f"Dependency {dep_id} lost before completion"
+        elif dep.get_status(refresh=False) in _DEAD_JOB_STATUSES:
+            dead[dep_id] = f"Dependency {dep_id} failed"
+    return {
+        job_id: dead[next(d for d in ids if d in dead)]
+        for job_id, ids in dependencies.items()
+        if any(d in dead for d in ids)
+    }
+
+
+def reconcile(conn, now: Optional[float] = None) -> int:
+    """
+    worker 崩溃或 job 被 RQ 直接判失败时不会写回 meta，按 RQ 状态补记为 failed；
+    依赖已失败或丢失的 deferred job 永远不会执行，取消该 job 并同样补记为 failed
+    """
+    now = now or time.time()
+    task_ids = [
+        t.decode()
+        for state in ("pending", "processing")
+        for t in conn.zrangebyscore(STATE_PREFIX + state, 0, now - RECONCILE_GRACE)
+    ]
+    failed = 0
+    for start in range(0, len(task_ids), SWEEP_BATCH):
+        batch = task_ids[start:start + SWEEP_BATCH]
+        jobs = Job.fetch_many(batch, connection=conn)
+        deferred = [job for job in jobs if job is not None and job.get_status(refresh=False) == "deferred"]
+        orphaned = _dead_dependencies(conn, deferred) if deferred else {}
+        for task_id, job in zip(batch, jobs):
+            if job is None:
+                error = "Job lost before completion"
+            elif job.get_status(refresh=False) in _DEAD_JOB_STATUSES:
+                error = job.exc_info.strip().splitlines()[-1] if job.exc_info else "Job failed"
+            elif job.id in orphaned:
+                error = orphaned[job.id]
+                job.cancel()
+            else:
+                continue
+            update(conn, task_id, status="failed", error=error)
+            failed += 1
+    return failed
+
+
+def _remove_files(paths: Iterable[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.warning(f"Failed to remove {path}: {e}")
+
+
+def expire(conn, now: Optional[float] = None) -> int:
+    """删除到期的任务记录、状态索引与产物文件，返回删除的任务数"""
+    now = now or time.time()
+    removed = 0
+    while True:
+        expired = [t.decode() for t in conn.zrangebyscore(EXPIRY_KEY, 0, now, start=0, num=SWEEP_BATCH)]
+        if not expired:
+            return removed
+        pipe = conn.pipeline()
+        for task_id in expired:
+            pipe.hget(TASK_PREFIX + task_id, "files")
+        files = pipe.execute()
+
+        pipe = conn.pipeline()
+        for task_id in expired:
+            pipe.delete(TASK_PREFIX + task_id)
+            for state in STATES:
+                pipe.zrem(STATE_PREFIX + state, task_id)
+        pipe.zrem(EXPIRY_KEY, *expired)
+        pipe.execute()
+        # 先删记录再删文件：查询不会看到指向已删除文件的 completed 状态
+        _remove_files(p for f in files if f for p in f.decode().split("\n"))
+        removed += len(expired)
+
+
+def sweep_uploads(now: Optional[float] = None) -> int:
+    """删除 uploads/ 中登记失败或中途中断遗留的上传文件"""
+    now = now or time.time()
+    directory = Path(UPLOAD_DIR)
+    if not directory.is_dir():
+        return 0
+    stale = [p for p in directory.iterdir() if p.is_file() and now - p.stat().st_mtime > UPLOAD_TTL]
+    _remove_files(stale)
+    return len(stale)
+
+
+def run_janitor(conn):
+    """后台线程：每 JANITOR_INTERVAL 秒清理一次，多进程间由锁去重"""
+    while True:
+        try:
+            if conn.set(JANITOR_LOCK, os.getpid(), nx=True, ex=max(1, int(JANITOR_INTERVAL) - 1)):
+                failed, tasks, uploads = reconcile(conn), expire(conn), sweep_uploads()
+                if failed or tasks or uploads:
+                    logger.info(
+                        f"Janitor marked {failed} lost tasks failed, removed {tasks} expired tasks "
+                        f"and {uploads} stale uploads"
+                    )
+        except Exception as e:
+            logger.warning(f"Janitor run failed: {e}")
+        time.sleep(JANITOR_INTERVAL)
+
+
+def start_janitor(conn):
+    threading.Thread(target=run_janitor, args=(conn,), name="task-janitor", daemon=True).start()
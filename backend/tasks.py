@@ -1,69 +1,191 @@
 import os
+import time
 from pathlib import Path
 from rq import get_current_job
+import cache
+import config
+import events
+import metrics
+import progress
+import queues
+import singleflight
+import task_store
+from services.http_pool import run
 from services.image_client import generate_image
-from services.voice_client import clone_voice
+from services.voice_client import clone_voice, stream_voice, finalize_wav
 from services.video_client import generate_video
 
-OUTPUT_DIR = Path("/app/static/outputs")
+OUTPUT_DIR = Path(config.OUTPUT_DIR)
 OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
 
-def async_generate_image(task_id: str, text: str):
+def _record_runtime(job, stage: str, started: float):
+    """阶段完成：更新准入控制用的平均耗时，并记入本 worker 的耗时直方图"""
+    seconds = time.time() - started
+    queues.record_runtime(job.connection, stage, seconds)
+    metrics.STAGE_DURATION.labels(stage).observe(seconds)
+
+def _save_meta(job, files=()):
+    """保存 job.meta，同步到任务状态记录，并通知订阅该任务的 SSE 连接；files 为本任务独占的产物文件"""
+    job.save_meta()
+    meta = job.meta
+    task_store.update(
+        job.connection, job.id,
+        status=meta.get("status"),
+        stage=meta.get("stage"),
+        url=meta.get("result_url"),
+        error=meta.get("error"),
+        files=files,
+    )
+    events.notify(job.connection, job.id)
+
+def async_generate_image(task_id: str, text: str, cache_key: str = None):
     job = get_current_job()
     try:
+        output_path = OUTPUT_DIR / f"{task_id}.png"
         job.meta.update({"status": "processing", "stage": "image"})
-        job.save_meta()
+        _save_meta(job, files=[output_path])
         
-        image_data = generate_image(text)
-        output_path = OUTPUT_DIR / f"{task_id}.png"
-        with open(output_path, "wb") as f:
-            f.write(image_data)
-            
+        started = time.time()
+        run(generate_image(text, str(output_path)))
+        _record_runtime(job, "image", started)
+
+        if cache_key:
+            cache.store(job.connection, cache_key, str(output_path))
+
         job.meta.update({
             "status": "completed",
             "result_url": f"/outputs/{task_id}.png"
         })
-        job.save_meta()
+        _save_meta(job)
     except Exception as e:
         job.meta.update({"status": "failed", "error": str(e)})
-        job.save_meta()
+        _save_meta(job)
+    finally:
+        if cache_key:
+            singleflight.release(job.connection, cache_key, job.id)
 
-def async_clone_voice(task_id: str, text: str, audio_path: str):
+def async_clone_voice(task_id: str, text: str, voice_id: str, cache_key: str = None):
     job = get_current_job()
     try:
+        output_path = OUTPUT_DIR / f"{task_id}.wav"
         job.meta.update({"status": "processing", "stage": "voice"})
-        job.save_meta()
+        _save_meta(job, files=[output_path])
         
-        audio_data = clone_voice(text, audio_path)
+        started = time.time()
+        run(clone_voice(
+            text, voice_id, str(output_path),
+            on_progress=lambda done, total: progress.publish(job.connection, task_id, "tts", done, total, started),
+        ))
+        _record_runtime(job, "voice", started)
+
+        if cache_key:
+            cache.store(job.connection, cache_key, str(output_path))
+
+        job.meta.update({
+            "status": "completed",
+            "result_url": f"/outputs/{task_id}.wav"
+        })
+        _save_meta(job)
+    except Exception as e:
+        job.meta.update({"status": "failed", "error": str(e)})
+        _save_meta(job)
+    finally:
+        if cache_key:
+            singleflight.release(job.connection, cache_key, job.id)
+
+async def _write_stream(job, text: str, voice_id: str, output_path: Path) -> int:
+    written = 0
+    last_report = time.time()
+    with open(output_path, "wb") as f:
+        async for chunk in stream_voice(text, voice_id):
+            f.write(chunk)
+            f.flush()
+            written += len(chunk)
+            if time.time() - last_report > 1:
+                job.meta["bytes_written"] = written
+                _save_meta(job)
+                last_report = time.time()
+    return written
+
+def async_clone_voice_stream(task_id: str, text: str, voice_id: str, cache_key: str = None):
+    """流式合成：逐句写盘，API 端通过 /api/voice/stream/{task_id} 边写边推给客户端"""
+    job = get_current_job()
+    try:
         output_path = OUTPUT_DIR / f"{task_id}.wav"
-        with open(output_path, "wb") as f:
-            f.write(audio_data)
-            
+        job.meta.update({"status": "processing", "stage": "voice", "streaming": True, "bytes_written": 0})
+        _save_meta(job, files=[output_path])
+
+        started = time.time()
+        written = run(_write_stream(job, text, voice_id, output_path))
+        _record_runtime(job, "voice", started)
+        finalize_wav(str(output_path))
+
+        if cache_key:
+            cache.store(job.connection, cache_key, str(output_path))
+
         job.meta.update({
             "status": "completed",
+            "bytes_written": written,
             "result_url": f"/outputs/{task_id}.wav"
         })
-        job.save_meta()
+        _save_meta(job)
     except Exception as e:
         job.meta.update({"status": "failed", "error": str(e)})
-        job.save_meta()
+        _save_meta(job)
+    finally:
+        if cache_key:
+            singleflight.release(job.connection, cache_key, job.id)
 
-def async_generate_video(task_id: str, image_url: str, audio_url: str, duration: int):
+def async_generate_video(task_id: str, image_url: str, audio_url: str, duration: int, cache_key: str = None):
     job = get_current_job()
     try:
+        output_path = OUTPUT_DIR / f"{task_id}.mp4"
         job.meta.update({"status": "processing", "stage": "video"})
-        job.save_meta()
+        _save_meta(job, files=[output_path])
         
-        video_data = generate_video(image_url, audio_url, duration)
-        output_path = OUTPUT_DIR / f"{task_id}.mp4"
-        with open(output_path, "wb") as f:
-            f.write(video_data)
-            
+        started = time.time()
+        run(generate_video(image_url, audio_url, duration, str(output_path)))
+        _record_runtime(job, "video", started)
+
+        if cache_key:
+            cache.store(job.connection, cache_key, str(output_path))
+
         job.meta.update({
             "status": "completed",
             "result_url": f"/outputs/{task_id}.mp4"
         })
-        job.save_meta()
+        _save_meta(job)
     except Exception as e:
         job.meta.update({"status": "failed", "error": str(e)})
-        job.save_meta()
\ No newline at end of file
+        _save_meta(job)
+    finally:
+        if cache_key:
+            singleflight.release(job.connection, cache_key, job.id)
+
+def _stage_result_url(conn, ref: dict) -> str:
+    if "url" in ref:
+        return ref["url"]
+    state = task_store.get(conn, ref["job_id"]) or {}
+    if state.get("status") != "completed":
+        raise RuntimeError(f"Upstream stage {ref['job_id']} did not complete: {state.get('error')}")
+    return state["result_url"]
+
+def async_generate_pipeline_video(task_id: str, image: dict, voice: dict, duration: int):
+    """流水线的 video 阶段：image/voice 阶段完成后由 RQ depends_on 触发"""
+    job = get_current_job()
+    try:
+        image_url = _stage_result_url(job.connection, image)
+        audio_url = _stage_result_url(job.connection, voice)
+    except Exception as e:
+        job.meta.update({"status": "failed", "stage": "video", "error": str(e)})
+        _save_meta(job)
+        return
+
+    cache_key = cache.video_key(image_url, audio_url, duration)
+    cached_url = cache.lookup(job.connection, cache_key)
+    if cached_url:
+        job.meta.update({"status": "completed", "stage": "video", "result_url": cached_url})
+        _save_meta(job)
+        return
+
+    async_generate_video(task_id, image_url, audio_url, duration, cache_key=cache_key)
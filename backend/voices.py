@@ -0,0 +1,71 @@
+# backend/voices.py
+"""
+参考音色登记表：按音频内容哈希去重，存入 fish-speech 挂载的 references/ 目录。
+
+目录结构遵循 fish-speech 的约定：references/<voice_id>/reference.<ext> + reference.lab（参考音频文本），
+之后合成请求只需携带 reference_id，fish-speech 侧也只需提取一次参考特征。
+"""
+import os
+import shutil
+import time
+from pathlib import Path
+from typing import Optional
+
+from cache import file_digest
+from config import REFERENCES_DIR
+
+VOICE_PREFIX = "voices:"  # hash: filename / size / created / last_used
+
+
+def voice_dir(voice_id: str) -> Path:
+    return Path(REFERENCES_DIR) / voice_id
+
+
+def reference_file(voice_id: str) -> Optional[Path]:
+    directory = voice_dir(voice_id)
+    for suffix in (".wav", ".mp3"):
+        path = directory / f"reference{suffix}"
+        if path.exists():
+            return path
+    return None
+
+
+def register(conn, upload_path: str, reference_text: str = "") -> str:
+    """登记上传的参考音频并删除上传文件，返回 voice_id；相同音频重复上传只保存一次"""
+    upload = Path(upload_path)
+    voice_id = f"ref_{file_digest(str(upload))[:32]}"
+    directory = voice_dir(voice_id)
+
+    if reference_file(voice_id) is None:
+        tmp = Path(REFERENCES_DIR) / f".{voice_id}.{os.getpid()}.tmp"
+        tmp.mkdir(parents=True, exist_ok=True)
+        shutil.move(str(upload), tmp / f"reference{upload.suffix.lower()}")
+        (tmp / "reference.lab").write_text(reference_text, encoding="utf-8")
+        try:
+            # 原子重命名；并发登记同一音频时后到者放弃自己的副本
+            os.rename(tmp, directory)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+        conn.hset(VOICE_PREFIX + voice_id, mapping={
+            "filename": upload.name,
+            "size": reference_file(voice_id).stat().st_size,
+            "created": time.time(),
+        })
+    else:
+        upload.unlink(missing_ok=True)
+        if reference_text and not (directory / "reference.lab").read_text(encoding="utf-8"):
+            (directory / "reference.lab").write_text(reference_text, encoding="utf-8")
+
+    conn.hset(VOICE_PREFIX + voice_id, "last_used", time.time())
+    return voice_id
+
+
+def exists(voice_id: str) -> bool:
+    # voice_id 会拼进路径，只接受登记时生成的格式
+    if not voice_id.startswith("ref_") or not voice_id[4:].isalnum():
+        return False
+    return reference_file(voice_id) is not None
+
+
+def touch(conn, voice_id: str):
+    conn.hset(VOICE_PREFIX + voice_id, "last_used", time.time())
@@ -0,0 +1,21 @@
+# backend/worker.py
+"""
+带 Prometheus 指标的 RQ worker：rq worker --worker-class worker.MetricsWorker <queues>
+
+在 WORKER_METRICS_PORT 上暴露本进程的入队→开始等待时间、各阶段耗时与模型服务请求耗时。
+"""
+from prometheus_client import start_http_server
+from rq.worker import SimpleWorker
+
+from config import WORKER_METRICS_PORT
+import metrics
+
+
+class MetricsWorker(SimpleWorker):
+    def work(self, *args, **kwargs):
+        start_http_server(WORKER_METRICS_PORT)
+        return super().work(*args, **kwargs)
+
+    def execute_job(self, job, queue):
+        metrics.observe_queue_wait(job)
+        return super().execute_job(job, queue)
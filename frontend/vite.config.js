@@ -8,6 +8,14 @@ export default defineConfig({
     port: 3000,
     // 代理后端请求（开发时避免 CORS）
     proxy: {
+      '/api': {
+        target: 'http://localhost:8000',
+        changeOrigin: true
+      },
+      '/outputs': {
+        target: 'http://localhost:8000',
+        changeOrigin: true
+      },
       '/generate': {
         target: 'http://localhost:8000',
         changeOrigin: true
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+CPU 推理模式基准：对比 fp32 / bf16 / 动态 int8 / torch.compile / IPEX 的
+延迟、峰值内存与生成图片相对 fp32 的相似度。
+
+每个模式在独立子进程中运行（通过 TORCH_DTYPE / QUANTIZE / COMPILE 环境变量选择，
+与服务运行时一致），这样峰值内存互不干扰。需要在对应服务的镜像内运行，例如：
+
+    docker compose run --rm -v ./scripts:/scripts qwen-image \\
+        python /scripts/benchmark_cpu_modes.py --service-dir /app --service qwen-image \\
+        --modes fp32,bf16,int8,bf16+torch --width 1664 --height 928 --steps 50
+
+模式写法：fp32 / bf16 / auto 选择精度，int8 开启动态量化，torch / ipex 选择编译方式，用 + 组合。
+"""
+import argparse
+import csv
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+DEFAULT_PROMPT = "一只在雨后街道上漫步的橘猫，霓虹灯倒影，电影感"
+
+
+def mode_env(mode: str) -> dict:
+    env = {"TORCH_DTYPE": "float32", "QUANTIZE": "none", "COMPILE": "none"}
+    for token in mode.split("+"):
+        if token in ("fp32", "bf16", "auto"):
+            env["TORCH_DTYPE"] = {"fp32": "float32", "bf16": "bfloat16", "auto": "auto"}[token]
+        elif token == "int8":
+            env["QUANTIZE"] = "int8"
+        elif token in ("torch", "ipex"):
+            env["COMPILE"] = token
+        else:
+            raise ValueError(f"Unknown mode token: {token}")
+    return env
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+# ---------------------------------------------------------------- 子进程：单个模式
+
+def _qwen_image(app, args):
+    import torch
+    pipe = app.load_pipeline()
+
+    def generate():
+        return pipe(
+            prompt=[args.prompt],
+            negative_prompt=[" "],
+            width=args.width,
+            height=args.height,
+            num_inference_steps=args.steps,
+            true_cfg_scale=app.DEFAULT_CFG_SCALE,
+            generator=[torch.Generator(device="cpu").manual_seed(args.seed)],
+        ).images[0]
+    return generate
+
+
+def _image_gen(app, args):
+    import torch
+    prior_pipe, decoder_pipe = app.load_pipelines()
+
+    def generate():
+        generator = torch.Generator(device="cpu").manual_seed(args.seed)
+        prior = prior_pipe(args.prompt, num_inference_steps=app.PRIOR_STEPS, generator=generator)
+        return decoder_pipe(
+            image_embeds=prior.image_embeds,
+            negative_image_embeds=prior.negative_image_embeds,
+            num_inference_steps=args.steps,
+            height=args.height,
+            width=args.width,
+            generator=generator,
+        ).images[0]
+    return generate
+
+
+SERVICES = {"qwen-image": _qwen_image, "image-gen": _image_gen}
+
+
+def run_worker(args):
+    # 只加载模型本身，不启动后台预加载 / 空闲卸载，也不上报进度
+    os.environ.update({"MODEL_PRELOAD": "false", "MODEL_IDLE_UNLOAD": "0"})
+    os.environ.pop("REDIS_URL", None)
+    sys.path.insert(0, str(args.service_dir or PROJECT_ROOT / "services" / args.service))
+    import app
+
+    started = time.perf_counter()
+    generate = SERVICES[args.service](app, args)
+    load_seconds = time.perf_counter() - started
+    rss_after_load = peak_rss_mb()
+
+    # 第一次推理包含 torch.compile / IPEX 的编译开销，单独记录
+    started = time.perf_counter()
+    image = generate()
+    first_seconds = time.perf_counter() - started
+    latencies = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        image = generate()
+        latencies.append(time.perf_counter() - started)
+
+    image.save(args.image_out)
+    print(json.dumps({
+        "load_seconds": round(load_seconds, 2),
+        "first_run_seconds": round(first_seconds, 2),
+        "latency_seconds": round(statistics.median(latencies), 2) if latencies else round(first_seconds, 2),
+        "peak_rss_after_load_mb": round(rss_after_load, 1),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    }))
+
+
+# ---------------------------------------------------------------- 相似度
+
+def psnr(a: np.ndarray, b: np.ndarray) -> float:
+    mse = np.mean((a - b) ** 2)
+    return float("inf") if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse))
+
+
+def block_ssim(a: np.ndarray, b: np.ndarray, block: int = 8) -> float:
+    """灰度图按 8x8 不重叠块计算 SSIM 后取平均"""
+    c1, c2 = (0.01 * 255) ** 2, (0.03 * 255) ** 2
+    h, w = (a.shape[0] // block) * block, (a.shape[1] // block) * block
+    a = a[:h, :w].reshape(h // block, block, w // block, block)
+    b = b[:h, :w].reshape(h // block, block, w // block, block)
+    mu_a, mu_b = a.mean(axis=(1, 3)), b.mean(axis=(1, 3))
+    var_a, var_b = a.var(axis=(1, 3)), b.var(axis=(1, 3))
+    cov = ((a - mu_a[:, None, :, None]) * (b - mu_b[:, None, :, None])).mean(axis=(1, 3))
+    ssim = ((2 * mu_a * mu_b + c1) * (2 * cov + c2)) / ((mu_a ** 2 + mu_b ** 2 + c1) * (var_a + var_b + c2))
+    return float(ssim.mean())
+
+
+def similarity(reference: Path, candidate: Path) -> dict:
+    ref = Image.open(reference).convert("RGB")
+    cand = Image.open(candidate).convert("RGB").resize(ref.size)
+    ref_rgb, cand_rgb = np.asarray(ref, dtype=np.float64), np.asarray(cand, dtype=np.float64)
+    ref_gray = np.asarray(ref.convert("L"), dtype=np.float64)
+    cand_gray = np.asarray(cand.convert("L"), dtype=np.float64)
+    return {
+        "psnr_db": round(psnr(ref_rgb, cand_rgb), 2),
+        "ssim": round(block_ssim(ref_gray, cand_gray), 4),
+        "mean_abs_diff": round(float(np.abs(ref_rgb - cand_rgb).mean()), 2),
+    }
+
+
+# ---------------------------------------------------------------- 主流程
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CPU inference modes against fp32")
+    parser.add_argument("--service", choices=sorted(SERVICES), default="qwen-image")
+    parser.add_argument("--service-dir", type=Path, help="服务 app.py 所在目录，默认 services/<service>")
+    parser.add_argument("--modes", default="fp32,bf16,int8", help="逗号分隔，第一个模式作为相似度基准")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--width", type=int, default=1664)
+    parser.add_argument("--height", type=int, default=928)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--runs", type=int, default=1, help="首次推理之后再计时的次数")
+    parser.add_argument("--output-dir", type=Path, default=Path("benchmark_results"))
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--image-out", type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    modes = [m.strip() for m in args.modes.split(",") if m.strip()]
+    results = []
+    for mode in modes:
+        image_out = args.output_dir / f"{args.service}_{mode.replace('+', '_')}.png"
+        cmd = [
+            sys.executable, __file__, "--worker",
+            "--service", args.service,
+            "--prompt", args.prompt,
+            "--width", str(args.width), "--height", str(args.height),
+            "--steps", str(args.steps), "--seed", str(args.seed), "--runs", str(args.runs),
+            "--image-out", str(image_out),
+        ]
+        if args.service_dir:
+            cmd += ["--service-dir", str(args.service_dir)]
+        print(f"▶ {mode} ...", file=sys.stderr)
+        proc = subprocess.run(cmd, env={**os.environ, **mode_env(mode)}, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(proc.stderr[-2000:], file=sys.stderr)
+            results.append({"mode": mode, "error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "failed"})
+            continue
+        result = {"mode": mode, **mode_env(mode), **json.loads(proc.stdout.strip().splitlines()[-1]), "image": str(image_out)}
+        results.append(result)
+        print(f"  {result['latency_seconds']}s, peak {result['peak_rss_mb']} MB", file=sys.stderr)
+
+    baseline = next((r for r in results if "error" not in r), None)
+    for r in results:
+        if "error" in r or baseline is None:
+            continue
+        r.update(similarity(Path(baseline["image"]), Path(r["image"])))
+        r["speedup"] = round(baseline["latency_seconds"] / r["latency_seconds"], 2)
+        r["memory_ratio"] = round(r["peak_rss_mb"] / baseline["peak_rss_mb"], 2)
+
+    report = {
+        "service": args.service,
+        "width": args.width,
+        "height": args.height,
+        "steps": args.steps,
+        "baseline": baseline["mode"] if baseline else None,
+        "results": results,
+    }
+    (args.output_dir / f"{args.service}_cpu_modes.json").write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    fields = sorted({k for r in results for k in r}, key=lambda k: (k != "mode", k))
+    with open(args.output_dir / f"{args.service}_cpu_modes.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(results)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
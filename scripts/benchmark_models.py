@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+单模型微基准：测各推理服务的耗时随分辨率、步数、帧数、线程数与批大小如何变化，
+用数据来定 DEFAULT_STEPS、MAX_BATCH_SIZE、线程数这类默认值。
+
+与 scripts/loadtest.py（编排层端到端压测）互补：这里直接在进程内调用服务 app.py 里的 pipeline，
+不经过 HTTP。每个配置记录每步耗时、总耗时、该配置期间的峰值内存与输出像素统计，写成 JSON + CSV。
+
+    # 服务镜像内，真实权重
+    docker compose run --rm -v ./scripts:/scripts qwen-image \\
+        python /scripts/benchmark_models.py --service-dir /app --service qwen-image \\
+        --aspect-ratios 1:1,16:9 --steps 20,50 --threads 8,16 --batch-sizes 1,2
+
+    # 随机初始化的小模型，不下载权重，适合在 CI 中跑通并观察相对趋势
+    python scripts/benchmark_models.py --service image-gen --tiny --sizes 256x256,512x512 --steps 4,8
+
+--tiny 时 image-gen 只测 decoder（prior 需要 CLIP 分词器文件），video-gen 与 qwen-image 直接传入
+随机的 prompt_embeds，跳过文本编码器。TORCH_DTYPE / QUANTIZE / COMPILE 与服务运行时一样生效。
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+DEFAULT_PROMPT = "一只在雨后街道上漫步的橘猫，霓虹灯倒影，电影感"
+
+
+def parse_list(value: str, cast=int) -> list:
+    return [cast(v.strip()) for v in value.split(",") if v.strip()]
+
+
+def parse_size(value: str):
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+
+# ---------------------------------------------------------------- 内存与计时
+
+def reset_peak_rss() -> bool:
+    """Linux 下写 /proc/self/clear_refs 可把 VmHWM 重置为当前 RSS，从而得到每个配置自己的峰值"""
+    try:
+        Path("/proc/self/clear_refs").write_text("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb() -> float:
+    try:
+        for line in Path("/proc/self/status").read_text().splitlines():
+            if line.startswith("VmHWM"):
+                return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StepTimer:
+    """通过 pipeline 的步回调记录每一步的完成时间；兼容新旧两种回调接口"""
+
+    def __init__(self):
+        self.started = None
+        self.marks = []
+
+    def start(self):
+        self.started = time.perf_counter()
+        self.marks = []
+
+    def callback_on_step_end(self, pipeline, step_index, timestep, callback_kwargs):
+        self.marks.append(time.perf_counter())
+        return callback_kwargs
+
+    def callback(self, step, timestep, latents):
+        self.marks.append(time.perf_counter())
+
+    def stats(self, finished: float) -> dict:
+        intervals = np.diff([self.started, *self.marks]) if self.marks else np.array([])
+        denoise = (self.marks[-1] - self.started) if self.marks else 0.0
+        return {
+            "first_step_seconds": round(float(intervals[0]), 4) if len(intervals) else None,
+            # 第一步包含预热开销，单步耗时取其余步的中位数
+            "seconds_per_step": round(float(np.median(intervals[1:] if len(intervals) > 1 else intervals)), 4)
+            if len(intervals) else None,
+            "denoise_seconds": round(denoise, 4),
+            # 最后一步之后的 VAE 解码与后处理
+            "decode_seconds": round(finished - self.marks[-1], 4) if self.marks else None,
+        }
+
+
+def output_stats(array: np.ndarray) -> dict:
+    array = np.asarray(array, dtype=np.float32)
+    return {
+        "output_shape": "x".join(map(str, array.shape)),
+        "output_mean": round(float(array.mean()), 4),
+        "output_std": round(float(array.std()), 4),
+        "output_min": round(float(array.min()), 4),
+        "output_max": round(float(array.max()), 4),
+        "output_nan": bool(np.isnan(array).any()),
+    }
+
+
+# ---------------------------------------------------------------- qwen-image
+
+def _tiny_qwen(app):
+    from diffusers import (
+        AutoencoderKLQwenImage, FlowMatchEulerDiscreteScheduler, QwenImagePipeline, QwenImageTransformer2DModel,
+    )
+    import torch
+    torch.manual_seed(0)
+    transformer = QwenImageTransformer2DModel(
+        patch_size=2, in_channels=16, out_channels=4, num_layers=2, attention_head_dim=16,
+        num_attention_heads=3, joint_attention_dim=16, guidance_embeds=False, axes_dims_rope=(8, 4, 4),
+    )
+    vae = AutoencoderKLQwenImage(
+        base_dim=24, z_dim=4, dim_mult=[1, 2, 4], num_res_blocks=1, temperal_downsample=[False, True],
+        latents_mean=[0.0] * 4, latents_std=[1.0] * 4,
+    )
+    pipe = QwenImagePipeline(
+        scheduler=FlowMatchEulerDiscreteScheduler(), vae=vae, text_encoder=None, tokenizer=None, transformer=transformer,
+    ).to(dtype=app.TORCH_DTYPE)
+    app.apply_cpu_mode(pipe, ("transformer",))
+    return pipe
+
+
+def qwen_image(app, args):
+    import torch
+    pipe = _tiny_qwen(app) if args.tiny else app.load_pipeline()
+
+    started = time.perf_counter()
+    if args.tiny:
+        dim = pipe.transformer.config.joint_attention_dim
+        embeds = torch.randn(1, 32, dim, dtype=app.TORCH_DTYPE)
+        negative = torch.randn(1, 8, dim, dtype=app.TORCH_DTYPE)
+        masks = torch.ones(1, 32, dtype=torch.long), torch.ones(1, 8, dtype=torch.long)
+    else:
+        # 与服务一致：文本编码一次后传 prompt_embeds，每步耗时只反映 transformer
+        with torch.inference_mode():
+            embeds, mask = pipe.encode_prompt(prompt=[args.prompt + app.POSITIVE_MAGIC["zh"]], device="cpu")
+            negative, negative_mask = pipe.encode_prompt(prompt=[app.DEFAULT_NEGATIVE_PROMPT], device="cpu")
+        masks = (
+            mask if mask is not None else torch.ones(embeds.shape[:2], dtype=torch.long),
+            negative_mask if negative_mask is not None else torch.ones(negative.shape[:2], dtype=torch.long),
+        )
+    text_encode_seconds = round(time.perf_counter() - started, 4)
+
+    sizes = {r: app.ASPECT_RATIOS[r] for r in (args.aspect_ratios or [k for k, v in app.ASPECT_RATIOS.items() if v])}
+
+    def run(config, timer):
+        width, height = sizes[config["aspect_ratio"]]
+        width, height = max(int(width * args.scale) // 16 * 16, 16), max(int(height * args.scale) // 16 * 16, 16)
+        batch = config["batch_size"]
+        result = pipe(
+            prompt_embeds=embeds.repeat(batch, 1, 1),
+            prompt_embeds_mask=masks[0].repeat(batch, 1),
+            negative_prompt_embeds=negative.repeat(batch, 1, 1),
+            negative_prompt_embeds_mask=masks[1].repeat(batch, 1),
+            width=width,
+            height=height,
+            num_inference_steps=config["steps"],
+            true_cfg_scale=app.DEFAULT_CFG_SCALE,
+            generator=[torch.Generator(device="cpu").manual_seed(args.seed + i) for i in range(batch)],
+            callback_on_step_end=timer.callback_on_step_end,
+            output_type="np",
+        )
+        return result.images, {"width": width, "height": height}
+
+    axes = {"aspect_ratio": list(sizes), "steps": args.steps, "threads": args.threads, "batch_size": args.batch_sizes}
+    return run, axes, {"text_encode_seconds": text_encode_seconds}
+
+
+# ---------------------------------------------------------------- image-gen (Kandinsky 2.2)
+
+def _tiny_kandinsky(app):
+    from diffusers import DDIMScheduler, KandinskyV22Pipeline, UNet2DConditionModel, VQModel
+    import torch
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        in_channels=4, out_channels=8, addition_embed_type="image",
+        down_block_types=("ResnetDownsampleBlock2D", "SimpleCrossAttnDownBlock2D"),
+        up_block_types=("SimpleCrossAttnUpBlock2D", "ResnetUpsampleBlock2D"),
+        mid_block_type="UNetMidBlock2DSimpleCrossAttn", block_out_channels=(32, 64), layers_per_block=1,
+        encoder_hid_dim=32, encoder_hid_dim_type="image_proj", cross_attention_dim=100, attention_head_dim=4,
+        resnet_time_scale_shift="scale_shift", class_embed_type=None,
+    )
+    movq = VQModel(
+        block_out_channels=[32, 64], down_block_types=["DownEncoderBlock2D", "AttnDownEncoderBlock2D"],
+        in_channels=3, latent_channels=4, layers_per_block=1, norm_num_groups=8, norm_type="spatial",
+        num_vq_embeddings=12, out_channels=3, up_block_types=["AttnUpDecoderBlock2D", "UpDecoderBlock2D"],
+        vq_embed_dim=4,
+    )
+    scheduler = DDIMScheduler(
+        num_train_timesteps=1000, beta_schedule="linear", beta_start=0.00085, beta_end=0.012,
+        clip_sample=False, set_alpha_to_one=False, steps_offset=1, prediction_type="epsilon",
+    )
+    pipe = KandinskyV22Pipeline(unet=unet, scheduler=scheduler, movq=movq).to(dtype=app.TORCH_DTYPE)
+    app.apply_cpu_mode(pipe, ("unet",))
+    return pipe
+
+
+def image_gen(app, args):
+    import torch
+    extra = {}
+    if args.tiny:
+        decoder = _tiny_kandinsky(app)
+        dim = decoder.unet.config.encoder_hid_dim
+        image_embeds, negative_embeds = torch.randn(1, dim), torch.zeros(1, dim)
+    else:
+        prior, decoder = app.load_pipelines()
+        started = time.perf_counter()
+        out = prior(args.prompt, num_inference_steps=app.PRIOR_STEPS, guidance_scale=app.PRIOR_GUIDANCE_SCALE,
+                    generator=torch.Generator(device="cpu").manual_seed(args.seed))
+        extra["prior_seconds"] = round(time.perf_counter() - started, 4)
+        image_embeds, negative_embeds = out.image_embeds, out.negative_image_embeds
+    image_embeds, negative_embeds = image_embeds.to(app.TORCH_DTYPE), negative_embeds.to(app.TORCH_DTYPE)
+
+    def run(config, timer):
+        width, height = config["size"]
+        batch = config["batch_size"]
+        result = decoder(
+            image_embeds=image_embeds.repeat(batch, 1),
+            negative_image_embeds=negative_embeds.repeat(batch, 1),
+            num_inference_steps=config["steps"],
+            height=height,
+            width=width,
+            generator=torch.Generator(device="cpu").manual_seed(args.seed),
+            callback_on_step_end=timer.callback_on_step_end,
+            output_type="np",
+        )
+        return result.images, {"width": width, "height": height}
+
+    sizes = args.sizes or [(768, 768)]
+    axes = {"size": sizes, "steps": args.steps, "threads": args.threads, "batch_size": args.batch_sizes}
+    return run, axes, extra
+
+
+# ---------------------------------------------------------------- video-gen (zeroscope)
+
+def _tiny_video(app):
+    from diffusers import AutoencoderKL, DDIMScheduler, TextToVideoSDPipeline, UNet3DConditionModel
+    import torch
+    torch.manual_seed(0)
+    unet = UNet3DConditionModel(
+        block_out_channels=(4, 8), layers_per_block=1, sample_size=32, in_channels=4, out_channels=4,
+        down_block_types=("CrossAttnDownBlock3D", "DownBlock3D"), up_block_types=("UpBlock3D", "CrossAttnUpBlock3D"),
+        cross_attention_dim=4, attention_head_dim=4, norm_num_groups=2,
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[8], in_channels=3, out_channels=3, down_block_types=["DownEncoderBlock2D"],
+        up_block_types=["UpDecoderBlock2D"], latent_channels=4, sample_size=32, norm_num_groups=2,
+    )
+    scheduler = DDIMScheduler(
+        beta_start=0.00085, beta_end=0.012, beta_schedule="scaled_linear", clip_sample=False, set_alpha_to_one=False,
+    )
+    return TextToVideoSDPipeline(vae=vae, text_encoder=None, tokenizer=None, unet=unet, scheduler=scheduler)
+
+
+def video_gen(app, args):
+    import torch
+    if args.tiny:
+        pipe = _tiny_video(app)
+        embeds = torch.randn(1, 77, pipe.unet.config.cross_attention_dim)
+        negative = torch.zeros_like(embeds)
+    else:
+        pipe = app.load_pipeline()
+        with torch.inference_mode():
+            embeds, negative = pipe.encode_prompt(args.prompt, "cpu", 1, True)
+
+    def run(config, timer):
+        width, height = config["size"]
+        result = pipe(
+            prompt_embeds=embeds,
+            negative_prompt_embeds=negative,
+            num_inference_steps=config["steps"],
+            num_frames=config["frames"],
+            height=height,
+            width=width,
+            guidance_scale=9.0,
+            generator=torch.Generator(device="cpu").manual_seed(args.seed),
+            output_type="np",
+            callback=timer.callback,
+            callback_steps=1,
+        )
+        return result.frames[0], {"width": width, "height": height}
+
+    sizes = args.sizes or [(576, 320)]
+    axes = {"size": sizes, "frames": args.frames, "steps": args.steps, "threads": args.threads}
+    return run, axes, {}
+
+
+SERVICES = {"qwen-image": qwen_image, "image-gen": image_gen, "video-gen": video_gen}
+
+
+# ---------------------------------------------------------------- 主流程
+
+def main():
+    parser = argparse.ArgumentParser(description="Sweep resolution / steps / frames / threads / batch size for one model service")
+    parser.add_argument("--service", choices=sorted(SERVICES), default="qwen-image")
+    parser.add_argument("--service-dir", type=Path, help="服务 app.py 所在目录，默认 services/<service>")
+    parser.add_argument("--tiny", action="store_true", help="使用随机初始化的小模型，不下载权重")
+    parser.add_argument("--aspect-ratios", type=lambda v: parse_list(v, str), help="qwen-image：ASPECT_RATIOS 中的键，默认全部")
+    parser.add_argument("--scale", type=float, default=1.0, help="qwen-image：分辨率缩放（对齐到 16）")
+    parser.add_argument("--sizes", type=lambda v: parse_list(v, parse_size), help="image-gen / video-gen：WxH 列表")
+    parser.add_argument("--frames", type=parse_list, default=[8, 16, 24], help="video-gen：每段帧数")
+    parser.add_argument("--steps", type=parse_list, default=[20])
+    parser.add_argument("--threads", type=parse_list, default=[os.cpu_count() or 1], help="torch.set_num_threads 取值")
+    parser.add_argument("--batch-sizes", type=parse_list, default=[1])
+    parser.add_argument("--repeats", type=int, default=1, help="每个配置在预热之后计时的次数")
+    parser.add_argument("--prompt", default=DEFAULT_PROMPT)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output-dir", type=Path, default=Path("benchmark_results"))
+    args = parser.parse_args()
+
+    # 只用 pipeline 本身：不启动后台预加载 / 空闲卸载，也不上报进度
+    os.environ.update({"MODEL_PRELOAD": "false", "MODEL_IDLE_UNLOAD": "0"})
+    os.environ.pop("REDIS_URL", None)
+    sys.path.insert(0, str(args.service_dir or PROJECT_ROOT / "services" / args.service))
+    import app
+    import torch
+
+    started = time.perf_counter()
+    run, axes, extra = SERVICES[args.service](app, args)
+    load_seconds = round(time.perf_counter() - started, 2)
+    print(f"Loaded {args.service}{' (tiny)' if args.tiny else ''} in {load_seconds}s", file=sys.stderr)
+
+    results = []
+    names = list(axes)
+    tracks_peak = reset_peak_rss()
+    for values in itertools.product(*axes.values()):
+        config = dict(zip(names, values))
+        torch.set_num_threads(config["threads"])
+        timer = StepTimer()
+        reset_peak_rss()
+        row = {**{k: ("x".join(map(str, v)) if isinstance(v, tuple) else v) for k, v in config.items()}}
+        try:
+            with torch.inference_mode():
+                # 第一次运行包含内存分配、编译等一次性开销，单独记录
+                timer.start()
+                output, shape = run(config, timer)
+                row["warmup_seconds"] = round(time.perf_counter() - timer.started, 4)
+                runs = []
+                for _ in range(args.repeats):
+                    timer.start()
+                    output, shape = run(config, timer)
+                    finished = time.perf_counter()
+                    runs.append({"total_seconds": finished - timer.started, **timer.stats(finished)})
+        except Exception as e:
+            row["error"] = f"{type(e).__name__}: {e}"
+            results.append(row)
+            print(f"  {row}: {row['error']}", file=sys.stderr)
+            continue
+        for key in runs[0]:
+            measured = [r[key] for r in runs if r[key] is not None]
+            row[key] = round(statistics.median(measured), 4) if measured else None
+        steps = config.get("steps")
+        items = config.get("batch_size", 1) * config.get("frames", 1)
+        row["steps_per_second"] = round(steps / row["denoise_seconds"], 3) if row["denoise_seconds"] else None
+        row["seconds_per_item"] = round(row["total_seconds"] / items, 4)
+        row["peak_rss_mb"] = round(peak_rss_mb(), 1)
+        row.update(shape)
+        row.update(output_stats(output))
+        results.append(row)
+        print(f"  {config}: {row['total_seconds']}s, {row['seconds_per_step']}s/step, peak {row['peak_rss_mb']} MB",
+              file=sys.stderr)
+
+    report = {
+        "service": args.service,
+        "tiny": args.tiny,
+        "torch_dtype": str(app.TORCH_DTYPE) if hasattr(app, "TORCH_DTYPE") else None,
+        "quantize": os.getenv("QUANTIZE", "none"),
+        "compile": os.getenv("COMPILE", "none"),
+        "torch_version": torch.__version__,
+        "cpu_count": os.cpu_count(),
+        "load_seconds": load_seconds,
+        # 无法重置 VmHWM 时（非 Linux），peak_rss_mb 为进程启动以来的峰值
+        "per_config_peak_rss": tracks_peak,
+        **extra,
+        "results": results,
+    }
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    stem = f"{args.service}{'_tiny' if args.tiny else ''}_models"
+    (args.output_dir / f"{stem}.json").write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    fields = list(dict.fromkeys(k for r in results for k in r))
+    with open(args.output_dir / f"{stem}.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(results)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
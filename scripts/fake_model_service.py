@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+模型服务的本地替身：不加载任何模型，按设定的延迟分布、产物大小与失败率响应，
+用于在没有 GPU / 模型权重的机器上验证 backend 的副本路由、重试与摘除逻辑，
+也是 scripts/loadtest.py 压测编排层时使用的桩服务。
+
+接口与真实服务一致：
+- POST /generate：图片 / 视频服务，写出占位文件（output_file）或直接返回字节；缺少 prompt（且非 kenburns）时返回 400
+- POST /v1/tts：fish-speech，返回静音 WAV
+- GET /health、/v1/health：上报 in_flight 与 queue_depth
+
+启动三个副本，其中一个较慢、一个偶尔失败：
+
+    python scripts/fake_model_service.py --port 9001 &
+    python scripts/fake_model_service.py --port 9002 --latency 3 &
+    python scripts/fake_model_service.py --port 9003 --fail-rate 0.5 &
+    export IMAGE_GEN_URLS=http://localhost:9001/generate,http://localhost:9002/generate,http://localhost:9003/generate
+    export FISH_SPEECH_URLS=http://localhost:9001/v1/tts,http://localhost:9002/v1/tts,http://localhost:9003/v1/tts
+"""
+import argparse
+import asyncio
+import math
+import os
+import random
+import struct
+from pathlib import Path
+from typing import Optional
+
+import uvicorn
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import JSONResponse, Response
+
+app = FastAPI(title="Fake Model Service")
+
+args = None
+in_flight = 0
+queue_depth = 0
+semaphore: Optional[asyncio.Semaphore] = None
+
+# 1x1 透明 PNG
+PNG_PIXEL = bytes.fromhex(
+    "89504e470d0a1a0a0000000d4948445200000001000000010806000000"
+    "1f15c4890000000d49444154789c6360000002000154a24f5d0000000049454e44ae426082"
+)
+
+
+def silent_wav(seconds: float, sample_rate: int = 44100) -> bytes:
+    pcm = b"\x00\x00" * int(seconds * sample_rate)
+    header = b"RIFF" + struct.pack("<I", 36 + len(pcm)) + b"WAVE"
+    header += b"fmt " + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+    header += b"data" + struct.pack("<I", len(pcm))
+    return header + pcm
+
+
+def sample_latency(chars: int = 0) -> float:
+    """fixed：恒定；uniform：±20%；lognormal：中位数为 --latency 的长尾分布。另加按文本长度线性增长的部分"""
+    if args.latency_dist == "lognormal":
+        latency = random.lognormvariate(math.log(max(args.latency, 1e-6)), args.latency_sigma)
+    elif args.latency_dist == "uniform":
+        latency = args.latency * random.uniform(0.8, 1.2)
+    else:
+        latency = args.latency
+    return latency + chars * args.per_char
+
+
+async def simulate(chars: int = 0):
+    """模拟排队 + 推理；按 fail-rate 返回 500，供 backend 重试并摘除副本"""
+    global in_flight, queue_depth
+    queue_depth += 1
+    try:
+        await semaphore.acquire()
+    finally:
+        queue_depth -= 1
+    in_flight += 1
+    try:
+        await asyncio.sleep(sample_latency(chars))
+        if random.random() < args.fail_rate:
+            raise HTTPException(500, "simulated failure")
+    finally:
+        in_flight -= 1
+        semaphore.release()
+
+
+@app.get("/health")
+@app.get("/v1/health")
+async def health():
+    return {"status": "healthy", "port": args.port, "in_flight": in_flight, "queue_depth": queue_depth}
+
+
+@app.post("/generate")
+async def generate(request: Request):
+    body = await request.json()
+    # 与 qwen-image / video-gen 的校验一致：图片与 diffusion 视频必须带 prompt，kenburns 视频带 image_url
+    if not body.get("prompt") and not body.get("image_url"):
+        raise HTTPException(400, "Missing 'prompt' in request")
+    await simulate()
+    output_file = body.get("output_file")
+    # 按 --payload-bytes 补齐到接近真实产物的大小，压测时写盘 / 传输开销才有意义
+    content = PNG_PIXEL + bytes(max(0, args.payload_bytes - len(PNG_PIXEL)))
+    if output_file:
+        path = Path(args.output_dir) / Path(output_file).name
+        path.write_bytes(content)
+        return JSONResponse({"output_file": path.name, "replica": args.port})
+    return Response(content=content, media_type="application/octet-stream")
+
+
+@app.post("/v1/tts")
+async def tts(request: Request):
+    body = await request.json()
+    await simulate(len(body.get("text", "")))
+    # 按文本长度估算时长，约每秒 5 个字
+    return Response(content=silent_wav(max(len(body.get("text", "")) / 5, 0.5)), media_type="audio/wav")
+
+
+def main():
+    global args
+    parser = argparse.ArgumentParser(description="Fake model service replica for local routing tests")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--latency", type=float, default=1.0, help="每个请求的模拟推理耗时（秒，lognormal 时为中位数）")
+    parser.add_argument("--latency-dist", choices=("fixed", "uniform", "lognormal"), default="uniform")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="lognormal 分布的 sigma")
+    parser.add_argument("--per-char", type=float, default=0.0, help="TTS 每个字额外增加的耗时（秒）")
+    parser.add_argument("--payload-bytes", type=int, default=0, help="/generate 产物大小（字节）")
+    parser.add_argument("--concurrency", type=int, default=1, help="同时推理的请求数，其余排队")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="返回 500 的概率")
+    parser.add_argument("--output-dir", default=os.getenv("OUTPUT_DIR", "static/outputs"))
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    async def serve():
+        global semaphore
+        semaphore = asyncio.Semaphore(args.concurrency)
+        await uvicorn.Server(uvicorn.Config(app, host=args.host, port=args.port, log_level="warning")).serve()
+
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,568 @@
+#!/usr/bin/env python3
+"""
+编排层端到端压测：在本机启动 Redis、backend（uvicorn）、按阶段划分的 RQ worker
+以及 scripts/fake_model_service.py 桩服务，以开环（泊松到达）方式向 /api/* 提交任务，
+统计吞吐、端到端延迟分位数与 API / worker 的 CPU、内存占用，结果写成 JSON（可选追加 CSV）。
+
+桩服务只模拟延迟分布与产物大小，不需要 GPU 与模型权重，测的是 backend + RQ + Redis 本身，
+适合在 CI 中对比基线发现编排层的性能回退：
+
+    python scripts/loadtest.py --rate 2 --duration 60 --mix image=2,voice=2,pipeline=1 \\
+        --output benchmark_results/loadtest.json
+
+    # 与基线对比：任一类请求 p95 变慢或吞吐下降超过 20% 时退出码为 1
+    python scripts/loadtest.py --rate 2 --duration 60 --baseline benchmark_results/loadtest_baseline.json
+
+Redis：--redis-url 指定已有实例（会写入数据，请使用单独的实例），否则启动本机的 redis-server；
+--fakeredis 在压测进程内起一个 fakeredis TCP 服务，无需安装 Redis，可用于冒烟测试与 CI，
+但其吞吐远低于真实 Redis 且不计入资源统计，结果不能与使用 redis-server 的基线比较。
+CPU / 内存读取 /proc，仅支持 Linux。
+"""
+import argparse
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import shutil
+import socket
+import statistics
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from urllib.parse import urlparse
+
+import httpx
+
+PROJECT_ROOT = Path(__file__).parent.parent.resolve()
+BACKEND_DIR = PROJECT_ROOT / "backend"
+FAKE_SERVICE = PROJECT_ROOT / "scripts" / "fake_model_service.py"
+
+ENDPOINTS = {
+    "image": "/api/image/generate",
+    "voice": "/api/voice/clone",
+    "video": "/api/video/generate",
+    "pipeline": "/api/pipeline/generate",
+}
+STAGES = ("image", "voice", "video")
+CLK_TCK = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def parse_pairs(value: str, cast=float) -> dict:
+    """"image=2,voice=1" → {"image": 2.0, "voice": 1.0}"""
+    pairs = {}
+    for item in value.split(","):
+        if item.strip():
+            key, _, number = item.partition("=")
+            pairs[key.strip()] = cast(number)
+    return pairs
+
+
+def percentile(values, q: float):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = (len(ordered) - 1) * q
+    low, high = int(index), min(int(index) + 1, len(ordered) - 1)
+    return round(ordered[low] + (ordered[high] - ordered[low]) * (index - low), 3)
+
+
+def silent_wav(seconds: float = 1.0, sample_rate: int = 24000) -> bytes:
+    pcm = b"\x00\x00" * int(seconds * sample_rate)
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(pcm), b"WAVE", b"fmt ", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16,
+        b"data", len(pcm),
+    ) + pcm
+
+
+# ---------------------------------------------------------------- 进程管理
+
+class Stack:
+    """本次压测启动的所有进程，按角色分组以便统计资源占用"""
+
+    def __init__(self, workdir: Path, log_dir: Path):
+        self.workdir = workdir
+        self.log_dir = log_dir
+        self.procs = {}  # role → [Popen]
+        self.servers = []  # 进程内的服务（--fakeredis）
+
+    def spawn(self, role: str, name: str, cmd, env=None):
+        log = open(self.log_dir / f"{name}.log", "wb")
+        proc = subprocess.Popen(
+            cmd, cwd=self.workdir, env={**os.environ, **(env or {})},
+            stdout=log, stderr=subprocess.STDOUT,
+        )
+        self.procs.setdefault(role, []).append(proc)
+        return proc
+
+    def pids(self) -> dict:
+        return {role: [p.pid for p in procs if p.poll() is None] for role, procs in self.procs.items()}
+
+    def check_alive(self):
+        for role, procs in self.procs.items():
+            for proc in procs:
+                if proc.poll() is not None:
+                    raise RuntimeError(f"{role} process {proc.args[:3]} exited with {proc.returncode}, see {self.log_dir}")
+
+    def stop(self):
+        for procs in self.procs.values():
+            for proc in procs:
+                if proc.poll() is None:
+                    proc.terminate()
+        for procs in self.procs.values():
+            for proc in procs:
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+        for server in self.servers:
+            server.shutdown()
+            server.server_close()
+
+
+def start_fakeredis(stack: Stack) -> str:
+    """
+    进程内的 fakeredis TCP 服务，连接建立后修正两处与 RQ 不兼容的行为：
+    - CLIENT LIST 中的 addr / laddr 是 Python 元组（"addr=('127.0.0.1', 5555)"，含空格），
+      redis-py 解析失败，RQ worker 启动时取自身 IP 即报错；改写成 Redis 的 "host:port" 格式
+    - 命令出错（如 RQ 用 INFO 探测版本，fakeredis 未实现）时 TCP 服务回复错误后直接断开连接，
+      RQ 的兜底逻辑来不及生效；改为只回复错误、保持连接
+    """
+    try:
+        from fakeredis import TcpFakeServer
+        from redis.exceptions import ResponseError
+    except ImportError:
+        sys.exit("--fakeredis requires the fakeredis package (pip install fakeredis lupa)")
+
+    server = TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+
+    class RequestHandler(server.RequestHandlerClass):
+        def setup(self):
+            super().setup()
+            info = self.current_client.get_socket()._client_info
+            for key in ("addr", "laddr"):
+                if isinstance(info.get(key), tuple):
+                    info[key] = "%s:%d" % info[key][:2]
+
+            read_response = self.current_client.read_response
+
+            def read_reply():
+                try:
+                    return read_response()
+                except ResponseError as e:
+                    return e
+
+            self.current_client.read_response = read_reply
+
+    server.RequestHandlerClass = RequestHandler
+    # worker 的 BLPOP 会让连接线程一直阻塞，关闭时不等待这些线程
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="fakeredis", daemon=True).start()
+    stack.servers.append(server)
+    return f"redis://127.0.0.1:{server.server_address[1]}/0"
+
+
+def start_redis(stack: Stack, args) -> str:
+    if args.redis_url:
+        return args.redis_url
+    if args.fakeredis:
+        return start_fakeredis(stack)
+    port = free_port()
+    if not shutil.which("redis-server"):
+        sys.exit("redis-server not found: install it, pass --redis-url or use --fakeredis")
+    stack.spawn("redis", "redis", ["redis-server", "--port", str(port), "--save", "", "--appendonly", "no"])
+    return f"redis://127.0.0.1:{port}/0"
+
+
+def start_stubs(stack: Stack, args, output_dir: Path) -> dict:
+    """每个阶段 args.replicas 个桩服务副本，返回各阶段的 URL 列表"""
+    latency = parse_pairs(args.latency)
+    payload = parse_pairs(args.payload_bytes, int)
+    urls = {}
+    for stage in STAGES:
+        urls[stage] = []
+        for n in range(args.replicas):
+            port = free_port()
+            cmd = [
+                sys.executable, str(FAKE_SERVICE), "--port", str(port),
+                "--latency", str(latency.get(stage, 1.0)),
+                "--latency-dist", args.latency_dist, "--latency-sigma", str(args.latency_sigma),
+                "--payload-bytes", str(payload.get(stage, 0)),
+                "--concurrency", str(args.stub_concurrency),
+                "--fail-rate", str(args.fail_rate),
+                "--output-dir", str(output_dir),
+            ]
+            if stage == "voice":
+                cmd += ["--per-char", str(args.tts_per_char)]
+            stack.spawn("stubs", f"stub-{stage}-{n}", cmd)
+            path = "/v1/tts" if stage == "voice" else "/generate"
+            urls[stage].append(f"http://127.0.0.1:{port}{path}")
+    return urls
+
+
+def start_backend(stack: Stack, args, redis_url: str, urls: dict, output_dir: Path) -> str:
+    redis = urlparse(redis_url)
+    env = {
+        "REDIS_HOST": redis.hostname,
+        "REDIS_PORT": str(redis.port or 6379),
+        "OUTPUT_DIR": str(output_dir),
+        "REFERENCES_DIR": str(stack.workdir / "references"),
+        "IMAGE_GEN_URLS": ",".join(urls["image"]),
+        "FISH_SPEECH_URLS": ",".join(urls["voice"]),
+        "VIDEO_GEN_URLS": ",".join(urls["video"]),
+        "SHARED_ARTIFACTS": "true",
+        "CACHE_ENABLED": "true" if args.cache else "false",
+        "HTTP_RETRY_BACKOFF": "0.1",
+        "PYTHONPATH": str(BACKEND_DIR),
+    }
+    port = free_port()
+    stack.spawn("api", "api", [
+        sys.executable, "-m", "uvicorn", "main:app", "--app-dir", str(BACKEND_DIR),
+        "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+    ], env)
+    for stage, count in parse_pairs(args.workers, int).items():
+        for n in range(count):
+            stack.spawn("workers", f"worker-{stage}-{n}", [
+                sys.executable, "-c", "from rq.cli import main; main()", "worker",
+                "--url", redis_url, "--path", str(BACKEND_DIR),
+                "--worker-class", "worker.MetricsWorker", stage, f"{stage}_batch",
+            ], {**env, "WORKER_METRICS_PORT": str(free_port())})
+    return f"http://127.0.0.1:{port}"
+
+
+async def wait_ready(stack: Stack, client: httpx.AsyncClient, base_url: str, urls: dict, timeout: float = 60):
+    deadline = time.time() + timeout
+    health = [f"{urlparse(u).scheme}://{urlparse(u).netloc}/health" for stage in STAGES for u in urls[stage]]
+    for url in [f"{base_url}/api/queue/stats", *health]:
+        while True:
+            stack.check_alive()
+            try:
+                if (await client.get(url)).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if time.time() > deadline:
+                raise RuntimeError(f"{url} not ready after {timeout}s")
+            await asyncio.sleep(0.2)
+
+
+async def check_stub_contract(client: httpx.AsyncClient, urls: dict):
+    """桩服务与真实服务的请求校验一致：不带 prompt 的图片请求应被拒绝，否则压测测不出 payload 字段错误"""
+    response = await client.post(urls["image"][0], json={"text": "压测", "task_id": "contract_check"})
+    if response.status_code != 400:
+        raise RuntimeError(f"Image stub accepted a request without 'prompt' (HTTP {response.status_code})")
+
+
+# ---------------------------------------------------------------- 资源采样
+
+def proc_stats(pid: int):
+    """(CPU 秒, 当前 RSS 字节, 峰值 RSS 字节)；进程已退出返回 None"""
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        status = Path(f"/proc/{pid}/status").read_text()
+    except OSError:
+        return None
+    memory = {
+        line.split(":")[0]: int(line.split()[1]) * 1024
+        for line in status.splitlines() if line.startswith(("VmRSS", "VmHWM"))
+    }
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK, memory.get("VmRSS", 0), memory.get("VmHWM", 0)
+
+
+class ResourceSampler(threading.Thread):
+    """定时采样各角色进程的 CPU 与内存；CPU 按压测窗口起止的差值计算"""
+
+    def __init__(self, stack: Stack, interval: float):
+        super().__init__(daemon=True)
+        self.stack = stack
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.start_cpu = {}
+        self.last = {}
+        self.rss_samples = {}
+        self.started = time.time()
+
+    def _sample(self):
+        snapshot = {}
+        for role, pids in self.stack.pids().items():
+            for pid in pids:
+                stats = proc_stats(pid)
+                if stats:
+                    snapshot[(role, pid)] = stats
+        return snapshot
+
+    def run(self):
+        self.start_cpu = {k: v[0] for k, v in self._sample().items()}
+        self.started = time.time()
+        while not self.stopped.wait(self.interval):
+            snapshot = self._sample()
+            self.last.update(snapshot)
+            for role in {r for r, _ in snapshot}:
+                total = sum(v[1] for (r, _), v in snapshot.items() if r == role)
+                self.rss_samples.setdefault(role, []).append(total)
+
+    def report(self) -> dict:
+        self.stopped.set()
+        self.join()
+        self.last.update(self._sample())
+        elapsed = time.time() - self.started
+        result = {}
+        for role in {r for r, _ in self.last}:
+            entries = {k: v for k, v in self.last.items() if k[0] == role}
+            cpu = sum(v[0] - self.start_cpu.get(k, 0.0) for k, v in entries.items())
+            samples = self.rss_samples.get(role, [0])
+            result[role] = {
+                "processes": len(entries),
+                "cpu_seconds": round(cpu, 2),
+                "cpu_percent": round(100 * cpu / elapsed, 1) if elapsed else None,
+                "mean_rss_mb": round(statistics.mean(samples) / 1024 ** 2, 1),
+                "peak_rss_mb": round(sum(v[2] for v in entries.values()) / 1024 ** 2, 1),
+            }
+        return result
+
+
+# ---------------------------------------------------------------- 负载
+
+class LoadGenerator:
+    def __init__(self, client: httpx.AsyncClient, base_url: str, args, voice_id: str):
+        self.client = client
+        self.base_url = base_url
+        self.args = args
+        self.voice_id = voice_id
+        self.rng = random.Random(args.seed)
+        self.results = []
+
+    def _text(self, kind: str, n: int) -> str:
+        # repeat_ratio 的请求从小集合中取文本，用来覆盖结果缓存 / 合并重复任务的路径
+        if self.rng.random() < self.args.repeat_ratio:
+            n = self.rng.randrange(8)
+            kind = "repeat"
+        sentence = f"第{n}号{kind}测试文本，描述一段雨后街道的场景。"
+        return (sentence * (self.args.text_chars // len(sentence) + 1))[:self.args.text_chars]
+
+    def _form(self, kind: str, n: int) -> dict:
+        text = self._text(kind, n)
+        form = {"priority": self.args.priority}
+        if kind == "image":
+            form["text"] = text
+        elif kind == "voice":
+            form.update(text=text, voice_id=self.voice_id)
+        elif kind == "video":
+            form.update(image_url=f"/outputs/loadtest_{n}.png", audio_url=f"/outputs/loadtest_{n}.wav",
+                        duration=str(self.args.video_duration))
+        else:
+            form.update(text=text, voice_id=self.voice_id, duration=str(self.args.video_duration))
+        return form
+
+    async def _one(self, kind: str, n: int, scheduled: float):
+        record = {"kind": kind, "scheduled": scheduled, "outcome": None, "latency": None}
+        self.results.append(record)
+        started = time.time()
+        try:
+            response = await self.client.post(self.base_url + ENDPOINTS[kind], data=self._form(kind, n))
+            record["submit_latency"] = round(time.time() - started, 4)
+            if response.status_code == 429:
+                record["outcome"] = "rejected"
+                return
+            response.raise_for_status()
+            body = response.json()
+            status = body.get("status")
+            deadline = started + self.args.task_timeout
+            while status not in ("completed", "failed"):
+                if time.time() > deadline:
+                    record["outcome"] = "timeout"
+                    return
+                await asyncio.sleep(self.args.poll_interval)
+                status = (await self.client.get(f"{self.base_url}/api/task/{body['task_id']}")).json().get("status")
+            record["outcome"] = status
+            record["latency"] = round(time.time() - started, 4)
+        except (httpx.HTTPError, ValueError) as e:
+            record["outcome"] = "error"
+            record["error"] = str(e)
+        finally:
+            record["finished"] = time.time()
+
+    async def run(self) -> float:
+        """开环：按泊松过程提前排好到达时间，请求是否完成不影响下一次提交"""
+        mix = parse_pairs(self.args.mix)
+        kinds, weights = list(mix), list(mix.values())
+        tasks, offset, n = [], 0.0, 0
+        start = time.time()
+        while True:
+            offset += self.rng.expovariate(self.args.rate)
+            if offset >= self.args.duration:
+                break
+            kind = self.rng.choices(kinds, weights)[0]
+            delay = start + offset - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self._one(kind, n, offset)))
+            n += 1
+        await asyncio.gather(*tasks)
+        return start
+
+
+def summarize(records, window: float) -> dict:
+    summary = {}
+    for kind in sorted({r["kind"] for r in records}) + ["all"]:
+        subset = [r for r in records if kind == "all" or r["kind"] == kind]
+        latencies = [r["latency"] for r in subset if r["outcome"] == "completed"]
+        submits = [r["submit_latency"] for r in subset if "submit_latency" in r]
+        outcomes = {}
+        for r in subset:
+            outcomes[r["outcome"]] = outcomes.get(r["outcome"], 0) + 1
+        summary[kind] = {
+            "requests": len(subset),
+            "outcomes": outcomes,
+            "throughput_rps": round(len(latencies) / window, 3) if window else None,
+            "latency_p50": percentile(latencies, 0.50),
+            "latency_p95": percentile(latencies, 0.95),
+            "latency_p99": percentile(latencies, 0.99),
+            "latency_mean": round(statistics.mean(latencies), 3) if latencies else None,
+            "latency_max": round(max(latencies), 3) if latencies else None,
+            "submit_p95": percentile(submits, 0.95),
+        }
+    return summary
+
+
+def compare(report: dict, baseline: dict, max_regression: float) -> list:
+    """p95 延迟变慢或吞吐下降超过阈值的条目"""
+    regressions = []
+    for kind, current in report["summary"].items():
+        base = baseline.get("summary", {}).get(kind)
+        if not base:
+            continue
+        if base.get("latency_p95") and current.get("latency_p95") and \
+                current["latency_p95"] > base["latency_p95"] * (1 + max_regression):
+            regressions.append(f"{kind}: p95 {base['latency_p95']}s → {current['latency_p95']}s")
+        if base.get("throughput_rps") and (current.get("throughput_rps") or 0) < base["throughput_rps"] * (1 - max_regression):
+            regressions.append(f"{kind}: throughput {base['throughput_rps']} → {current['throughput_rps']} rps")
+    return regressions
+
+
+async def register_voice(client: httpx.AsyncClient, base_url: str) -> str:
+    files = {"audio": ("loadtest.wav", io.BytesIO(silent_wav()), "audio/wav")}
+    response = await client.post(f"{base_url}/api/voices", files=files, data={"reference_text": "压测参考音频"})
+    response.raise_for_status()
+    return response.json()["voice_id"]
+
+
+async def run(args, stack: Stack) -> dict:
+    output_dir = stack.workdir / "static" / "outputs"
+    output_dir.mkdir(parents=True)
+    redis_url = start_redis(stack, args)
+    urls = start_stubs(stack, args, output_dir)
+    base_url = start_backend(stack, args, redis_url, urls, output_dir)
+
+    limits = httpx.Limits(max_connections=args.max_connections)
+    async with httpx.AsyncClient(timeout=60, limits=limits) as client:
+        await wait_ready(stack, client, base_url, urls)
+        await check_stub_contract(client, urls)
+        # 等 worker 注册到 Redis
+        await asyncio.sleep(2)
+        voice_id = await register_voice(client, base_url)
+
+        sampler = ResourceSampler(stack, args.sample_interval)
+        sampler.start()
+        load = LoadGenerator(client, base_url, args, voice_id)
+        start = await load.run()
+        resources = sampler.report()
+        queue_stats = (await client.get(f"{base_url}/api/queue/stats")).json()
+
+    finished = [r["finished"] for r in load.results if "finished" in r]
+    window = (max(finished) - start) if finished else 0
+    return {
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(start)),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "csv", "keep")},
+        "window_seconds": round(window, 2),
+        "summary": summarize(load.results, window),
+        "resources": resources,
+        "queue_stats_after": queue_stats,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open-loop load test of the orchestration layer against stub model services")
+    parser.add_argument("--rate", type=float, default=1.0, help="平均到达率（请求/秒）")
+    parser.add_argument("--duration", type=float, default=60, help="提交请求的时长（秒），之后等待全部完成")
+    parser.add_argument("--mix", default="image=1,voice=1,pipeline=1", help="各端点的请求比例：image / voice / video / pipeline")
+    parser.add_argument("--priority", default="interactive", choices=("interactive", "batch"))
+    parser.add_argument("--seed", type=int, default=42, help="到达时间与请求内容的随机种子")
+    parser.add_argument("--text-chars", type=int, default=120, help="提示词 / 旁白长度，决定 TTS 分段数")
+    parser.add_argument("--repeat-ratio", type=float, default=0.0, help="重复文本的比例（覆盖缓存命中与任务合并）")
+    parser.add_argument("--video-duration", type=int, default=10)
+    parser.add_argument("--no-cache", dest="cache", action="store_false", help="关闭结果缓存")
+    parser.add_argument("--workers", default="image=2,voice=2,video=1", help="各阶段的 worker 进程数")
+    parser.add_argument("--replicas", type=int, default=1, help="每个阶段的桩服务副本数")
+    parser.add_argument("--latency", default="image=2,voice=0.5,video=5", help="各阶段桩服务的延迟（秒）")
+    parser.add_argument("--latency-dist", choices=("fixed", "uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--latency-sigma", type=float, default=0.4)
+    parser.add_argument("--tts-per-char", type=float, default=0.005, help="TTS 桩每个字增加的耗时（秒）")
+    parser.add_argument("--payload-bytes", default="image=2000000,video=20000000", help="各阶段产物大小（字节）")
+    parser.add_argument("--stub-concurrency", type=int, default=1, help="每个桩副本同时处理的请求数")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="桩服务返回 500 的概率")
+    parser.add_argument("--redis-url", help="使用已有的 Redis（会写入数据，请勿指向生产实例）")
+    parser.add_argument("--fakeredis", action="store_true", help="使用进程内的 fakeredis，无需安装 Redis（仅冒烟测试）")
+    parser.add_argument("--poll-interval", type=float, default=0.25)
+    parser.add_argument("--task-timeout", type=float, default=600)
+    parser.add_argument("--max-connections", type=int, default=200)
+    parser.add_argument("--sample-interval", type=float, default=0.5)
+    parser.add_argument("--output", type=Path, default=Path("benchmark_results/loadtest.json"))
+    parser.add_argument("--csv", type=Path, help="额外把汇总追加为一行 CSV，便于跟踪趋势")
+    parser.add_argument("--baseline", type=Path, help="基线结果 JSON，超出 --max-regression 时退出码为 1")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    parser.add_argument("--keep", action="store_true", help="保留临时目录（日志与产物）")
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix="loadtest_"))
+    log_dir = workdir / "logs"
+    log_dir.mkdir()
+    stack = Stack(workdir, log_dir)
+    try:
+        report = asyncio.run(run(args, stack))
+    finally:
+        stack.stop()
+        if args.keep:
+            print(f"Logs and artifacts kept in {workdir}", file=sys.stderr)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    args.output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+    if args.csv:
+        row = {"started_at": report["started_at"], "rate": args.rate, "mix": args.mix}
+        for kind, s in report["summary"].items():
+            for field in ("throughput_rps", "latency_p50", "latency_p95", "latency_p99"):
+                row[f"{kind}_{field}"] = s[field]
+        for role, r in report["resources"].items():
+            row[f"{role}_cpu_percent"] = r["cpu_percent"]
+            row[f"{role}_peak_rss_mb"] = r["peak_rss_mb"]
+        new = not args.csv.exists()
+        with open(args.csv, "a", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(row))
+            if new:
+                writer.writeheader()
+            writer.writerow(row)
+    print(json.dumps(report["summary"], indent=2, ensure_ascii=False))
+
+    if args.baseline:
+        regressions = compare(report, json.loads(args.baseline.read_text()), args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
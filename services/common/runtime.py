@@ -0,0 +1,237 @@
+"""
+模型服务共用的运行时工具（qwen-image / image-gen / video-gen）：
+
+- ModelManager：权重在后台线程加载，空闲超时卸载，请求频繁时保持常驻
+- cpu_dtype / apply_cpu_mode：按 TORCH_DTYPE / QUANTIZE / COMPILE 选择 CPU 推理模式
+- ProgressReporter：把推理进度写入 Redis 的 progress:<task_id> 并通知 backend 的 SSE 订阅者
+
+各服务的 Dockerfile 以 services/ 为构建上下文，把本文件复制到 app.py 所在目录；
+在源码树中直接运行时，app.py 会把 services/common 加入 sys.path。
+"""
+import gc
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import redis
+import torch
+from prometheus_client import Gauge
+
+logger = logging.getLogger(__name__)
+
+# CPU 推理模式：TORCH_DTYPE=float32 / bfloat16 / auto（CPU 支持 bf16 指令时才用 bf16），
+# QUANTIZE=int8 对参与优化的子模块的 Linear 做动态 int8 量化，COMPILE=torch / ipex 可选
+CPU_DTYPE_REQUEST = os.getenv("TORCH_DTYPE", "float32").lower()
+QUANTIZE = os.getenv("QUANTIZE", "none").lower()
+COMPILE = os.getenv("COMPILE", "none").lower()
+
+# 推理进度上报（与 backend 共用同一个 Redis），未配置时只记日志
+REDIS_URL = os.getenv("REDIS_URL")
+PROGRESS_TTL = int(os.getenv("PROGRESS_TTL", 3600))
+progress_redis = redis.Redis.from_url(REDIS_URL) if REDIS_URL else None
+
+MODEL_LOAD_SECONDS = Gauge("model_load_seconds", "Duration of the last model load")
+
+
+def cpu_supports_bf16():
+    """CPU 是否有原生 bfloat16 指令（AVX512-BF16 / AMX），没有时 bf16 反而比 fp32 慢"""
+    try:
+        with open("/proc/cpuinfo") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def cpu_dtype():
+    """CPU 推理使用的 dtype：int8 量化固定 float32，bf16 仅在 CPU 支持相应指令时启用"""
+    requested = CPU_DTYPE_REQUEST
+    if QUANTIZE == "int8":
+        # 动态 int8 量化以 float32 权重为输入
+        if requested not in ("float32", "fp32"):
+            logger.warning("QUANTIZE=int8 requires float32 weights, ignoring TORCH_DTYPE")
+        return torch.float32
+    if requested in ("bfloat16", "bf16", "auto"):
+        if cpu_supports_bf16():
+            return torch.bfloat16
+        if requested != "auto":
+            logger.warning("CPU lacks AVX512-BF16/AMX, falling back to float32")
+    return torch.float32
+
+
+def apply_cpu_mode(pipe, module_names, dtype=None):
+    """按 QUANTIZE / COMPILE 就地替换 pipeline 的子模块；dtype 为 ipex 优化的目标精度，缺省取 cpu_dtype()"""
+    dtype = dtype or cpu_dtype()
+    for name in module_names:
+        module = getattr(pipe, name, None)
+        if module is None:
+            continue
+        module.eval()
+        if QUANTIZE == "int8":
+            module = torch.ao.quantization.quantize_dynamic(module, {torch.nn.Linear}, dtype=torch.qint8)
+            logger.info(f"Applied dynamic int8 quantization to {name}")
+        if COMPILE == "ipex":
+            try:
+                import intel_extension_for_pytorch as ipex
+            except ImportError:
+                logger.warning("COMPILE=ipex but intel_extension_for_pytorch is not installed")
+            else:
+                module = ipex.optimize(module, dtype=dtype, inplace=True)
+                logger.info(f"Applied IPEX optimizations to {name}")
+        elif COMPILE == "torch":
+            # 首次推理时编译，耗时计入第一次请求
+            module = torch.compile(module)
+            logger.info(f"Wrapped {name} with torch.compile")
+        setattr(pipe, name, module)
+
+
+class ModelManager:
+    """
+    模型生命周期管理：HTTP 服务立即启动，权重在后台线程加载（/health 报告 loading），
+    空闲超过 MODEL_IDLE_UNLOAD 秒后卸载释放内存，下次请求时再按需加载。
+    最近 WARM_POOL_WINDOW 秒内请求数达到 WARM_POOL_MIN_REQUESTS 时视为热点，保持常驻不卸载。
+    """
+
+    def __init__(self, loader, preload, idle_unload, warm_window, warm_min_requests):
+        self.loader = loader
+        self.idle_unload = idle_unload
+        self.warm_window = warm_window
+        self.warm_min_requests = warm_min_requests
+        self.model = None
+        self.state = "unloaded"  # unloaded / loading / ready / failed
+        self.error = None
+        self.load_seconds = None
+        self.active = 0
+        self.last_used = time.time()
+        self.recent = deque()
+        self.cond = threading.Condition()
+        if idle_unload > 0:
+            threading.Thread(target=self._reaper, name="model-reaper", daemon=True).start()
+        if preload:
+            self.load_async()
+
+    def load_async(self):
+        with self.cond:
+            if self.state in ("loading", "ready"):
+                return
+            self.state = "loading"
+            self.error = None
+        threading.Thread(target=self._load, name="model-loader", daemon=True).start()
+
+    def _load(self):
+        started = time.time()
+        try:
+            model = self.loader()
+        except Exception as e:
+            logger.exception("Failed to load model")
+            with self.cond:
+                self.state = "failed"
+                self.error = str(e)
+                self.cond.notify_all()
+            return
+        with self.cond:
+            self.model = model
+            self.state = "ready"
+            self.load_seconds = round(time.time() - started, 1)
+            self.last_used = time.time()
+            self.cond.notify_all()
+        MODEL_LOAD_SECONDS.set(self.load_seconds)
+        logger.info(f"Model ready in {self.load_seconds}s")
+
+    @contextmanager
+    def acquire(self):
+        """取得已加载的模型；尚未加载时触发加载并等待完成。使用期间不会被卸载"""
+        with self.cond:
+            self.active += 1
+            self.recent.append(time.time())
+        try:
+            self.load_async()
+            with self.cond:
+                self.cond.wait_for(lambda: self.state in ("ready", "failed"))
+                if self.state == "failed":
+                    raise RuntimeError(f"Model failed to load: {self.error}")
+                model = self.model
+            yield model
+        finally:
+            with self.cond:
+                self.active -= 1
+                self.last_used = time.time()
+
+    def _warm(self):
+        cutoff = time.time() - self.warm_window
+        while self.recent and self.recent[0] < cutoff:
+            self.recent.popleft()
+        return len(self.recent) >= self.warm_min_requests
+
+    def _reaper(self):
+        while True:
+            time.sleep(min(60, self.idle_unload))
+            with self.cond:
+                idle = time.time() - self.last_used
+                if self.state != "ready" or self.active or idle < self.idle_unload or self._warm():
+                    continue
+                logger.info(f"Unloading model after {idle:.0f}s idle")
+                self.model = None
+                self.state = "unloaded"
+            gc.collect()
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+    def describe(self):
+        with self.cond:
+            return {
+                "model_state": self.state,
+                "model_error": self.error,
+                "load_seconds": self.load_seconds,
+                "idle_seconds": round(time.time() - self.last_used, 1),
+                "warm": self._warm(),
+                "in_flight": self.active,
+            }
+
+
+class ProgressReporter:
+    """
+    把推理进度（第 i/N 步、预计剩余时间、当前阶段）写入 Redis 的 progress:<task_id>，
+    backend 的 /api/task/{task_id} 直接读取。未配置 REDIS_URL 时只记日志。
+    """
+
+    def __init__(self, task_ids, stage, total_steps, started=None):
+        self.task_ids = [t for t in task_ids if t]
+        self.stage = stage
+        self.total = total_steps
+        # 多段生成共用一个起点，ETA 覆盖整个任务而非单段
+        self.started = started or time.time()
+
+    def publish(self, step):
+        elapsed = time.time() - self.started
+        eta = elapsed / step * (self.total - step) if step else None
+        if step == self.total or step % 10 == 0:
+            logger.info(f"[{self.stage}] step {step}/{self.total}, elapsed {elapsed:.1f}s")
+        if progress_redis is None or not self.task_ids:
+            return
+        fields = {
+            "stage": self.stage,
+            "step": step,
+            "total": self.total,
+            "elapsed": round(elapsed, 2),
+            "eta": round(eta, 2) if eta is not None else "",
+            "updated": time.time(),
+        }
+        try:
+            pipe_ = progress_redis.pipeline()
+            for task_id in self.task_ids:
+                pipe_.hset(f"progress:{task_id}", mapping=fields)
+                pipe_.expire(f"progress:{task_id}", PROGRESS_TTL)
+                # 通知 backend 的 SSE 订阅者
+                pipe_.publish(f"task_events:{task_id}", "progress")
+            pipe_.execute()
+        except redis.RedisError as e:
+            # 进度上报失败不影响推理
+            logger.warning(f"Failed to publish progress: {e}")
+
+    def callback_on_step_end(self, pipeline, step_index, timestep, callback_kwargs):
+        self.publish(step_index + 1)
+        return callback_kwargs
@@ -0,0 +1,363 @@
+"""
+基于 ONNX Runtime 的 TTS 服务，加载 scripts/export_onnx_fish15.py 导出的三个计算图：
+
+- ref_audio_encoder.onnx：参考音频 → 参考特征（按 reference_id 缓存，只提取一次）
+- fish_speech_text2sem.onnx：文本 token + 参考特征 → 语义 token logits
+- firefly_gan.onnx：语义 token → 波形
+
+对外提供与 fish-speech 相同的 POST /v1/tts 接口（backend 的 voice_client.py 直接调用），
+可替换 fishaudio/fish-speech:server-cpu 容器，镜像只需 onnxruntime 而不需要 torch。
+"""
+import base64
+import io
+import logging
+import os
+import re
+import resource
+import struct
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import onnxruntime as ort
+import soundfile as sf
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+from pydantic import BaseModel
+
+app = FastAPI(title="Fish-Speech ONNX Runtime TTS")
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+MODEL_DIR = Path(os.getenv("MODEL_DIR", "/app/models"))
+REFERENCES_DIR = Path(os.getenv("REFERENCES_DIR", "/app/references"))
+TEXT2SEM_MODEL = os.getenv("TEXT2SEM_MODEL", "fish_speech_text2sem.onnx")
+VOCODER_MODEL = os.getenv("VOCODER_MODEL", "firefly_gan.onnx")
+REF_ENCODER_MODEL = os.getenv("REF_ENCODER_MODEL", "ref_audio_encoder.onnx")
+TOKENIZER_FILE = os.getenv("TOKENIZER_FILE", "tokenizer.tiktoken")
+
+SAMPLE_RATE = int(os.getenv("SAMPLE_RATE", 44100))  # 声码器输出采样率
+REFERENCE_SAMPLE_RATE = int(os.getenv("REFERENCE_SAMPLE_RATE", 24000))  # 参考编码器输入采样率
+MAX_REFERENCE_SECONDS = float(os.getenv("MAX_REFERENCE_SECONDS", 30))
+REFERENCE_CACHE_SIZE = int(os.getenv("REFERENCE_CACHE_SIZE", 64))
+
+# 线程调优：intra-op 用满分配给容器的核心；图内算子基本串行，inter-op 保持 1 即可
+ORT_INTRA_OP_THREADS = int(os.getenv("ORT_INTRA_OP_THREADS", os.cpu_count() or 1))
+ORT_INTER_OP_THREADS = int(os.getenv("ORT_INTER_OP_THREADS", 1))
+# 空闲时工作线程自旋等待会占满 CPU，与其他服务同机部署时建议关闭
+ORT_ALLOW_SPINNING = os.getenv("ORT_ALLOW_SPINNING", "false").lower() == "true"
+# 同时执行的合成请求数；每个请求已用满 intra-op 线程，并发只会互相争抢核心
+INFERENCE_CONCURRENCY = int(os.getenv("INFERENCE_CONCURRENCY", 1))
+
+# 可选 int8 动态量化：对列出的计算图使用 <name>.int8.onnx，不存在时启动时生成一次
+ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "none").lower()
+ONNX_QUANTIZE_GRAPHS = [g.strip() for g in os.getenv("ONNX_QUANTIZE_GRAPHS", "text2sem").split(",") if g.strip()]
+
+STREAM_CHUNK_SAMPLES = int(os.getenv("STREAM_CHUNK_SAMPLES", 8192))
+STREAMING_SIZE = 0xFFFFFFFF
+
+# Prometheus 指标（GET /metrics）
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+INFERENCE_SECONDS = Histogram("model_inference_seconds", "ONNX graph run time", ["stage"], buckets=LATENCY_BUCKETS)
+STEPS_PER_SECOND = Gauge("model_inference_steps_per_second", "Semantic tokens per second of the last sentence", ["stage"])
+ENCODE_SECONDS = Histogram("model_encode_seconds", "Time to convert waveforms to PCM16", buckets=LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram("model_request_seconds", "End-to-end /v1/tts latency", buckets=LATENCY_BUCKETS)
+CACHE_LOOKUPS = Counter("model_cache_lookups_total", "In-process cache lookups", ["cache", "result"])
+MODEL_LOAD_SECONDS = Gauge("model_load_seconds", "Duration of the last model load")
+Gauge("process_peak_resident_memory_bytes", "Peak resident set size").set_function(
+    lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+)
+
+_SENTENCE_END = re.compile(r'(?<=[。！？；!?;…\n])|(?<=\.)\s')
+
+
+class ServeTTSRequest(BaseModel):
+    """fish-speech /v1/tts 请求体中本服务用到的字段，其余字段忽略"""
+    text: str
+    reference_id: Optional[str] = None
+    reference_audio: Optional[str] = None  # base64 编码的参考音频（内联）
+    format: str = "wav"  # wav / pcm
+    streaming: bool = False
+    temperature: float = 0.7
+    top_p: float = 0.7
+    seed: Optional[int] = None
+
+
+def _model_path(name: str, graph: str) -> Path:
+    path = MODEL_DIR / name
+    if ONNX_QUANTIZE != "int8" or graph not in ONNX_QUANTIZE_GRAPHS:
+        return path
+    quantized = path.with_suffix(".int8.onnx")
+    if not quantized.exists():
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        logger.info(f"Quantizing {path.name} to int8 ...")
+        quantize_dynamic(str(path), str(quantized), weight_type=QuantType.QInt8)
+    return quantized
+
+
+def _session(name: str, graph: str) -> ort.InferenceSession:
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = ORT_INTRA_OP_THREADS
+    options.inter_op_num_threads = ORT_INTER_OP_THREADS
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    options.add_session_config_entry("session.intra_op.allow_spinning", "1" if ORT_ALLOW_SPINNING else "0")
+    path = _model_path(name, graph)
+    logger.info(f"Loading {path.name} (intra_op={ORT_INTRA_OP_THREADS}, inter_op={ORT_INTER_OP_THREADS})")
+    return ort.InferenceSession(str(path), sess_options=options, providers=["CPUExecutionProvider"])
+
+
+class Tokenizer:
+    """
+    优先使用导出时一并打包的 tokenizer.tiktoken；缺失时退化为 UTF-8 字节编码。
+    token id 必须落在 text2sem 图的词表范围内，否则说明分词器与导出的图不匹配。
+    """
+
+    PATTERN = r"""'(?i:[sdmt]|ll|ve|re)|[^\r\n\p{L}\p{N}]?+\p{L}+|\p{N}{1,3}| ?[^\s\p{L}\p{N}]++[\r\n]*|\s*[\r\n]|\s+(?!\S)|\s+"""
+
+    def __init__(self, path: Path, vocab_size: int):
+        self.vocab_size = vocab_size
+        self.encoding = None
+        if path.exists():
+            import tiktoken
+            from tiktoken.load import load_tiktoken_bpe
+            self.encoding = tiktoken.Encoding(
+                name="fish", pat_str=self.PATTERN, mergeable_ranks=load_tiktoken_bpe(str(path)), special_tokens={}
+            )
+        else:
+            logger.warning(f"{path} not found, falling back to UTF-8 byte tokens")
+
+    def encode(self, text: str) -> np.ndarray:
+        ids = self.encoding.encode(text) if self.encoding else list(text.encode("utf-8"))
+        tokens = np.asarray([ids], dtype=np.int64)
+        if tokens.size and tokens.max() >= self.vocab_size:
+            raise ValueError(
+                f"token id {tokens.max()} exceeds text2sem vocabulary ({self.vocab_size}); "
+                "tokenizer and exported graph do not match"
+            )
+        return tokens
+
+
+class OnnxTTS:
+    def __init__(self):
+        self.text2sem = _session(TEXT2SEM_MODEL, "text2sem")
+        self.vocoder = _session(VOCODER_MODEL, "vocoder")
+        self.ref_encoder = _session(REF_ENCODER_MODEL, "ref_encoder")
+        vocab_size = self.text2sem.get_outputs()[0].shape[-1]
+        self.vocab_size = vocab_size if isinstance(vocab_size, int) else 1029
+        self.tokenizer = Tokenizer(MODEL_DIR / TOKENIZER_FILE, self.vocab_size)
+        self.feature_dim = self.text2sem.get_inputs()[1].shape[-1]
+        self.references = OrderedDict()  # reference_id → 参考特征，LRU
+        self.references_lock = threading.Lock()
+        self.inference = threading.Semaphore(INFERENCE_CONCURRENCY)
+
+    # ---------------------------------------------------------------- 参考音色
+
+    def _encode_reference(self, audio: np.ndarray) -> np.ndarray:
+        waveform = audio[None, :].astype(np.float32)
+        with INFERENCE_SECONDS.labels("ref_encoder").time():
+            return self.ref_encoder.run(None, {"audio_waveform": waveform})[0].astype(np.float32)
+
+    def reference_features(self, reference_id: Optional[str], reference_audio: Optional[str]) -> np.ndarray:
+        if reference_audio:
+            return self._encode_reference(load_audio(base64.b64decode(reference_audio)))
+        if not reference_id:
+            # 无参考音色：使用空的参考特征
+            return np.zeros((1, 1, self.feature_dim), dtype=np.float32)
+
+        with self.references_lock:
+            if reference_id in self.references:
+                self.references.move_to_end(reference_id)
+                CACHE_LOOKUPS.labels("reference", "hit").inc()
+                return self.references[reference_id]
+        CACHE_LOOKUPS.labels("reference", "miss").inc()
+        path = reference_path(reference_id)
+        if path is None:
+            raise HTTPException(404, f"Reference {reference_id} not found")
+        features = self._encode_reference(load_audio(path.read_bytes()))
+        with self.references_lock:
+            self.references[reference_id] = features
+            while len(self.references) > REFERENCE_CACHE_SIZE:
+                self.references.popitem(last=False)
+        return features
+
+    # ---------------------------------------------------------------- 合成
+
+    def _semantic_logits(self, tokens: np.ndarray, reference: np.ndarray) -> np.ndarray:
+        """
+        text2sem 单次前向得到所有位置的 logits。
+        导出的图没有 past_key_values 输入输出，不存在逐步解码循环，用 IO binding 避免输入输出的额外拷贝。
+        """
+        binding = self.text2sem.io_binding()
+        binding.bind_ortvalue_input("text_tokens", ort.OrtValue.ortvalue_from_numpy(tokens))
+        binding.bind_ortvalue_input("reference_audio", ort.OrtValue.ortvalue_from_numpy(reference))
+        binding.bind_output("logits", "cpu")
+        self.text2sem.run_with_iobinding(binding)
+        return binding.copy_outputs_to_cpu()[0]
+
+    @staticmethod
+    def _sample(logits: np.ndarray, temperature: float, top_p: float, rng: np.random.Generator) -> np.ndarray:
+        logits = logits[0].astype(np.float64)
+        if temperature <= 0:
+            return logits.argmax(axis=-1)[None, :].astype(np.int64)
+        logits = logits / temperature
+        probs = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        probs /= probs.sum(axis=-1, keepdims=True)
+        # nucleus 采样：每个位置只保留累计概率达到 top_p 的候选
+        order = np.argsort(-probs, axis=-1)
+        sorted_probs = np.take_along_axis(probs, order, axis=-1)
+        keep = np.cumsum(sorted_probs, axis=-1) - sorted_probs < top_p
+        sorted_probs = np.where(keep, sorted_probs, 0.0)
+        sorted_probs /= sorted_probs.sum(axis=-1, keepdims=True)
+        picks = [rng.choice(order.shape[-1], p=p) for p in sorted_probs]
+        return order[np.arange(len(picks)), picks][None, :].astype(np.int64)
+
+    def synthesize(self, text: str, reference: np.ndarray, temperature: float, top_p: float, seed: Optional[int]):
+        """逐句合成，每句产出一段 float32 波形"""
+        rng = np.random.default_rng(seed)
+        for sentence in split_sentences(text):
+            tokens = self.tokenizer.encode(sentence)
+            with self.inference:
+                started = time.perf_counter()
+                codes = self._sample(self._semantic_logits(tokens, reference), temperature, top_p, rng)
+                elapsed = time.perf_counter() - started
+                INFERENCE_SECONDS.labels("text2sem").observe(elapsed)
+                STEPS_PER_SECOND.labels("text2sem").set(codes.shape[-1] / elapsed)
+                with INFERENCE_SECONDS.labels("vocoder").time():
+                    waveform = self.vocoder.run(None, {"codes": codes})[0]
+            yield np.asarray(waveform, dtype=np.float32).reshape(-1)
+
+
+def split_sentences(text: str):
+    return [s.strip() for s in _SENTENCE_END.split(text) if s and s.strip()] or [text]
+
+
+def reference_path(reference_id: str) -> Optional[Path]:
+    # reference_id 会拼进路径，只接受目录名形式
+    if not reference_id.replace("_", "").replace("-", "").isalnum():
+        return None
+    for suffix in (".wav", ".mp3", ".flac"):
+        path = REFERENCES_DIR / reference_id / f"reference{suffix}"
+        if path.exists():
+            return path
+    return None
+
+
+def load_audio(data: bytes) -> np.ndarray:
+    """解码为单声道 float32，并线性插值重采样到参考编码器的采样率"""
+    audio, rate = sf.read(io.BytesIO(data), dtype="float32", always_2d=True)
+    audio = audio.mean(axis=1)[:int(rate * MAX_REFERENCE_SECONDS)]
+    if rate != REFERENCE_SAMPLE_RATE:
+        target = int(len(audio) * REFERENCE_SAMPLE_RATE / rate)
+        audio = np.interp(np.linspace(0, len(audio) - 1, target), np.arange(len(audio)), audio).astype(np.float32)
+    return audio
+
+
+def to_pcm16(waveform: np.ndarray) -> bytes:
+    return (np.clip(waveform, -1.0, 1.0) * 32767).astype("<i2").tobytes()
+
+
+def wav_header(data_size: int) -> bytes:
+    return struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", min(36 + data_size, STREAMING_SIZE), b"WAVE",
+        b"fmt ", 16, 1, 1, SAMPLE_RATE, SAMPLE_RATE * 2, 2, 16,
+        b"data", data_size,
+    )
+
+
+tts: Optional[OnnxTTS] = None
+load_error: Optional[str] = None
+# 正在处理的合成请求数，供 backend 的副本路由参考
+in_flight = 0
+in_flight_lock = threading.Lock()
+Gauge("model_requests_in_flight", "Synthesis requests being processed").set_function(lambda: in_flight)
+
+
+def _load():
+    global tts, load_error
+    started = time.time()
+    try:
+        tts = OnnxTTS()
+        MODEL_LOAD_SECONDS.set(time.time() - started)
+        logger.info(f"ONNX models loaded in {time.time() - started:.1f}s")
+    except Exception as e:
+        logger.exception("Failed to load ONNX models")
+        load_error = str(e)
+
+
+# 后台加载，HTTP 服务立即可用，/health 报告 loading
+threading.Thread(target=_load, name="model-loader", daemon=True).start()
+
+
+@app.get("/v1/health")
+@app.get("/health")
+def health():
+    if load_error:
+        return JSONResponse({"status": "unhealthy", "error": load_error}, status_code=503)
+    return {
+        "status": "healthy" if tts else "loading",
+        "in_flight": in_flight,
+        "intra_op_threads": ORT_INTRA_OP_THREADS,
+        "inter_op_threads": ORT_INTER_OP_THREADS,
+        "quantize": ONNX_QUANTIZE,
+        "cached_references": len(tts.references) if tts else 0,
+    }
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def encode_pcm(waveform: np.ndarray) -> bytes:
+    with ENCODE_SECONDS.time():
+        return to_pcm16(waveform)
+
+
+@app.post("/v1/tts")
+def text_to_speech(req: ServeTTSRequest):
+    if tts is None:
+        raise HTTPException(503, load_error or "Models are still loading")
+    if req.format not in ("wav", "pcm"):
+        raise HTTPException(400, f"Unsupported format: {req.format}")
+    if not req.text.strip():
+        raise HTTPException(400, "Text is required")
+
+    media_type = "audio/wav" if req.format == "wav" else "audio/pcm"
+    started = time.perf_counter()
+    # 在构造响应之前解析参考音色：流式响应一旦开始就已发出 200，找不到参考音色时无法再返回 404
+    reference = tts.reference_features(req.reference_id, req.reference_audio)
+
+    def synthesize():
+        global in_flight
+        with in_flight_lock:
+            in_flight += 1
+        try:
+            yield from tts.synthesize(req.text, reference, req.temperature, req.top_p, req.seed)
+            REQUEST_SECONDS.observe(time.perf_counter() - started)
+        finally:
+            with in_flight_lock:
+                in_flight -= 1
+
+    if req.streaming:
+        def stream():
+            # 与 fish-speech 一致：先发长度占位的 WAV 头，再逐句发送 PCM
+            if req.format == "wav":
+                yield wav_header(STREAMING_SIZE)
+            for waveform in synthesize():
+                for start in range(0, len(waveform), STREAM_CHUNK_SAMPLES):
+                    yield encode_pcm(waveform[start:start + STREAM_CHUNK_SAMPLES])
+        return StreamingResponse(stream(), media_type=media_type)
+
+    try:
+        pcm = b"".join(encode_pcm(w) for w in synthesize())
+    except ValueError as e:
+        raise HTTPException(500, str(e))
+    body = wav_header(len(pcm)) + pcm if req.format == "wav" else pcm
+    return Response(content=body, media_type=media_type)
@@ -1,50 +1,270 @@
 from fastapi import FastAPI, HTTPException, Response
+from fastapi.responses import JSONResponse
 from diffusers import KandinskyV22Pipeline, KandinskyV22PriorPipeline
 import torch
 from PIL import Image
 import io
+import os
+import sys
+import hashlib
+import time
+import logging
+import threading
+from collections import OrderedDict
+from pathlib import Path
+import numpy as np
+import resource
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# 共享的模型运行时（services/common/runtime.py）：镜像内与 app.py 同目录，源码树中直接运行时从 services/common 导入
+sys.path.append(str(Path(__file__).resolve().parent.parent / "common"))
+from runtime import COMPILE, QUANTIZE, ModelManager, ProgressReporter, apply_cpu_mode, cpu_dtype
 
 app = FastAPI(title="Kandinsky 2.2 Image Generator")
 
-# 全局加载模型（首次启动慢，后续快）
-print("Loading Kandinsky 2.2 models...")
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 与 backend 共享的产物目录：请求携带 output_file 时直接写入该目录，只返回文件名
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/app/static/outputs")
+
+# 模型按需加载：启动时在后台预加载（MODEL_PRELOAD=false 则等首个请求），空闲超时后卸载
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "true").lower() == "true"
+MODEL_IDLE_UNLOAD = int(os.getenv("MODEL_IDLE_UNLOAD", 1800))  # 0 表示从不卸载
+MODEL_MMAP = os.getenv("MODEL_MMAP", "true").lower() == "true"
+WARM_POOL_WINDOW = int(os.getenv("WARM_POOL_WINDOW", 3600))
+WARM_POOL_MIN_REQUESTS = int(os.getenv("WARM_POOL_MIN_REQUESTS", 3))
+
+# Prometheus 指标（GET /metrics）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+INFERENCE_SECONDS = Histogram("model_inference_seconds", "Model forward time", ["stage"], buckets=LATENCY_BUCKETS)
+STEPS_PER_SECOND = Gauge("model_inference_steps_per_second", "Denoising steps per second of the last run", ["stage"])
+ENCODE_SECONDS = Histogram("model_encode_seconds", "Time to encode the output artifact", buckets=LATENCY_BUCKETS)
+WRITE_SECONDS = Histogram("model_write_seconds", "Time to write the output artifact", buckets=LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram("model_request_seconds", "End-to-end /generate latency", buckets=LATENCY_BUCKETS)
+CACHE_LOOKUPS = Counter("model_cache_lookups_total", "In-process cache lookups", ["cache", "result"])
+Gauge("process_peak_resident_memory_bytes", "Peak resident set size").set_function(
+    lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+)
+
+PRIOR_STEPS = 25
+PRIOR_GUIDANCE_SCALE = 4.0
+DECODER_STEPS = 20
+
+# prior 输出缓存：同一提示词只跑一次 prior，换种子 / 尺寸 / 步数时直接复用 image_embeds
+PRIOR_CACHE_SIZE = int(os.getenv("PRIOR_CACHE_SIZE", 256))  # 0 表示关闭
+PRIOR_CACHE_DIR = os.getenv("PRIOR_CACHE_DIR")  # 设置后同时以 .npz 落盘，重启后仍可命中
+
+
+class PriorCache:
+    """
+    Kandinsky prior 输出（image_embeds + negative_image_embeds）的 LRU 缓存。
+    键为规范化后的提示词与影响 prior 输出的参数；内存未命中时再查磁盘。
+    """
+
+    def __init__(self, max_entries, directory=None):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(prompt, steps, guidance_scale, dtype):
+        # CLIP 分词本身不区分大小写，多余空白也不影响结果
+        normalized = " ".join(prompt.lower().split())
+        raw = f"{normalized}|{steps}|{guidance_scale}|{dtype}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        if self.max_entries <= 0:
+            return None
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                CACHE_LOOKUPS.labels("prior", "hit").inc()
+                return self.entries[key]
+        embeds = self._load(key)
+        with self.lock:
+            if embeds is None:
+                self.misses += 1
+                CACHE_LOOKUPS.labels("prior", "miss").inc()
+                return None
+            self.disk_hits += 1
+            CACHE_LOOKUPS.labels("prior", "disk_hit").inc()
+            self._put(key, embeds)
+        return embeds
+
+    def put(self, key, image_embeds, negative_image_embeds):
+        if self.max_entries <= 0:
+            return
+        embeds = (image_embeds.detach().cpu(), negative_image_embeds.detach().cpu())
+        with self.lock:
+            self._put(key, embeds)
+        if self.directory:
+            path = os.path.join(self.directory, f"{key}.npz")
+            tmp = path + ".part.npz"
+            np.savez(tmp, image_embeds=embeds[0].float().numpy(), negative_image_embeds=embeds[1].float().numpy())
+            os.replace(tmp, path)
+
+    def _put(self, key, embeds):
+        self.entries[key] = embeds
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def _load(self, key):
+        if not self.directory:
+            return None
+        path = os.path.join(self.directory, f"{key}.npz")
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return (
+                torch.from_numpy(data["image_embeds"]).to(TORCH_DTYPE),
+                torch.from_numpy(data["negative_image_embeds"]).to(TORCH_DTYPE),
+            )
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.hits + self.disk_hits) / lookups, 3) if lookups else None,
+                "on_disk": bool(self.directory),
+            }
+
+
+TORCH_DTYPE = cpu_dtype()
+
 
-# Prior pipeline (text → image embedding)
-prior_pipe = KandinskyV22PriorPipeline.from_pretrained(
-    "kandinsky-community/kandinsky-2-2-prior",
-    torch_dtype=torch.float32,
-    use_safetensors=True
-).to("cpu")
+def load_pipelines():
+    """加载 prior + decoder；由 ModelManager 在后台线程中调用"""
+    logger.info(f"Loading Kandinsky 2.2 models with {TORCH_DTYPE}, quantize={QUANTIZE}, compile={COMPILE}...")
 
-# Decoder pipeline (embedding → image)
-decoder_pipe = KandinskyV22Pipeline.from_pretrained(
-    "kandinsky-community/kandinsky-2-2-decoder",
-    torch_dtype=torch.float32,
-    use_safetensors=True
-).to("cpu")
+    # Prior pipeline (text → image embedding)
+    prior_pipe = KandinskyV22PriorPipeline.from_pretrained(
+        "kandinsky-community/kandinsky-2-2-prior",
+        torch_dtype=TORCH_DTYPE,
+        use_safetensors=True,
+        low_cpu_mem_usage=MODEL_MMAP,
+    ).to("cpu")
 
+    # Decoder pipeline (embedding → image)
+    decoder_pipe = KandinskyV22Pipeline.from_pretrained(
+        "kandinsky-community/kandinsky-2-2-decoder",
+        torch_dtype=TORCH_DTYPE,
+        use_safetensors=True,
+        low_cpu_mem_usage=MODEL_MMAP,
+    ).to("cpu")
+
+    apply_cpu_mode(prior_pipe, ("text_encoder", "prior"), TORCH_DTYPE)
+    apply_cpu_mode(decoder_pipe, ("unet",), TORCH_DTYPE)
+    return prior_pipe, decoder_pipe
+
+
+models = ModelManager(
+    load_pipelines,
+    preload=MODEL_PRELOAD,
+    idle_unload=MODEL_IDLE_UNLOAD,
+    warm_window=WARM_POOL_WINDOW,
+    warm_min_requests=WARM_POOL_MIN_REQUESTS,
+)
+
+
+prior_cache = PriorCache(PRIOR_CACHE_SIZE, PRIOR_CACHE_DIR)
+Gauge("model_requests_in_flight", "Requests holding or waiting for the model").set_function(lambda: models.active)
+
+
+@app.get("/health")
+def health():
+    model = models.describe()
+    # 模型未加载（加载中或已空闲卸载）时服务仍可接收请求；只有加载失败才算不健康
+    status = {"ready": "healthy", "loading": "loading", "unloaded": "idle", "failed": "unhealthy"}[model["model_state"]]
+    return JSONResponse(
+        {"status": status, **model, "prior_cache": prior_cache.stats()},
+        status_code=503 if status == "unhealthy" else 200,
+    )
+
+
+@app.get("/metrics")
+def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
+def observe_inference(stage, steps, seconds):
+    INFERENCE_SECONDS.labels(stage).observe(seconds)
+    STEPS_PER_SECOND.labels(stage).set(steps / seconds)
+
+
+# 同步函数由 FastAPI 放入线程池执行，等待模型加载或推理时 /health 仍可响应
 @app.post("/generate")
-async def generate(payload: dict):
+def generate(payload: dict):
     prompt = payload.get("text", "").strip()
     if not prompt:
         raise HTTPException(status_code=400, detail="Text prompt is required")
 
+    task_id = payload.get("task_id")
+    request_started = time.perf_counter()
+
     try:
-        # Step 1: Generate image embedding from text
-        image_emb = prior_pipe(prompt).image_embeds
+        with models.acquire() as (prior_pipe, decoder_pipe):
+            # Step 1: Generate image embedding from text（相同提示词命中缓存时跳过 prior）
+            cache_key = PriorCache.key(prompt, PRIOR_STEPS, PRIOR_GUIDANCE_SCALE, TORCH_DTYPE)
+            embeds = prior_cache.get(cache_key)
+            if embeds is None:
+                prior_progress = ProgressReporter([task_id], "prior", PRIOR_STEPS)
+                prior_progress.publish(0)
+                started = time.perf_counter()
+                prior = prior_pipe(
+                    prompt,
+                    num_inference_steps=PRIOR_STEPS,
+                    guidance_scale=PRIOR_GUIDANCE_SCALE,
+                    callback_on_step_end=prior_progress.callback_on_step_end,
+                )
+                observe_inference("prior", PRIOR_STEPS, time.perf_counter() - started)
+                embeds = (prior.image_embeds, prior.negative_image_embeds)
+                prior_cache.put(cache_key, *embeds)
 
-        # Step 2: Decode embedding to image
-        image = decoder_pipe(
-            image_embeds=image_emb,
-            num_inference_steps=20,
-            height=768,
-            width=768,
-        ).images[0]
+            # Step 2: Decode embedding to image
+            decoder_progress = ProgressReporter([task_id], "decoder", DECODER_STEPS)
+            decoder_progress.publish(0)
+            started = time.perf_counter()
+            image = decoder_pipe(
+                image_embeds=embeds[0],
+                negative_image_embeds=embeds[1],
+                num_inference_steps=DECODER_STEPS,
+                height=768,
+                width=768,
+                callback_on_step_end=decoder_progress.callback_on_step_end,
+            ).images[0]
+            observe_inference("decoder", DECODER_STEPS, time.perf_counter() - started)
 
-        # Return as PNG
         buf = io.BytesIO()
-        image.save(buf, format='PNG')
-        buf.seek(0)
+        with ENCODE_SECONDS.time():
+            image.save(buf, format='PNG')
+
+        output_file = payload.get("output_file")
+        if output_file:
+            path = os.path.join(OUTPUT_DIR, os.path.basename(output_file))
+            with WRITE_SECONDS.time():
+                with open(path + ".part", "wb") as f:
+                    f.write(buf.getbuffer())
+                os.replace(path + ".part", path)
+            REQUEST_SECONDS.observe(time.perf_counter() - request_started)
+            return {"output_file": os.path.basename(path), "bytes": os.path.getsize(path)}
+
+        # Return as PNG
+        REQUEST_SECONDS.observe(time.perf_counter() - request_started)
         return Response(content=buf.getvalue(), media_type="image/png")
 
     except Exception as e:
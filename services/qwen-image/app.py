@@ -1,11 +1,22 @@
 from modelscope import DiffusionPipeline
 import torch
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify, send_file
 import os
 import io
+import sys
 from PIL import Image
 import logging
 import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+import resource
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+# 共享的模型运行时（services/common/runtime.py）：镜像内与 app.py 同目录，源码树中直接运行时从 services/common 导入
+sys.path.append(str(Path(__file__).resolve().parent.parent / "common"))
+from runtime import COMPILE, QUANTIZE, ModelManager, ProgressReporter, apply_cpu_mode, cpu_dtype
 
 app = Flask(__name__)
 
@@ -24,6 +35,40 @@ DEFAULT_STEPS = int(os.getenv("DEFAULT_STEPS", 50))
 DEFAULT_CFG_SCALE = float(os.getenv("DEFAULT_CFG_SCALE", 4.0))
 DEFAULT_SEED = int(os.getenv("DEFAULT_SEED", 42))
 
+# 微批调度：在 MAX_BATCH_WAIT_MS 窗口内收集参数相同的请求，合并为一次 pipe 调用
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", 4))
+MAX_BATCH_WAIT_MS = int(os.getenv("MAX_BATCH_WAIT_MS", 200))
+
+# 文本编码结果缓存：默认负向提示常驻，正向提示按 LRU 淘汰，总大小不超过 PROMPT_CACHE_MAX_MB
+DEFAULT_NEGATIVE_PROMPT = " "
+PROMPT_CACHE_MAX_MB = int(os.getenv("PROMPT_CACHE_MAX_MB", 512))  # 0 表示关闭
+
+# 与 backend 共享的产物目录：请求携带 output_file 时直接写入该目录，只返回文件名
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/app/static/outputs")
+
+# CPU 推理模式（TORCH_DTYPE / QUANTIZE / COMPILE）见 runtime.py；参与量化 / 编译的子模块
+OPTIMIZE_MODULES = ("text_encoder", "transformer")
+
+# 模型按需加载：启动时在后台预加载（MODEL_PRELOAD=false 则等首个请求），空闲超时后卸载
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "true").lower() == "true"
+MODEL_IDLE_UNLOAD = int(os.getenv("MODEL_IDLE_UNLOAD", 1800))  # 0 表示从不卸载
+MODEL_MMAP = os.getenv("MODEL_MMAP", "true").lower() == "true"
+WARM_POOL_WINDOW = int(os.getenv("WARM_POOL_WINDOW", 3600))
+WARM_POOL_MIN_REQUESTS = int(os.getenv("WARM_POOL_MIN_REQUESTS", 3))
+
+# Prometheus 指标（GET /metrics）
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200)
+INFERENCE_SECONDS = Histogram("model_inference_seconds", "Model forward time", ["stage"], buckets=LATENCY_BUCKETS)
+STEPS_PER_SECOND = Gauge("model_inference_steps_per_second", "Denoising steps per second of the last run", ["stage"])
+ENCODE_SECONDS = Histogram("model_encode_seconds", "Time to encode the output artifact", buckets=LATENCY_BUCKETS)
+WRITE_SECONDS = Histogram("model_write_seconds", "Time to write the output artifact", buckets=LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram("model_request_seconds", "End-to-end /generate latency", buckets=LATENCY_BUCKETS)
+BATCH_SIZE = Histogram("model_batch_size", "Requests merged into one pipeline call", buckets=(1, 2, 3, 4, 6, 8, 16))
+CACHE_LOOKUPS = Counter("model_cache_lookups_total", "In-process cache lookups", ["cache", "result"])
+Gauge("process_peak_resident_memory_bytes", "Peak resident set size").set_function(
+    lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+)
+
 # 正向提示增强
 POSITIVE_MAGIC = {
     "en": ", Ultra HD, 4K, cinematic composition.",
@@ -45,9 +90,9 @@ ASPECT_RATIOS = {
 
 # 确定设备和数据类型
 if DEVICE == "cpu" or not torch.cuda.is_available():
-    TORCH_DTYPE = torch.float32
     DEVICE = "cpu"
-    logger.info("Using CPU for inference with float32 precision")
+    TORCH_DTYPE = cpu_dtype()
+    logger.info(f"Using CPU for inference with {TORCH_DTYPE} precision, quantize={QUANTIZE}, compile={COMPILE}")
 else:
     # 检查设备是否支持bfloat16
     if torch.cuda.is_bf16_supported():
@@ -63,14 +108,15 @@ else:
         torch.cuda.set_device(int(device_idx))
     DEVICE = "cuda"
 
-# 加载模型
-logger.info(f"Loading Qwen-Image model with dtype={TORCH_DTYPE} on device={DEVICE}")
-
-try:
-    # 使用modelscope的DiffusionPipeline
+def load_pipeline():
+    """加载 Qwen-Image pipeline；由 ModelManager 在后台线程中调用"""
+    logger.info(f"Loading Qwen-Image model with dtype={TORCH_DTYPE} on device={DEVICE}")
+    # 使用modelscope的DiffusionPipeline；safetensors 权重按 mmap 方式加载，不额外复制一份到内存
     pipe = DiffusionPipeline.from_pretrained(
         model_name,
         torch_dtype=TORCH_DTYPE,
+        use_safetensors=MODEL_MMAP,
+        low_cpu_mem_usage=MODEL_MMAP,
     )
     
     # 移动到指定设备
@@ -79,7 +125,7 @@ try:
     # CPU优化
     if DEVICE == "cpu":
         logger.info("Applying CPU optimizations")
-        pipe.unet.to(memory_format=torch.channels_last)
+        apply_cpu_mode(pipe, OPTIMIZE_MODULES, TORCH_DTYPE)
     
     # 启用xformers内存高效注意力（如果可用）
     try:
@@ -92,22 +138,244 @@ try:
     pipe.enable_attention_slicing()
     logger.info("Enabled attention slicing for memory optimization")
     
+    if prompt_cache is not None:
+        prompt_cache.pin(pipe, DEFAULT_NEGATIVE_PROMPT)
+
     logger.info("Qwen-Image model loaded successfully")
-except Exception as e:
-    logger.error(f"Failed to load Qwen-Image model: {str(e)}")
-    logger.exception("Full traceback:")
-    raise
+    return pipe
+
+
+class PromptEmbeddingCache:
+    """
+    文本编码器输出（prompt_embeds + mask）的缓存，键为最终送入编码器的完整提示词。
+    钉住的条目（默认负向提示）不参与淘汰；其余按 LRU 淘汰，占用按张量字节数计算。
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.pinned = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _encode(pipe, prompt):
+        with INFERENCE_SECONDS.labels("text_encoder").time(), torch.inference_mode():
+            embeds, mask = pipe.encode_prompt(prompt=[prompt], device=DEVICE)
+        if mask is None:
+            mask = torch.ones(embeds.shape[:2], dtype=torch.long, device=embeds.device)
+        return embeds, mask
+
+    @staticmethod
+    def _size(entry):
+        return sum(t.numel() * t.element_size() for t in entry)
+
+    def pin(self, pipe, prompt):
+        """预先编码并常驻，模型卸载重载后仍然有效"""
+        if prompt not in self.pinned:
+            self.pinned[prompt] = self._encode(pipe, prompt)
+
+    def get(self, pipe, prompt):
+        with self.lock:
+            if prompt in self.pinned:
+                self.hits += 1
+                CACHE_LOOKUPS.labels("prompt_embeds", "hit").inc()
+                return self.pinned[prompt]
+            if prompt in self.entries:
+                self.entries.move_to_end(prompt)
+                self.hits += 1
+                CACHE_LOOKUPS.labels("prompt_embeds", "hit").inc()
+                return self.entries[prompt]
+            self.misses += 1
+            CACHE_LOOKUPS.labels("prompt_embeds", "miss").inc()
+        entry = self._encode(pipe, prompt)
+        size = self._size(entry)
+        if size > self.max_bytes:
+            return entry
+        with self.lock:
+            if prompt not in self.entries:
+                self.entries[prompt] = entry
+                self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= self._size(evicted)
+        return entry
+
+    def batch(self, pipe, prompts):
+        """逐条取缓存后按最长序列补零拼成一个批次（mask 补 0，编码器本身也是这样补齐的）"""
+        entries = [self.get(pipe, p) for p in prompts]
+        length = max(e[0].shape[1] for e in entries)
+        embeds = torch.cat([
+            torch.nn.functional.pad(e[0], (0, 0, 0, length - e[0].shape[1])) for e in entries
+        ])
+        masks = torch.cat([torch.nn.functional.pad(e[1], (0, length - e[1].shape[1])) for e in entries])
+        return embeds, masks
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "pinned": len(self.pinned),
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
+
+
+prompt_cache = PromptEmbeddingCache(PROMPT_CACHE_MAX_MB * 1024 * 1024) if PROMPT_CACHE_MAX_MB > 0 else None
+
+
+models = ModelManager(
+    load_pipeline,
+    preload=MODEL_PRELOAD,
+    idle_unload=MODEL_IDLE_UNLOAD,
+    warm_window=WARM_POOL_WINDOW,
+    warm_min_requests=WARM_POOL_MIN_REQUESTS,
+)
+
+class BatchScheduler:
+    """
+    收集可合并的请求（宽高/步数/cfg/负向提示一致），由单个后台线程串行执行。
+    每个请求保留自己的种子：以 generator 列表的形式传给 pipe。
+    """
+
+    def __init__(self, max_batch_size, max_wait_ms):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.pending = []
+        self.running = 0  # 正在推理的批次中的请求数
+        self.cond = threading.Condition()
+        # 同一时间只允许一次推理，避免多个线程争抢 CPU 核心和同一个 pipeline 对象
+        self.inference_lock = threading.Lock()
+        self.worker = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+        self.worker.start()
+
+    def submit(self, prompt, negative_prompt, width, height, steps, cfg_scale, seed, task_id=None):
+        item = {
+            "key": (width, height, steps, cfg_scale, negative_prompt),
+            "prompt": prompt,
+            "seed": seed,
+            "task_id": task_id,
+            "future": Future(),
+        }
+        with self.cond:
+            self.pending.append(item)
+            self.cond.notify()
+        return item["future"]
+
+    def queue_depth(self):
+        with self.cond:
+            return len(self.pending)
+
+    def in_flight(self):
+        with self.cond:
+            return self.running
+
+    def _take_batch(self):
+        with self.cond:
+            while not self.pending:
+                self.cond.wait()
+            first = self.pending.pop(0)
+            batch = [first]
+            deadline = time.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                compatible = [it for it in self.pending if it["key"] == first["key"]]
+                for it in compatible[:self.max_batch_size - len(batch)]:
+                    self.pending.remove(it)
+                    batch.append(it)
+                remaining = deadline - time.time()
+                if len(batch) >= self.max_batch_size or remaining <= 0:
+                    break
+                self.cond.wait(remaining)
+            return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            with self.cond:
+                self.running = len(batch)
+            try:
+                with self.inference_lock:
+                    images = self._infer(batch)
+                for item, image in zip(batch, images):
+                    item["future"].set_result(image)
+            except Exception as e:
+                for item in batch:
+                    if not item["future"].done():
+                        item["future"].set_exception(e)
+            finally:
+                with self.cond:
+                    self.running = 0
+
+    def _infer(self, batch):
+        width, height, steps, cfg_scale, negative_prompt = batch[0]["key"]
+        generators = [torch.Generator(device=DEVICE).manual_seed(it["seed"]) for it in batch]
+        logger.info(f"Running batch of {len(batch)} at {width}x{height}, steps={steps}, cfg_scale={cfg_scale}")
+        # 同一批次的所有任务共享同一条推理进度
+        reporter = ProgressReporter([it["task_id"] for it in batch], "image", steps)
+        reporter.publish(0)
+        BATCH_SIZE.observe(len(batch))
+        with models.acquire() as pipe:
+            if prompt_cache is not None:
+                # 直接传入缓存的文本编码结果，跳过文本编码器
+                prompt_embeds, prompt_mask = prompt_cache.batch(pipe, [it["prompt"] for it in batch])
+                negative_embeds, negative_mask = prompt_cache.batch(pipe, [negative_prompt] * len(batch))
+                prompt_args = {
+                    "prompt_embeds": prompt_embeds,
+                    "prompt_embeds_mask": prompt_mask,
+                    "negative_prompt_embeds": negative_embeds,
+                    "negative_prompt_embeds_mask": negative_mask,
+                }
+            else:
+                prompt_args = {
+                    "prompt": [it["prompt"] for it in batch],
+                    "negative_prompt": [negative_prompt] * len(batch),
+                }
+            started = time.perf_counter()
+            result = pipe(
+                **prompt_args,
+                width=width,
+                height=height,
+                num_inference_steps=steps,
+                true_cfg_scale=cfg_scale,  # Qwen-Image特有的参数
+                generator=generators,
+                callback_on_step_end=reporter.callback_on_step_end
+            )
+            elapsed = time.perf_counter() - started
+        INFERENCE_SECONDS.labels("denoise").observe(elapsed)
+        STEPS_PER_SECOND.labels("denoise").set(steps / elapsed)
+        return result.images
+
+
+scheduler = BatchScheduler(MAX_BATCH_SIZE, MAX_BATCH_WAIT_MS)
+Gauge("model_requests_in_flight", "Requests in the running batch").set_function(scheduler.in_flight)
+Gauge("model_queue_depth", "Requests waiting for a batch").set_function(scheduler.queue_depth)
 
 @app.route('/health', methods=['GET'])
 def health_check():
+    model = models.describe()
+    # 模型未加载（加载中或已空闲卸载）时服务仍可接收请求；只有加载失败才算不健康
+    status = {"ready": "healthy", "loading": "loading", "unloaded": "idle", "failed": "unhealthy"}[model["model_state"]]
     return jsonify({
-        "status": "healthy",
+        "status": status,
+        **model,
         "device": DEVICE,
         # "model_path": MODEL_PATH,
         "dtype": str(TORCH_DTYPE),
         "supported_aspect_ratios": list(ASPECT_RATIOS.keys()),
+        "max_batch_size": MAX_BATCH_SIZE,
+        "max_batch_wait_ms": MAX_BATCH_WAIT_MS,
+        # backend 的副本路由按 in_flight + queue_depth 选择负载最低的副本
+        "in_flight": scheduler.in_flight(),
+        "queue_depth": scheduler.queue_depth(),
+        "prompt_cache": prompt_cache.stats() if prompt_cache is not None else None,
         "memory_allocated": f"{torch.cuda.memory_allocated() / 1024**3:.2f} GB" if DEVICE != "cpu" else "N/A"
-    })
+    }), 503 if status == "unhealthy" else 200
 
 @app.route('/generate', methods=['POST'])
 def generate_image():
@@ -120,7 +388,7 @@ def generate_image():
     # 获取请求参数
     prompt = data.get('prompt', '')
     aspect_ratio = data.get('aspect_ratio', '16:9')
-    negative_prompt = data.get('negative_prompt', " ")
+    negative_prompt = data.get('negative_prompt', DEFAULT_NEGATIVE_PROMPT)
     steps = int(data.get('steps', DEFAULT_STEPS))
     cfg_scale = float(data.get('cfg_scale', DEFAULT_CFG_SCALE))
     seed = int(data.get('seed', DEFAULT_SEED))
@@ -152,32 +420,37 @@ def generate_image():
     logger.info(f"Generating image with prompt: '{prompt}' at {width}x{height}, steps={steps}, cfg_scale={cfg_scale}, seed={seed}")
     
     try:
-        # 创建生成器
-        generator = torch.Generator(device=DEVICE).manual_seed(seed)
-        
-        # 生成图像 - 包含Qwen-Image特有的参数
-        result = pipe(
-            prompt=prompt,
-            negative_prompt=negative_prompt,
-            width=width,
-            height=height,
-            num_inference_steps=steps,
-            true_cfg_scale=cfg_scale,  # Qwen-Image特有的参数
-            generator=generator
+        # 交给调度器，与同参数的并发请求合并推理
+        future = scheduler.submit(
+            prompt, negative_prompt, width, height, steps, cfg_scale, seed,
+            task_id=data.get('task_id')
         )
-        
-        image = result.images[0]
-        
-        # 保存到内存
+        image = future.result()
+
+        # 先编码到内存，编码与写盘分别计时
         img_io = io.BytesIO()
-        image.save(img_io, 'PNG')
-        img_io.seek(0)
+        with ENCODE_SECONDS.time():
+            image.save(img_io, 'PNG')
+        
+        output_file = data.get('output_file')
+        if output_file:
+            # 写入共享目录，避免 PNG 经 HTTP 再被 backend 缓冲一遍
+            path = os.path.join(OUTPUT_DIR, os.path.basename(output_file))
+            tmp_path = path + ".part"
+            with WRITE_SECONDS.time():
+                with open(tmp_path, 'wb') as f:
+                    f.write(img_io.getbuffer())
+                os.replace(tmp_path, path)
+            response = jsonify({"output_file": os.path.basename(path), "bytes": os.path.getsize(path)})
+        else:
+            img_io.seek(0)
+            response = send_file(img_io, mimetype='image/png')
         
         elapsed = time.time() - start_time
+        REQUEST_SECONDS.observe(elapsed)
         logger.info(f"Image generated successfully in {elapsed:.2f} seconds")
         
         # 添加性能指标到响应头
-        response = send_file(img_io, mimetype='image/png')
         response.headers['X-Generation-Time'] = f"{elapsed:.2f}"
         response.headers['X-Resolution'] = f"{width}x{height}"
         response.headers['X-Steps'] = str(steps)
@@ -190,6 +463,10 @@ def generate_image():
             "hint": "Check model loading and ensure you have sufficient memory"
         }), 500
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(generate_latest(), mimetype=CONTENT_TYPE_LATEST)
+
 @app.route('/aspect_ratios', methods=['GET'])
 def get_aspect_ratios():
     """返回支持的宽高比列表及其对应分辨率"""
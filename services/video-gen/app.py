@@ -1,69 +1,372 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import FileResponse, JSONResponse, Response
+from starlette.background import BackgroundTask
 from pydantic import BaseModel
 from diffusers import DiffusionPipeline
 import torch
 import numpy as np
-from moviepy.editor import ImageSequenceClip
 import os
-from pathlib import Path
-from typing import List
+import sys
+import shutil
+import subprocess
 import tempfile
+import logging
+from pathlib import Path
+from typing import Optional
+import uuid
+import math
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import requests
+import resource
+from prometheus_client import CONTENT_TYPE_LATEST, Gauge, Histogram, generate_latest
+
+# 共享的模型运行时（services/common/runtime.py）：镜像内与 app.py 同目录，源码树中直接运行时从 services/common 导入
+sys.path.append(str(Path(__file__).resolve().parent.parent / "common"))
+from runtime import ModelManager, ProgressReporter
+from render import (
+    ENCODE_WORKERS, GOP_SECONDS, CHUNK_GOPS, KENBURNS_FPS, FFmpegPipeWriter, render_kenburns_chunk,
+)
 
 app = FastAPI(title="Text2Video-Zero Service")
 
-# 初始化模型（CPU 版本）
-print("Loading Text2Video-Zero model...")
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# 与 backend 共享的产物目录：请求携带 output_file 时直接写入该目录，只返回文件名
+OUTPUT_DIR = os.getenv("OUTPUT_DIR", "/app/static/outputs")
+os.makedirs(OUTPUT_DIR, exist_ok=True)
+
+# 分段生成：每段固定帧数，相邻段之间重叠 OVERLAP_FRAMES 帧，
+# 下一段的重叠帧以上一段末尾的潜变量为条件去噪（见 TailConditioning）。
+# 内存占用只与单段帧数有关，与视频总时长无关。
+SEGMENT_FRAMES = int(os.getenv("SEGMENT_FRAMES", 24))
+OVERLAP_FRAMES = int(os.getenv("OVERLAP_FRAMES", 4))
+
+# image_url / audio_url 为 /outputs/... 的相对地址时，先在共享目录中查找，找不到再从 backend 下载
+BACKEND_BASE_URL = os.getenv("BACKEND_BASE_URL", "http://backend:8000")
+
+# Prometheus 指标（GET /metrics）
+LATENCY_BUCKETS = (0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200)
+INFERENCE_SECONDS = Histogram("model_inference_seconds", "Model forward time", ["stage"], buckets=LATENCY_BUCKETS)
+STEPS_PER_SECOND = Gauge(
+    "model_inference_steps_per_second", "Denoising steps (diffusion) or rendered frames (kenburns) per second", ["stage"]
+)
+ENCODE_SECONDS = Histogram("model_encode_seconds", "Time to render / encode video chunks", ["mode"], buckets=LATENCY_BUCKETS)
+WRITE_SECONDS = Histogram("model_write_seconds", "Time to concatenate, mux and move the output", ["mode"], buckets=LATENCY_BUCKETS)
+REQUEST_SECONDS = Histogram("model_request_seconds", "End-to-end /generate latency", ["mode"], buckets=LATENCY_BUCKETS)
+Gauge("process_peak_resident_memory_bytes", "Peak resident set size").set_function(
+    lambda: resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+)
+DIFFUSION_STEPS = 20
+
+# 模型按需加载：默认的 kenburns 模式不需要扩散模型，因此默认不预加载，首个 diffusion 请求时再加载
+MODEL_PRELOAD = os.getenv("MODEL_PRELOAD", "false").lower() == "true"
+MODEL_IDLE_UNLOAD = int(os.getenv("MODEL_IDLE_UNLOAD", 900))  # 0 表示从不卸载
+MODEL_MMAP = os.getenv("MODEL_MMAP", "true").lower() == "true"
+WARM_POOL_WINDOW = int(os.getenv("WARM_POOL_WINDOW", 3600))
+WARM_POOL_MIN_REQUESTS = int(os.getenv("WARM_POOL_MIN_REQUESTS", 3))
 model_id = "cerspense/zeroscope_v2_576w"
-pipe = DiffusionPipeline.from_pretrained(model_id)
-pipe.to("cpu")  # 强制使用 CPU 推理
+
+def load_pipeline():
+    """加载 zeroscope（CPU 版本）；由 ModelManager 在后台线程中调用"""
+    logger.info("Loading Text2Video-Zero model...")
+    pipe = DiffusionPipeline.from_pretrained(model_id, low_cpu_mem_usage=MODEL_MMAP)
+    pipe.to("cpu")  # 强制使用 CPU 推理
+    return pipe
+
+models = ModelManager(
+    load_pipeline,
+    preload=MODEL_PRELOAD,
+    idle_unload=MODEL_IDLE_UNLOAD,
+    warm_window=WARM_POOL_WINDOW,
+    warm_min_requests=WARM_POOL_MIN_REQUESTS,
+)
+
+# 正在处理的 /generate 请求数，供 backend 的副本路由参考
+in_flight = 0
+in_flight_lock = threading.Lock()
+Gauge("model_requests_in_flight", "Requests being processed").set_function(lambda: in_flight)
 
 class VideoRequest(BaseModel):
-    prompt: str
+    prompt: Optional[str] = None  # diffusion 模式必填
+    image_url: Optional[str] = None  # kenburns 模式的静态图片
+    audio_url: Optional[str] = None  # kenburns 模式的旁白，视频时长与其对齐
+    mode: Optional[str] = None  # kenburns / diffusion；缺省时有图片则走 kenburns
     duration: float = 10.0  # 默认持续时间为 10 秒
-    fps: int = 8  # 帧率，默认为 8 FPS
+    fps: int = 8  # 帧率，默认为 8 FPS（仅 diffusion 模式）
+    seed: int = 42
+    output_file: Optional[str] = None  # 提供时写入共享目录，否则以文件流返回
+    task_id: Optional[str] = None  # 推理进度写入 Redis 时使用的键
 
-@app.post("/generate")
-async def generate_video(req: VideoRequest):
+def encode_frames(frames: np.ndarray, path, fps, threads=1):
+    started = time.perf_counter()
+    writer = FFmpegPipeWriter(path, frames.shape[2], frames.shape[1], fps, threads=threads)
+    try:
+        writer.write(frames)
+    finally:
+        writer.close()
+    ENCODE_SECONDS.labels("diffusion").observe(time.perf_counter() - started)
+    return path
+
+def concat_segments(paths, output_path, audio_path=None):
+    """用 concat demuxer 无损拼接各段（视频流复制，不重新编码），可同时封装音频"""
+    list_file = Path(paths[0]).with_name("segments.txt")
+    list_file.write_text("".join(f"file '{p}'\n" for p in paths))
+    audio_args = []
+    if audio_path:
+        audio_args = ["-i", str(audio_path), "-map", "0:v", "-map", "1:a", "-c:a", "aac", "-shortest"]
+    subprocess.run(
+        [
+            "ffmpeg", "-y", "-loglevel", "error",
+            "-f", "concat", "-safe", "0", "-i", str(list_file),
+            *audio_args,
+            "-c:v", "copy", "-movflags", "+faststart",
+            str(output_path),
+        ],
+        check=True,
+    )
+
+def to_uint8(frames) -> np.ndarray:
+    """一次性把 [0,1] 浮点帧批量转换为 (N, H, W, 3) uint8"""
+    frames = np.asarray(frames, dtype=np.float32)
+    return (np.clip(frames, 0.0, 1.0) * 255).round().astype(np.uint8)
+
+def crossfade(tail: np.ndarray, head: np.ndarray) -> np.ndarray:
+    """上一段末尾与下一段开头的重叠帧做线性混合（两者已在潜空间对齐，这里只抹平解码差异）"""
+    weights = np.linspace(0.0, 1.0, len(tail) + 2, dtype=np.float32)[1:-1, None, None, None]
+    return (tail * (1.0 - weights) + head * weights).round().astype(np.uint8)
+
+class TailConditioning:
     """
-    Generate a video from text prompt.
-    
-    Parameters:
-    - prompt: The text description of the video.
-    - duration: Duration of the video in seconds (default 10).
-    - fps: Frames per second (default 8).
+    段间衔接（时间维 inpainting）：下一段开头 overlap 帧的潜变量在每一步去噪后都替换为
+    上一段末尾 overlap 帧的干净潜变量按下一个时间步加噪的结果，最后一步替换为干净潜变量本身；
+    其余帧经 UNet3D 的时间注意力与这几帧对齐，内容与运动从上一段延续下来，而不是各段独立生成。
+    解码后的重叠帧仍做一次 crossfade，只用于抹平逐帧 VAE 解码的细微差异。
     """
-    try:
-        # 计算需要生成的帧数
-        num_frames = int(req.duration * req.fps)
 
-        # 使用 Text2Video-Zero 生成帧序列
-        frames = pipe(
-            prompt=req.prompt,
-            num_inference_steps=20,  # 调整步数以平衡速度和质量
-            num_frames=num_frames,
-            guidance_scale=9.0
-        ).frames[0]
+    def __init__(self, pipe, overlap: int):
+        self.pipe = pipe
+        self.overlap = overlap
+        self.tail = None   # 上一段末尾 overlap 帧的干净潜变量 (1, C, overlap, H, W)
+        self.noise = None  # 本段重叠帧使用的固定噪声
+
+    def _noised(self, timesteps):
+        return self.pipe.scheduler.add_noise(self.tail, self.noise, timesteps)
+
+    def initial_latents(self, generator, num_frames: int) -> torch.Tensor:
+        """按管线默认分辨率生成初始噪声，第一段之外把重叠帧换成加噪到首个时间步的上一段尾部"""
+        pipe = self.pipe
+        size = pipe.unet.config.sample_size
+        shape = (1, pipe.unet.config.in_channels, num_frames, size, size)
+        latents = torch.randn(shape, generator=generator, dtype=pipe.unet.dtype)
+        if self.tail is not None:
+            # 与管线内部一致的时间步表（管线调用时会以同样参数再设置一次）
+            pipe.scheduler.set_timesteps(DIFFUSION_STEPS)
+            self.noise = latents[:, :, :self.overlap].clone()
+            latents[:, :, :self.overlap] = self._noised(pipe.scheduler.timesteps[:1])
+        return latents / pipe.scheduler.init_noise_sigma
+
+    def step(self, step: int, latents: torch.Tensor):
+        """每步去噪后由管线回调；latents 即管线下一步使用的张量，原地写入即生效"""
+        timesteps = self.pipe.scheduler.timesteps
+        if self.tail is not None:
+            upcoming = timesteps[step + 1:step + 2]
+            latents[:, :, :self.overlap] = self._noised(upcoming) if len(upcoming) else self.tail
+        if step == len(timesteps) - 1 and self.overlap:
+            self.tail = latents[:, :, -self.overlap:].clone()
+
+
+def generate_segmented(req: VideoRequest, output_path: Path):
+    """
+    逐段生成并编码：每段 SEGMENT_FRAMES 帧，相邻段重叠 overlap 帧，
+    下一段的重叠帧以上一段末尾的潜变量为条件（TailConditioning），重叠部分在像素域再混合一次后只写入一份。
+    """
+    total_frames = max(1, int(req.duration * req.fps))
+    overlap = min(OVERLAP_FRAMES, SEGMENT_FRAMES // 2)
+    step = SEGMENT_FRAMES - overlap
+    num_segments = max(1, -(-(total_frames - overlap) // step))
+    # 总步数 = 段数 × 每段去噪步数，ETA 覆盖整个视频而非单段
+    total_steps = num_segments * DIFFUSION_STEPS
+    reporter = ProgressReporter([req.task_id], "diffusion", total_steps)
+    reporter.publish(0)
+
+    # 编码由 ffmpeg 子进程完成，线程只负责喂数据；下一段的推理与上一段的编码同时进行
+    with models.acquire() as pipe, \
+            tempfile.TemporaryDirectory(dir=OUTPUT_DIR) as tmpdir, \
+            ThreadPoolExecutor(max_workers=ENCODE_WORKERS) as encoders:
+        encodes = []
+        tail = None
+        written = 0
+        conditioning = TailConditioning(pipe, overlap)
+
+        def on_step(step, t, latents, done):
+            conditioning.step(step, latents)
+            reporter.publish(done + step + 1)
+
+        for i in range(num_segments):
+            generator = torch.Generator(device="cpu").manual_seed(req.seed + i)
+            done = i * DIFFUSION_STEPS
+            segment_started = time.perf_counter()
+            frames = to_uint8(pipe(
+                prompt=req.prompt,
+                num_inference_steps=DIFFUSION_STEPS,  # 调整步数以平衡速度和质量
+                num_frames=SEGMENT_FRAMES,
+                guidance_scale=9.0,
+                latents=conditioning.initial_latents(generator, SEGMENT_FRAMES),
+                output_type="np",
+                callback=lambda step, t, latents, done=done: on_step(step, t, latents, done),
+                callback_steps=1,
+            ).frames[0])
+            elapsed = time.perf_counter() - segment_started
+            INFERENCE_SECONDS.labels("diffusion").observe(elapsed)
+            STEPS_PER_SECOND.labels("diffusion").set(DIFFUSION_STEPS / elapsed)
+
+            if tail is not None:
+                frames[:len(tail)] = crossfade(tail, frames[:len(tail)])
+            last = i == num_segments - 1
+            if not last and overlap:
+                # 末尾的重叠帧留到下一段混合后再写
+                tail = frames[-overlap:].copy()
+                frames = frames[:-overlap]
+            frames = frames[:total_frames - written]
+
+            path = Path(tmpdir) / f"segment_{i:05d}.mp4"
+            encodes.append(encoders.submit(encode_frames, frames, path, req.fps))
+            written += len(frames)
+
+            logger.info(f"Segment {i + 1}/{num_segments} generated ({written}/{total_frames} frames)")
+            del frames
+
+        segment_paths = [f.result() for f in encodes]
+        with WRITE_SECONDS.labels("diffusion").time():
+            if len(segment_paths) == 1:
+                shutil.move(str(segment_paths[0]), output_path)
+            else:
+                concat_segments(segment_paths, output_path)
+
+def fetch_input(url: str, workdir: str) -> Path:
+    """解析 backend 传来的产物地址：优先直接读共享目录，避免再走一次 HTTP"""
+    if url.startswith("/outputs/"):
+        local = Path(OUTPUT_DIR) / url[len("/outputs/"):]
+        if local.resolve().is_relative_to(Path(OUTPUT_DIR).resolve()) and local.exists():
+            return local
+        url = BACKEND_BASE_URL + url
+    dest = Path(workdir) / os.path.basename(url.split("?", 1)[0])
+    with requests.get(url, stream=True, timeout=(10, 300)) as response:
+        response.raise_for_status()
+        with open(dest, "wb") as f:
+            shutil.copyfileobj(response.raw, f)
+    return dest
+
+def probe_duration(path: Path) -> float:
+    out = subprocess.run(
+        ["ffprobe", "-v", "error", "-show_entries", "format=duration", "-of", "csv=p=0", str(path)],
+        check=True, capture_output=True, text=True,
+    )
+    return float(out.stdout.strip())
+
+def render_kenburns(req: VideoRequest, output_path: Path):
+    """
+    静态图片 + 旁白：时间轴按 GOP 对齐切块，各块在进程池中并行渲染、编码，
+    最后流复制拼接并封装音频；时长与音频对齐。
+    """
+    with tempfile.TemporaryDirectory(dir=OUTPUT_DIR) as workdir:
+        image_path = fetch_input(req.image_url, workdir)
+        audio_path = fetch_input(req.audio_url, workdir) if req.audio_url else None
+        duration = probe_duration(audio_path) if audio_path else req.duration
 
-        # 将帧转换为 PIL 图像列表
-        pil_images = [torch_to_pil(frame) for frame in frames]
+        fps = KENBURNS_FPS
+        total_frames = max(1, math.ceil(duration * fps))
+        chunk_frames = max(1, round(GOP_SECONDS * fps)) * CHUNK_GOPS
+        chunks = [(s, min(s + chunk_frames, total_frames)) for s in range(0, total_frames, chunk_frames)]
+        started = time.time()
+        reporter = ProgressReporter([req.task_id], "render", total_frames, started)
+        reporter.publish(0)
 
-        # 使用 MoviePy 创建视频剪辑
-        with tempfile.TemporaryDirectory() as tmpdir:
-            output_path = Path(tmpdir) / f"video_{hash(req.prompt)}{req.duration}.mp4"
-            clip = ImageSequenceClip(pil_images, fps=req.fps)
-            clip.write_videofile(str(output_path), codec="libx264", audio=False)
+        written = 0
+        paths = [str(Path(workdir) / f"chunk_{n:05d}.mp4") for n in range(len(chunks))]
+        # spawn 启动：本进程有模型管理与编码线程，fork 可能在子进程中留下被持有的锁
+        with ProcessPoolExecutor(max_workers=ENCODE_WORKERS, mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = [
+                pool.submit(render_kenburns_chunk, str(image_path), start, end, path)
+                for (start, end), path in zip(chunks, paths)
+            ]
+            for future in futures:
+                written += future.result()
+                reporter.publish(written)
+        # 渲染与编码在子进程中同时进行，只能按整体计时
+        elapsed = time.time() - started
+        ENCODE_SECONDS.labels("kenburns").observe(elapsed)
+        STEPS_PER_SECOND.labels("kenburns").set(total_frames / elapsed)
+        ProgressReporter([req.task_id], "mux", 1).publish(0)
+        with WRITE_SECONDS.labels("kenburns").time():
+            concat_segments(paths, output_path, audio_path=audio_path)
 
-            # 返回视频文件路径
-            return {"video_url": str(output_path)}
+@app.get("/health")
+def health():
+    model = models.describe()
+    # kenburns 模式不依赖扩散模型，模型未加载不影响服务可用；只有加载失败才算不健康
+    status = {"ready": "healthy", "loading": "loading", "unloaded": "healthy", "failed": "unhealthy"}[model["model_state"]]
+    with in_flight_lock:
+        model["in_flight"] = in_flight
+    return JSONResponse({"status": status, **model}, status_code=503 if status == "unhealthy" else 200)
+
+@app.get("/metrics")
+def metrics():
+    return Response(content=generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+@app.post("/generate")
+def generate_video(req: VideoRequest):
+    """
+    Generate a video.
+
+    Modes:
+    - kenburns (default when image_url is given): pan/zoom over the still image,
+      muxed with audio_url; duration follows the audio length.
+    - diffusion: text-to-video from prompt with zeroscope (opt-in, much slower).
+
+    Parameters:
+    - prompt: The text description of the video (diffusion).
+    - image_url / audio_url: Still image and narration (kenburns).
+    - duration: Duration of the video in seconds (default 10, ignored when audio is given).
+    - fps: Frames per second for diffusion (default 8).
+    """
+    mode = req.mode or ("kenburns" if req.image_url else "diffusion")
+    if mode == "kenburns" and not req.image_url:
+        raise HTTPException(status_code=400, detail="image_url is required for kenburns mode")
+    if mode == "diffusion" and not req.prompt:
+        raise HTTPException(status_code=400, detail="prompt is required for diffusion mode")
+    if mode not in ("kenburns", "diffusion"):
+        raise HTTPException(status_code=400, detail=f"Unknown mode: {mode}")
+
+    global in_flight
+    with in_flight_lock:
+        in_flight += 1
+    request_started = time.perf_counter()
+    name = os.path.basename(req.output_file or f"video_{uuid.uuid4().hex}.mp4")
+    output_path = Path(OUTPUT_DIR) / name
+    tmp_path = output_path.with_name(f".part_{name}")
+    try:
+        if mode == "kenburns":
+            render_kenburns(req, tmp_path)
+        else:
+            # 分段生成，每段帧直接送入 ffmpeg 编码，再拼接到共享目录
+            generate_segmented(req, tmp_path)
+        os.replace(tmp_path, output_path)
+        REQUEST_SECONDS.labels(mode).observe(time.perf_counter() - request_started)
+
+        if req.output_file:
+            return {"output_file": name, "bytes": output_path.stat().st_size}
+        # 未共享目录时以文件流返回（由 sendfile 发送，不经 Python 缓冲）
+        return FileResponse(output_path, media_type="video/mp4", background=BackgroundTask(output_path.unlink))
 
     except Exception as e:
+        # 半成品在共享卷中，失败时删除，避免残留的 .part_* 文件堆积
+        tmp_path.unlink(missing_ok=True)
         raise HTTPException(status_code=500, detail=f"Video generation failed: {str(e)}")
-
-def torch_to_pil(tensor_image):
-    """Converts a PyTorch tensor image to a PIL Image."""
-    image_np = (tensor_image.cpu().numpy() * 255).astype(np.uint8)
-    if image_np.shape[0] == 1:
-        image_np = np.squeeze(image_np, axis=0)
-    elif image_np.shape[0] == 3:
-        image_np = np.moveaxis(image_np, 0, -1)
-    return Image.fromarray(image_np)
\ No newline at end of file
+    finally:
+        with in_flight_lock:
+            in_flight -= 1
@@ -0,0 +1,114 @@
+"""
+不依赖 torch 的帧渲染与编码：ffmpeg 管道写入、Ken Burns 平移缩放。
+
+kenburns 渲染在进程池中并行执行，子进程以 spawn 方式启动并只导入本模块，
+不会继承 app.py 进程中的模型加载 / 卸载线程、编码线程池以及 torch / OpenMP 的锁状态，
+也不会再加载一遍扩散模型。
+"""
+import math
+import os
+import subprocess
+
+import numpy as np
+from PIL import Image
+
+# 图片 + 音频的平移缩放（Ken Burns）渲染参数
+KENBURNS_WIDTH = int(os.getenv("KENBURNS_WIDTH", 1280))
+KENBURNS_HEIGHT = int(os.getenv("KENBURNS_HEIGHT", 720))
+KENBURNS_FPS = int(os.getenv("KENBURNS_FPS", 25))
+KENBURNS_ZOOM = float(os.getenv("KENBURNS_ZOOM", 1.15))  # 最大放大倍数
+KENBURNS_CYCLE = float(os.getenv("KENBURNS_CYCLE", 20.0))  # 一次推拉的周期（秒）
+
+# 编码参数：按 GOP 对齐切块后在多个核心上并行编码，再无损拼接
+ENCODE_PRESET = os.getenv("ENCODE_PRESET", "veryfast")
+ENCODE_CRF = int(os.getenv("ENCODE_CRF", 23))
+ENCODE_WORKERS = int(os.getenv("ENCODE_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+GOP_SECONDS = float(os.getenv("GOP_SECONDS", 2.0))
+CHUNK_GOPS = int(os.getenv("CHUNK_GOPS", 5))  # kenburns 模式每个并行块包含的 GOP 数
+
+
+class FFmpegPipeWriter:
+    """把 uint8 RGB 帧直接写入 ffmpeg 的 stdin 进行编码，不在内存中保留整段视频"""
+
+    def __init__(self, path, width, height, fps, audio_path=None, threads=0):
+        audio_args = []
+        if audio_path:
+            # 同时封装旁白音频，以较短的一路为准
+            audio_args = ["-i", str(audio_path), "-map", "0:v", "-map", "1:a", "-c:a", "aac", "-shortest"]
+        # 固定 GOP 且关闭场景切换插入关键帧，保证各块的关键帧间隔一致，拼接后播放/拖动正常
+        gop = max(1, round(GOP_SECONDS * fps))
+        self.proc = subprocess.Popen(
+            [
+                "ffmpeg", "-y", "-loglevel", "error",
+                "-f", "rawvideo", "-pix_fmt", "rgb24",
+                "-s", f"{width}x{height}", "-r", str(fps),
+                "-i", "-",
+                *audio_args,
+                "-c:v", "libx264", "-pix_fmt", "yuv420p",
+                "-preset", ENCODE_PRESET, "-crf", str(ENCODE_CRF),
+                "-g", str(gop), "-keyint_min", str(gop), "-sc_threshold", "0",
+                "-threads", str(threads),
+                str(path),
+            ],
+            stdin=subprocess.PIPE,
+        )
+
+    def write(self, frames: np.ndarray):
+        self.proc.stdin.write(np.ascontiguousarray(frames).tobytes())
+
+    def close(self):
+        self.proc.stdin.close()
+        if self.proc.wait() != 0:
+            raise RuntimeError(f"ffmpeg exited with code {self.proc.returncode}")
+
+def cover_crop(image: np.ndarray, width: int, height: int) -> np.ndarray:
+    """按输出宽高比居中裁剪，保证任何缩放下画面都被填满"""
+    h, w = image.shape[:2]
+    target = width / height
+    if w / h > target:
+        new_w = int(h * target)
+        x0 = (w - new_w) // 2
+        return image[:, x0:x0 + new_w]
+    new_h = int(w / target)
+    y0 = (h - new_h) // 2
+    return image[y0:y0 + new_h]
+
+def kenburns_frame(image: Image.Image, zoom: float, cx: float, cy: float, width: int, height: int) -> np.ndarray:
+    """
+    对原图做轴对齐的缩放 + 平移仿射变换，双线性采样出一帧。
+    cx / cy 为取景窗口中心在原图中的相对位置（0~1）。
+    采样由 PIL 的 C 实现完成，1280x720 每帧约 40ms，比逐像素的 NumPy gather 快约 5 倍。
+    """
+    w, h = image.size
+    view_w, view_h = w / zoom, h / zoom
+    left = min(max(cx * w - view_w / 2, 0), w - view_w)
+    top = min(max(cy * h - view_h / 2, 0), h - view_h)
+    frame = image.transform(
+        (width, height),
+        Image.AFFINE,
+        (view_w / width, 0, left, 0, view_h / height, top),
+        resample=Image.BILINEAR,
+    )
+    return np.asarray(frame)
+
+def kenburns_motion(i: int, fps: int):
+    """第 i 帧的缩放与取景中心；只依赖帧号，各块可独立计算"""
+    t = i / fps
+    cycle, phase = divmod(t / KENBURNS_CYCLE, 1.0)
+    # 余弦缓动：每个周期内先推近再拉远，平移方向按周期交替
+    ease = (1 - math.cos(2 * math.pi * phase)) / 2
+    zoom = 1.0 + (KENBURNS_ZOOM - 1.0) * ease
+    direction = 1 if int(cycle) % 2 == 0 else -1
+    return zoom, 0.5 + direction * 0.08 * ease, 0.5 - direction * 0.04 * ease
+
+def render_kenburns_chunk(image_path: str, start: int, end: int, path: str):
+    """在独立进程中渲染 [start, end) 帧并编码为一个块；块边界与 GOP 对齐"""
+    width, height, fps = KENBURNS_WIDTH, KENBURNS_HEIGHT, KENBURNS_FPS
+    image = Image.fromarray(cover_crop(np.asarray(Image.open(image_path).convert("RGB")), width, height))
+    writer = FFmpegPipeWriter(path, width, height, fps, threads=1)
+    try:
+        for i in range(start, end):
+            writer.write(kenburns_frame(image, *kenburns_motion(i, fps), width, height))
+    finally:
+        writer.close()
+    return end - start